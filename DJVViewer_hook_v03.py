@@ -5,6 +5,9 @@ by Joshua Krause
 This Ftrack Connect hook registers DJV View with Ftrack. 
 When run with an image sequence asset selected, DJV View opens the asset.
 If an inappropriate object is selected, the DJV View application launches with no file.
+DJV View is searched for on macOS, Windows and Linux, and the result is cached.
+Sequences open with their frame range and can be prefetched to a local cache
+first, see SDE_DJV_PREFETCH and hookLib.frameCache.
 '''
 
 import logging
@@ -12,10 +15,40 @@ import getpass
 import sys
 import pprint
 import os
+import re
+import json
+
+try:
+	from distutils.version import LooseVersion
+except ImportError:
+	LooseVersion = None
 
 import ftrack
 import ftrack_connect.application
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from hookLib import copyEngine
+from hookLib import instrument
+from hookLib import sequenceScanner
+from hookLib import sessionProvider
+from hookLib.frameCache import frames
+from hookLib import STATE_FOLDER
+from hookLib.serverLinks import serverLinks, ServerLinkError
+
+# Asset type opened with its server link.
+SEQUENCE_TYPE = 'img'
+
+def sequenceName(value):
+	'''
+	Returns DJV View's name for a sequence value, e.g. "shot.1001-1240.exr" for "shot.%04d.exr [1001-1240]".
+	'''
+	found = sequenceScanner.VALUE_PATTERN.match(value)
+	padding = int(found.group('padding'))
+	return '{0}{1}-{2}{3}'.format(
+		found.group('head'), found.group('first').zfill(padding), found.group('last').zfill(padding), found.group('tail')
+	)
+
 
 class DJVViewerAction(object):
 	'''
@@ -36,6 +69,7 @@ class DJVViewerAction(object):
 		
 		self.applicationStore = applicationStore
 		self.launcher = launcher
+		self._items = None
 		
 		if self.identifier is None:
 			raise ValueError('The action must be given an identifier.')
@@ -58,35 +92,41 @@ class DJVViewerAction(object):
 			self.launch
 		)
 		
+	@instrument.entryPoint('djv.discover')
 	def discover(self, event):
 		''' 
 		Returns a list of applicable applications and their accompanying attributes, such as label, version, etc. 
 		'''
-		items = []
-		applications = self.applicationStore.applications
-		applications = sorted(
-			applications, key=lambda application: application['label']
-		)
-		
-		for application in applications:
-			applicationIdentifier = application['identifier']
-			label = application['label']
-			items.append({
-				'actionIdentifier': self.identifier,
-				'label': label,
-				'variant': application.get('variant', None),
-				'description': application.get('description', None),
-				'icon': application.get('icon', 'default'),
-				'applicationIdentifier': applicationIdentifier
-			})
-			
 		selection = event['data'].get('selection', [])
-		entityType = selection[0]['entityType']
-		if len(selection) == 1 and entityType == 'assetversion':	
+		if len(selection) == 1 and selection[0]['entityType'] == 'assetversion':	
 			return {
-				'items': items
+				'items': self.items
 			}
+			
+	@property
+	def items(self):
+		'''
+		The discover items, built once from the application store.
+		'''
+		if self._items is None:
+			items = []
+			applications = sorted(
+				self.applicationStore.applications, key=lambda application: application['label']
+			)
+			
+			for application in applications:
+				items.append({
+					'actionIdentifier': self.identifier,
+					'label': application['label'],
+					'variant': application.get('variant', None),
+					'description': application.get('description', None),
+					'icon': application.get('icon', 'default'),
+					'applicationIdentifier': application['identifier']
+				})
+			self._items = items
+		return self._items
 		
+	@instrument.entryPoint('djv.launch')
 	def launch(self, event):
 		''' 
 		Passes launch information to the launcher.
@@ -102,7 +142,6 @@ class DJVViewerAction(object):
 		context = event['data'].copy()
 		context['source'] = event['source']
 		if context['selection'][0]['entityType'] == 'asset_version' or context['selection'][0]['entityType'] == 'assetversion':
-			assetVersion = ftrack.AssetVersion(context['selection'][0]['entityId'])
 			context['selection'] = [{'entityId': context['selection'][0]['entityId'], 'entityType': context['selection'][0]['entityType']}]
 			
 		return self.launcher.launch(application_identifier, context)
@@ -110,43 +149,136 @@ class DJVViewerAction(object):
 class ApplicationStore(ftrack_connect.application.ApplicationStore):
 	'''
 	Store used to find and keep track of available applications.
+	The applications found are kept in a cache file and reused as long as the
+	executables and the folders searched have not changed.
 	'''
 	
+	# Where the discovered applications are remembered between runs.
+	cachePath = os.path.join(STATE_FOLDER, 'djvApplications.json')
+	
 	def _discoverApplications(self):
 		'''
 		Return a list of applications that can be launched from this host.
 		'''
-		applications = []
-		if sys.platform == 'darwin':
-			prefix = ['/', 'Applications']
+		applications = self._loadCache()
+		if applications is None:
+			applications = self._searchApplications()
+			self._saveCache(applications)
 			
-			applications.extend(self._searchFilesystem(
-				expression=prefix + [
-					'DJVViewer*', 'djv_view.app'
-				],
-				label='DJV View',
-				applicationIdentifier='djv_view'
-			))
+		self.logger.debug(
+			'Discovered applications:\n{0}'.format(
+				pprint.pformat(applications)
+			)
+		)
+		return applications
+		
+	def _searchRoots(self):
+		'''
+		Return the folders searched on this platform as (prefix, expression) pairs.
+		'''
+		if sys.platform == 'darwin':
+			return [(['/', 'Applications'], ['DJVViewer*', 'djv_view.app'])]
 		elif sys.platform == 'win32':
-			prefix = ['C:\\', 'Program Files.*']
-
+			return [(['C:\\', 'Program Files.*'], ['djv-1.1.0-Windows-64', 'bin', 'djv_view.exe'])]
+		elif sys.platform.startswith('linux'):
+			return [
+				(['/', 'opt'], ['djv.*', 'bin', 'djv_view']),
+				(['/', 'usr', 'local'], ['djv.*', 'bin', 'djv_view'])
+			]
+		return []
+		
+	def _searchApplications(self):
+		'''
+		Search the filesystem for the applications.
+		'''
+		applications = []
+		for prefix, expression in self._searchRoots():
 			applications.extend(self._searchFilesystem(
-				expression=(
-					prefix +
-					['djv-1.1.0-Windows-64', 'bin', 'djv_view.exe']
-				),
+				expression=prefix + expression,
 				label='DJV View',
 				applicationIdentifier='djv_view'
 			))
+		return applications
+		
+	def _fingerprint(self, paths):
+		'''
+		Return the modification time of each path, None for missing paths.
+		Search roots are included so a new installation invalidates the cache.
+		'''
+		roots = []
+		for prefix, expression in self._searchRoots():
+			root = os.path.join(*prefix)
+			# Expand "Program Files.*" to the folders it matches.
+			parent, pattern = os.path.split(root)
+			if os.path.isdir(parent) and not os.path.isdir(root):
+				roots.extend(os.path.join(parent, name) for name in os.listdir(parent) if re.match(pattern + '$', name))
+			else:
+				roots.append(root)
+				
+		fingerprint = {}
+		for path in roots + list(paths):
+			try:
+				fingerprint[path] = os.path.getmtime(path)
+			except OSError:
+				fingerprint[path] = None
+		return fingerprint
+		
+	def _loadCache(self):
+		'''
+		Return the cached applications, or None if the cache is missing or stale.
+		'''
+		try:
+			with open(self.cachePath) as cacheFile:
+				cache = json.load(cacheFile)
+		except (IOError, ValueError):
+			return None
+		
+		applications = cache.get('applications', [])
+		if cache.get('platform') != sys.platform:
+			return None
+		if self._fingerprint(application['path'] for application in applications) != cache.get('fingerprint'):
+			self.logger.debug('Application cache {0} is out of date.'.format(self.cachePath))
+			return None
 			
-		self.logger.debug(
-			'Discovered applications:\n{0}'.format(
-				pprint.pformat(applications)
-			)
-		)
+		for application in applications:
+			if LooseVersion is not None and application.get('version') is not None:
+				application['version'] = LooseVersion(application['version'])
 		return applications
 		
+	def _saveCache(self, applications):
+		'''
+		Write the applications and the fingerprint they were found with to the cache.
+		'''
+		serialisable = []
+		for application in applications:
+			application = dict(application)
+			if application.get('version') is not None:
+				application['version'] = str(application['version'])
+			serialisable.append(application)
+		cache = {
+			'platform': sys.platform,
+			'fingerprint': self._fingerprint(application['path'] for application in applications),
+			'applications': serialisable
+		}
+		try:
+			folder = os.path.dirname(self.cachePath)
+			if not os.path.isdir(folder):
+				os.makedirs(folder)
+			with open(self.cachePath, 'w') as cacheFile:
+				json.dump(cache, cacheFile, indent=1)
+		except (IOError, OSError, TypeError):
+			self.logger.exception('Failed to write application cache {0}.'.format(self.cachePath))
+			
 class ApplicationLauncher(ftrack_connect.application.ApplicationLauncher):
+	'''
+	Launches DJV View with the selected version's file.
+	'''
+	
+	# Open sequences with their frame range rather than the raw link.
+	launchSequences = True
+	
+	# Frames copied to the local frame cache before DJV View starts, 0 to play from the server.
+	prefetchFrames = int(os.environ.get('SDE_DJV_PREFETCH', 0))
 	
 	def _getApplicationLaunchCommand(self, application, context=None):
 		'''
@@ -158,38 +290,62 @@ class ApplicationLauncher(ftrack_connect.application.ApplicationLauncher):
 		
 		# Figure out if the command should be started with a file path.
 		if command is not None and context is not None:
-			# If our selection is an asset_version and its type is an image sequence, get its component.
+			# If our selection is an asset_version and its type is an image sequence, get its server link.
 			selection = context['selection'][0]
 			if selection['entityType'] == 'asset_version' or selection['entityType'] == 'assetversion':
 				self.logger.debug(u'Launching action with context {0!r}'.format(context))
-				try:
-					entityId = selection['entityId']
-					aVersion = ftrack.AssetVersion(entityId)
-					if aVersion.getAsset().getType().getShort() == 'img':
-						component = None
-						try:
-							components = aVersion.getComponents()
-							for c in components:
-								if c.getName() == 'Server link':
-									component = c
-						except:
-							pass
-
-						# If we have a component, append its path to the command.
-						if component:
-							path = component.getFilesystemPath()
-							self.logger.info(u'Launching application with file {0!r}'.format(path))
-							command = command + ' ' + path
-						else:
-							self.logger.warning(
-								'Unable to find an appropriate component when '
-								'launching with latest version.'
-							)
-				except:
-					pass
+				path = self._serverLink(selection['entityId'])
+				if path:
+					path = self._launchPath(path)
+					self.logger.info(u'Launching application with file {0!r}'.format(path))
+					if ' ' in path:
+						path = '"{0}"'.format(path)
+					command = command + ' ' + path
 					
 		return command
 		
+	def _launchPath(self, path):
+		'''
+		Returns the path to open in DJV View. Sequences linked as "name.%04d.exr [1001-1240]"
+		are opened as "name.1001-1240.exr", from the local frame cache when prefetching is on.
+		Links without a frame range, e.g. "name.%04d.exr", get the range of the frames on disk.
+		'''
+		folder, value = os.path.split(path)
+		if not self.launchSequences:
+			return path
+		if sequenceScanner.parseValue(value) is None:
+			value = sequenceScanner.rangedValue(folder, value)
+			if value is None:
+				return path
+		
+		if self.prefetchFrames > 0:
+			try:
+				with instrument.phase(instrument.COPY):
+					folder = frames.prefetch(folder, value, self.prefetchFrames)
+			except (copyEngine.CopyError, IOError, OSError):
+				self.logger.exception('Failed to prefetch {0}, playing it from the server.'.format(path))
+		return os.path.join(folder, sequenceName(value))
+		
+	def _serverLink(self, versionId):
+		'''
+		Returns the path of the version's 'Server link' component, or None when
+		the version is not an image sequence or has no link.
+		'''
+		try:
+			with sessionProvider.session() as session:
+				return serverLinks.resolve(session, versionId, assetType=SEQUENCE_TYPE)['path']
+		except ServerLinkError as error:
+			if error.reason == ServerLinkError.MISSING:
+				self.logger.warning(
+					'Unable to find an appropriate component when '
+					'launching with version {0}: {1}'.format(versionId, error)
+				)
+			else:
+				self.logger.debug(str(error))
+		except Exception:
+			self.logger.exception('Failed to look up the server link of version {0}.'.format(versionId))
+		return None
+		
 def register(registry, **kw):
 	'''
 	Register action in Connect.
@@ -207,6 +363,8 @@ def register(registry, **kw):
 		)
 		return
 		
+	instrument.countLegacyApi(ftrack)
+	instrument.serveMetrics()
 	applicationStore = ApplicationStore()
 	
 	launcher = ApplicationLauncher(applicationStore)
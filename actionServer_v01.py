@@ -0,0 +1,228 @@
+'''
+Headless action server hosting the hooks for the whole studio.
+
+Registers Output Manager, Transfer File and the status toggler of
+changeStatus_v01 for every user, so one process answers all workstations
+instead of each artist's Connect running its own copy. Every user shares
+the process' session and its shot path, listing, selection, server link and
+status caches, so most launches find them warm.
+
+Discover events are answered on the event hub thread, they only need the
+selection cache. Launches are handed to a pool of workers and answered with
+publishReply, one user's launches in the order they were made. Update
+events go to the status toggler's own workers and also drop the cached
+names and paths of the tasks and projects they touch.
+
+	python actionServer_v01.py --workers 8 --status-workers 4
+
+With SDE_METRICS_PORT set, /metrics and /health are served on that port.
+SIGHUP reloads: queued launches are finished, then the shared session, the
+status workers' sessions and every cache are dropped. SIGTERM and SIGINT stop
+once queued launches are done, uploads and notifications still queued resume
+on the next start.
+
+Remove Output Manager and Transfer File from the workstations' Connect
+plug-in folders, or every launch would be answered twice. The DJV View hook
+stays on the workstations, it starts a viewer on the artist's machine.
+'''
+
+import sys
+import os
+import logging
+import argparse
+import signal
+import threading
+import time
+from collections import OrderedDict
+
+path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ftrack-api')
+sys.path.append(path)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import ftrack
+
+import changeStatus_v01
+import outputManagerHook_v04
+import transferFileHook_v05
+from hookLib import executor
+from hookLib import instrument
+from hookLib import metrics
+from hookLib import sessionProvider
+from hookLib.dispatcher import EventDispatcher
+from hookLib.launchStore import launchKey
+from hookLib.listingCache import listings
+from hookLib.selectionInfo import selections
+from hookLib.serverLinks import serverLinks
+from hookLib.shotPaths import resolver
+from hookLib.statusRegistry import StatusRegistry
+
+# Seconds the event hub is waited on before checking for a reload or stop.
+HUB_WAIT = 1.0
+
+# Seconds queued launches are given to finish on reload and stop.
+DRAIN_TIMEOUT = 120.0
+
+def userKey(event):
+	# Launches are routed by user, so a form is always built before its submit is handled.
+	return launchKey(event)[0]
+
+class ActionServer(object):
+	'''
+	Hosts the actions for every user and routes their launches to workers.
+	'''
+
+	def __init__(self, workers=8, queueSize=1000, statusWorkers=4):
+		super(ActionServer, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+		self.actions = OrderedDict()
+		for action in (outputManagerHook_v04.OutputManager(), transferFileHook_v05.TransferFile()):
+			self.actions[action.identifier] = action
+		self.dispatcher = EventDispatcher(self.handle, workers=workers, queueSize=queueSize, keyFunction=userKey, name='actionServer')
+
+		self.toggler = None
+		if statusWorkers > 0:
+			self.toggler = changeStatus_v01.PooledToggler(
+				StatusRegistry(sessionProvider.createSession()), workers=statusWorkers, queueSize=queueSize
+			)
+
+		self.queueSize = queueSize
+		self.started = None
+		self.lastEvent = None
+		self._reloading = threading.Event()
+		self._stopping = threading.Event()
+
+	def start(self):
+		# Resume the actions' queues, start the workers and subscribe for all users.
+		for action in self.actions.values():
+			action.start()
+		self.dispatcher.start()
+		ftrack.EVENT_HUB.subscribe('topic=ftrack.action.discover', self.discover)
+		for identifier in self.actions:
+			ftrack.EVENT_HUB.subscribe('topic=ftrack.action.launch and data.actionIdentifier={0}'.format(identifier), self.launch)
+		if self.toggler is not None:
+			self.toggler.start()
+		ftrack.EVENT_HUB.subscribe('topic=ftrack.update', self.update)
+
+		instrument.addHealthCheck('eventHub', self.checkEventHub)
+		instrument.addHealthCheck('launches', lambda: self.checkDispatcher(self.dispatcher))
+		if self.toggler is not None:
+			instrument.addHealthCheck('statuses', lambda: self.checkDispatcher(self.toggler.dispatcher))
+		instrument.serveMetrics()
+		self.started = time.time()
+		instrument.log('actionServer.started', actions=sorted(self.actions), workers=self.dispatcher.workers)
+
+	def serve(self):
+		# Handle events until stop is requested, reloading in between when asked to.
+		while not self._stopping.is_set():
+			ftrack.EVENT_HUB.wait(HUB_WAIT)
+			if self._reloading.is_set():
+				self._reloading.clear()
+				self.reload()
+		self.stop()
+
+	def requestReload(self, *args):
+		self._reloading.set()
+
+	def requestStop(self, *args):
+		self._stopping.set()
+
+	def discover(self, event):
+		# Each action answers for itself. Only the selection cache is used, so this stays on the hub thread.
+		self.lastEvent = time.time()
+		items = []
+		for action in self.actions.values():
+			result = action.discover(event)
+			if result:
+				items.extend(result['items'])
+		if items:
+			return {'items': items}
+
+	def launch(self, event):
+		# Runs on the hub thread, so only queue the launch. The worker replies.
+		self.lastEvent = time.time()
+		metrics.increment('actionServer.launches')
+		if not self.dispatcher.dispatch(event):
+			return {'success': False, 'message': 'The action server is busy, please try again.'}
+
+	def handle(self, event):
+		action = self.actions[event['data']['actionIdentifier']]
+		try:
+			result = action.launch(event)
+		except Exception as error:
+			self.logger.exception('{0} failed to handle launch {1}.'.format(action.identifier, event.get('id')))
+			result = {'success': False, 'message': 'The action failed: {0}'.format(error)}
+		if result is not None:
+			ftrack.EVENT_HUB.publishReply(event, data=result)
+
+	def update(self, event):
+		# Keep the shared caches in step with the server, then let the status toggler have the event.
+		self.lastEvent = time.time()
+		for entity in event['data'].get('entities', []):
+			entityType = entity.get('entityType', '').lower()
+			if entityType == 'task':
+				selections.invalidate(entity.get('entityId'))
+				resolver.invalidate(taskId=entity.get('entityId'))
+			elif entityType == 'show':
+				resolver.invalidate(projectId=entity.get('entityId'))
+		if self.toggler is not None:
+			self.toggler.callback(event)
+
+	def reload(self):
+		# Finish what is queued, then start over with a fresh session and empty caches.
+		self.logger.info('Reloading.')
+		if not self.dispatcher.drain(DRAIN_TIMEOUT):
+			self.logger.warning('Launches still running after {0} seconds, reloading anyway.'.format(DRAIN_TIMEOUT))
+		sessionProvider.reset()
+		listings.invalidate()
+		selections.invalidate()
+		serverLinks.invalidate()
+		resolver.invalidate()
+		if self.toggler is not None:
+			self.toggler.reset()
+		metrics.increment('actionServer.reloads')
+		instrument.log('actionServer.reloaded')
+
+	def stop(self):
+		# Finish the queued launches and status updates. Uploads and notifications are kept on disk.
+		self.logger.info('Stopping.')
+		self.dispatcher.stop(DRAIN_TIMEOUT)
+		if self.toggler is not None:
+			self.toggler.dispatcher.stop(DRAIN_TIMEOUT)
+		transferFileHook_v05.notifier.flush()
+		executor.shutdown()
+		sessionProvider.reset()
+		instrument.log('actionServer.stopped', seconds=time.time() - (self.started or time.time()))
+
+	def checkEventHub(self):
+		connected = getattr(ftrack.EVENT_HUB, 'connected', True)
+		detail = 'connected' if connected else 'disconnected'
+		if self.lastEvent is not None:
+			detail += ', last event {0:.0f} seconds ago'.format(time.time() - self.lastEvent)
+		return connected, detail
+
+	def checkDispatcher(self, dispatcher):
+		# Healthy while every worker runs and the queues are not close to full.
+		alive = dispatcher.alive()
+		depth = dispatcher.queueDepth()
+		healthy = alive == dispatcher.workers and depth < self.queueSize * 0.9
+		return healthy, '{0} of {1} workers running, {2} events queued'.format(alive, dispatcher.workers, depth)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--workers', type=int, default=8, help='Launches handled at once.')
+	parser.add_argument('--queue-size', type=int, default=1000, help='Events the workers may have waiting before the hub blocks.')
+	parser.add_argument('--status-workers', type=int, default=4, help='Threads toggling task statuses, 0 leaves that to a separate changeStatus_v01.')
+	arguments = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO)
+	ftrack.setup()
+	instrument.countLegacyApi(ftrack)
+
+	server = ActionServer(workers=arguments.workers, queueSize=arguments.queue_size, statusWorkers=arguments.status_workers)
+	signal.signal(signal.SIGTERM, server.requestStop)
+	signal.signal(signal.SIGINT, server.requestStop)
+	if hasattr(signal, 'SIGHUP'):
+		signal.signal(signal.SIGHUP, server.requestReload)
+	server.start()
+	server.serve()
@@ -0,0 +1,187 @@
+'''
+Action Hook Benchmark
+
+Drives discover and launch of the Output Manager, Transfer File and DJV View
+hooks against the fake server in fakeFtrack, with the hooks' project and
+transfer roots redirected to a temporary directory. Every OUT folder is
+filled with the given number of files, mostly as 100 frame sequences.
+
+	python benchmarks/benchActionHooks.py --files 10 1000 100000 --output results.json
+
+Each step runs once with the hooks' caches cleared and once warm, and
+reports wall time, API calls and peak memory. Results are written as JSON
+so runs can be compared between revisions.
+'''
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from benchmarks import fakeFtrack
+from benchmarks.benchStatusHook import revision
+
+# Frames per sequence in the generated OUT folders.
+SEQUENCE_LENGTH = 100
+
+
+class Event(dict):
+	'''
+	Action event as handed to the hooks by the event hub.
+	'''
+
+	def stop(self):
+		self['stopped'] = True
+
+
+def fillOutFolder(folder, count):
+	# count empty files, in sequences of SEQUENCE_LENGTH frames with the remainder as movies.
+	if not os.path.isdir(folder):
+		os.makedirs(folder)
+	sequences = count // SEQUENCE_LENGTH
+	for sequence in range(sequences):
+		for frame in range(SEQUENCE_LENGTH):
+			open(os.path.join(folder, 'comp_v{0:03d}.{1:04d}.exr'.format(sequence + 1, 1001 + frame)), 'w').close()
+	for index in range(count - sequences * SEQUENCE_LENGTH):
+		open(os.path.join(folder, 'review_v{0:03d}.mov'.format(index + 1)), 'w').close()
+
+
+def measure(fn):
+	# (result, seconds, peak bytes) of calling fn.
+	if tracemalloc is not None:
+		tracemalloc.start()
+	started = time.time()
+	result = fn()
+	seconds = time.time() - started
+	peak = None
+	if tracemalloc is not None:
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+	else:
+		try:
+			import resource
+			peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+		except ImportError:
+			pass
+	return result, seconds, peak
+
+
+def clearCaches():
+	from hookLib.listingCache import listings
+	from hookLib.selectionInfo import selections
+	from hookLib.serverLinks import serverLinks
+	from hookLib.shotPaths import resolver
+	listings.invalidate()
+	selections.invalidate()
+	serverLinks.invalidate()
+	resolver.invalidate()
+
+
+def run(arguments):
+	workFolder = tempfile.mkdtemp(prefix='sde_bench_')
+	os.environ['SDE_HOOKS_STATE'] = os.path.join(workFolder, 'state')
+	os.environ['SDE_TRACE_LOG'] = os.path.join(workFolder, 'state', 'trace.jsonl')
+	projectRoot = os.path.join(workFolder, 'projects') + os.sep
+	transferRoot = os.path.join(workFolder, 'transfer') + os.sep
+
+	server = fakeFtrack.FakeServer(latency=arguments.latency)
+	fakeFtrack.install(server)
+	graph = fakeFtrack.buildGraph(server, acts=1, shots=arguments.shots)
+	tasks = graph['Task']
+	fakeFtrack.DiskAccessor.ROOTS = {'Z:/projects/': projectRoot, 'Y:/': transferRoot}
+
+	import outputManagerHook_v04
+	import transferFileHook_v05
+	import DJVViewer_hook_v03
+	from hookLib import metrics
+
+	outputManagerHook_v04.OutputManager.projectRoot = projectRoot
+	transferFileHook_v05.TransferFile.source_root = projectRoot
+	transferFileHook_v05.TransferFile.destination_root = transferRoot
+	outputManager = outputManagerHook_v04.OutputManager()
+	transferFile = transferFileHook_v05.TransferFile()
+	store = DJVViewer_hook_v03.ApplicationStore()
+	djv = DJVViewer_hook_v03.DJVViewerAction(store, DJVViewer_hook_v03.ApplicationLauncher(store))
+
+	taskSelection = [{'entityType': 'task', 'entityId': task['id']} for task in tasks]
+	source = {'user': {'username': 'bench'}}
+	results = []
+	try:
+		for count in arguments.files:
+			for task in tasks:
+				folder = os.path.join(projectRoot, fakeFtrack.shotFolder(task), 'out')
+				shutil.rmtree(folder, ignore_errors=True)
+				fillOutFolder(folder, count)
+
+			# A version of the first task linked to its first sequence, or its only movie.
+			outFolder = os.path.join(projectRoot, fakeFtrack.shotFolder(tasks[0]), 'out')
+			value = 'comp_v001.%04d.exr [1001-{0}]'.format(1000 + SEQUENCE_LENGTH) if count >= SEQUENCE_LENGTH else 'review_v001.mov'
+			version = server.add('AssetVersion', task_id=tasks[0]['id'], asset={'type': {'short': 'img'}})
+			component = server.add('Component', name='Server link', version=version)
+			server.add('ComponentLocation', component=component, resource_identifier=os.path.join(outFolder, value))
+			versionSelection = [{'entityType': 'assetversion', 'entityId': version['id']}]
+
+			steps = [
+				('outputManager.discover', lambda: outputManager.discover(Event(data={'selection': taskSelection[:1]}, source=source))),
+				('outputManager.launch', lambda: outputManager.launch(Event(data={'selection': taskSelection[:1]}, source=source))),
+				('transferFile.discover', lambda: transferFile.discover(Event(data={'selection': taskSelection}, source=source))),
+				('transferFile.launch', lambda: transferFile.launch(Event(data={'selection': taskSelection}, source=source))),
+				('djv.discover', lambda: djv.discover(Event(data={'selection': versionSelection}, source=source))),
+				('djv.launch', lambda: djv.launch(Event(data={'selection': versionSelection, 'applicationIdentifier': 'djv_view'}, source=source)))
+			]
+			for name, step in steps:
+				for cache in ('cold', 'warm'):
+					if cache == 'cold':
+						clearCaches()
+					calls = server.calls
+					response, seconds, peak = measure(step)
+					results.append({
+						'files': count,
+						'step': name,
+						'cache': cache,
+						'seconds': seconds,
+						'apiCalls': server.calls - calls,
+						'peakBytes': peak,
+						'responseItems': len((response or {}).get('items', []))
+					})
+	finally:
+		shutil.rmtree(workFolder, ignore_errors=True)
+
+	return {
+		'revision': revision(),
+		'latency': arguments.latency,
+		'shots': arguments.shots,
+		'scenarios': results,
+		'metrics': metrics.snapshot()
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Time discover and launch of the action hooks against a fake server.')
+	parser.add_argument('--files', type=int, nargs='+', default=[10, 1000, 100000], help='Files in each OUT folder, one scenario per count.')
+	parser.add_argument('--shots', type=int, default=4, help='Shots, each with a Compositing task selected for Transfer File.')
+	parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every API call.')
+	parser.add_argument('--output', help='Write the results to this JSON file.')
+	arguments = parser.parse_args()
+
+	results = run(arguments)
+	text = json.dumps(results, indent=4, sort_keys=True)
+	if arguments.output:
+		with open(arguments.output, 'w') as outputFile:
+			outputFile.write(text)
+	print(text)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,245 @@
+'''
+Status Hook Benchmark
+
+Replays a stream of ftrack.update events through changeStatus_v01 against
+the fake server in fakeFtrack and reports throughput, API calls per event,
+how long the event hub thread is kept busy per event and how long it takes
+from publishing an event until its status changes have been applied.
+
+	python benchmarks/benchStatusHook.py --events 10000 --mode batch --output results.json
+
+Recorded streams can be replayed with --replay, a file holding one JSON event
+per line. Results are written as JSON so runs can be compared between
+revisions.
+'''
+
+import argparse
+import collections
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from benchmarks import fakeFtrack
+
+STATUSES = ['Not started', 'Assigned', 'In progress', 'On Hold', 'Omitted', 'For Review']
+
+
+def buildServer(taskCount, latency):
+	# A single project whose tasks are spread across the workflow, each in its own shot with one version.
+	server = fakeFtrack.FakeServer(latency=latency)
+	statuses = [server.add('Status', name=name) for name in STATUSES]
+	schema = server.add('ProjectSchema', name='Default', statuses=statuses)
+	project = server.add('Project', name='bench', project_schema_id=schema['id'])
+	random.seed(taskCount)
+	for index in range(taskCount):
+		shot = server.add('Shot', name='shot{0}'.format(index), project_id=project['id'])
+		task = server.add(
+			'Task', name='task{0}'.format(index), project_id=project['id'], parent_id=shot['id'],
+			status_id=random.choice(statuses)['id'], assignments=[]
+		)
+		asset = server.add('Asset', name='asset{0}'.format(index), parent_id=shot['id'])
+		server.add('AssetVersion', task_id=task['id'], asset_id=asset['id'], version=1)
+	return server
+
+
+def parents(server, entityType, entity):
+	# The parents of an entity as a legacy update event lists them, itself first.
+	# Shots are labelled 'task' there, as are the tasks themselves.
+	if entityType == 'task':
+		chain = [('task', entity['id']), ('task', entity['parent_id'])]
+	else:
+		asset = server.get('Asset', entity['asset_id'])
+		chain = [('assetversion', entity['id']), ('asset', asset['id']), ('task', asset['parent_id'])]
+	projectId = server.get('Shot', chain[-1][1])['project_id']
+	return [{'entityType': each, 'entityId': eachId} for each, eachId in chain + [('show', projectId)]]
+
+
+def syntheticEvents(server, count, seed):
+	# Mixed task and asset version updates. Assignments change as the events are made.
+	random.seed(seed)
+	tasks = server.all('Task')
+	versions = server.all('AssetVersion')
+	events = []
+	for index in range(count):
+		entities = []
+		for each in range(random.choice([1, 1, 1, 2, 5])):
+			if random.random() < 0.7:
+				task = random.choice(tasks)
+				entities.append({
+					'entityType': 'task', 'entityId': task['id'], 'action': 'update', 'keys': ['assignments'],
+					'parents': parents(server, 'task', task)
+				})
+			else:
+				version = random.choice(versions)
+				entities.append({
+					'entityType': 'assetversion', 'entityId': version['id'], 'action': 'update', 'keys': ['status'],
+					'parents': parents(server, 'assetversion', version)
+				})
+		events.append({'id': str(index), 'topic': 'ftrack.update', 'data': {'entities': entities}})
+	return events
+
+
+def toggleAssignments(server, event):
+	# Mimic the change the event announces before it is delivered.
+	for entity in event['data']['entities']:
+		if entity['entityType'] == 'task':
+			task = server.get('Task', entity['entityId'])
+			if task is not None:
+				task['assignments'] = [] if task['assignments'] else ['user']
+
+
+class EventLatency(object):
+	'''
+	Time from publishing each event until the toggler has applied every entity it carries.
+	Every mode applies the updates to one entity in the order they were published.
+	'''
+
+	def __init__(self):
+		super(EventLatency, self).__init__()
+		self.latencies = []
+		self._lock = threading.Lock()
+		self._published = {}
+		self._remaining = {}
+		self._waiting = {}
+		self._count = 0
+
+	def published(self, entities):
+		# Call just before the event carrying entities is published.
+		if not entities:
+			return
+		with self._lock:
+			self._count += 1
+			self._published[self._count] = time.time()
+			self._remaining[self._count] = len(entities)
+			for entity in entities:
+				self._waiting.setdefault(entity, collections.deque()).append(self._count)
+
+	def applied(self, entities):
+		now = time.time()
+		with self._lock:
+			for entity in entities:
+				index = self._waiting[entity].popleft()
+				self._remaining[index] -= 1
+				if not self._remaining[index]:
+					del self._remaining[index]
+					self.latencies.append(now - self._published.pop(index))
+
+	def track(self, apply):
+		# Wrap StatusToggler.apply so every finished call is recorded.
+		def tracked(toggler, entities):
+			try:
+				return apply(toggler, entities)
+			finally:
+				self.applied(entities)
+		return tracked
+
+
+def revision():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=root).decode('utf-8').strip()
+	except Exception:
+		return None
+
+
+def run(arguments):
+	server = buildServer(arguments.tasks, arguments.latency)
+	hub = fakeFtrack.install(server, hubLatency=arguments.hub_latency)
+
+	import changeStatus_v01
+	import ftrack_api
+	from hookLib import metrics
+	metrics.reset()
+	eventLatency = EventLatency()
+	changeStatus_v01.StatusToggler.apply = eventLatency.track(changeStatus_v01.StatusToggler.__dict__['apply'])
+
+	if arguments.replay:
+		with open(arguments.replay) as replayFile:
+			events = [json.loads(line) for line in replayFile if line.strip()]
+	else:
+		events = syntheticEvents(server, arguments.events, arguments.seed)
+
+	finish = lambda: None
+	if arguments.mode == 'single':
+		changeStatus_v01._toggler = None
+		hub.subscribe('topic=ftrack.update', changeStatus_v01.callback)
+	elif arguments.mode == 'batch':
+		toggler = changeStatus_v01.StatusToggler(ftrack_api.Session())
+		batcher = changeStatus_v01.StatusBatcher(toggler, window=arguments.window)
+		hub.subscribe('topic=ftrack.update', batcher.callback)
+		finish = batcher.flush
+	else:
+		registry = changeStatus_v01.StatusRegistry(ftrack_api.Session())
+		entityCount = sum(len(event['data'].get('entities', [])) for event in events)
+		pool = changeStatus_v01.PooledToggler(registry, workers=arguments.workers, queueSize=entityCount)
+		pool.start()
+		hub.subscribe('topic=ftrack.update', pool.callback)
+		finish = pool.dispatcher.stop
+
+	server.calls = 0
+	latencies = []
+	started = time.time()
+	for event in events:
+		if not arguments.replay:
+			toggleAssignments(server, event)
+		eventLatency.published(changeStatus_v01.updatedEntities(event))
+		published = time.time()
+		hub.publish(event)
+		latencies.append(time.time() - published)
+	finish()
+	elapsed = time.time() - started
+
+	return {
+		'revision': revision(),
+		'mode': arguments.mode,
+		'events': len(events),
+		'tasks': arguments.tasks,
+		'latency': arguments.latency,
+		'seconds': elapsed,
+		'eventsPerSecond': len(events) / elapsed if elapsed else None,
+		'apiCalls': server.calls,
+		'apiCallsPerEvent': float(server.calls) / len(events) if events else None,
+		'hubLatency': {
+			'p50': metrics.percentile(latencies, 0.50),
+			'p95': metrics.percentile(latencies, 0.95),
+			'p99': metrics.percentile(latencies, 0.99)
+		},
+		'eventLatency': {
+			'p50': metrics.percentile(eventLatency.latencies, 0.50),
+			'p95': metrics.percentile(eventLatency.latencies, 0.95),
+			'p99': metrics.percentile(eventLatency.latencies, 0.99)
+		},
+		'metrics': metrics.snapshot()
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Replay ftrack.update events through the status hook.')
+	parser.add_argument('--events', type=int, default=10000)
+	parser.add_argument('--tasks', type=int, default=500)
+	parser.add_argument('--mode', choices=['single', 'batch', 'workers'], default='single')
+	parser.add_argument('--window', type=float, default=0.05, help='Batch window in seconds.')
+	parser.add_argument('--workers', type=int, default=4)
+	parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every API call.')
+	parser.add_argument('--hub-latency', type=float, default=0.0, help='Seconds added to every event delivery.')
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--replay', help='File with one recorded event per line.')
+	parser.add_argument('--output', help='Write the results to this JSON file.')
+	arguments = parser.parse_args()
+
+	results = run(arguments)
+	text = json.dumps(results, indent=4, sort_keys=True)
+	if arguments.output:
+		with open(arguments.output, 'w') as outputFile:
+			outputFile.write(text)
+	print(text)
+
+
+if __name__ == '__main__':
+	main()
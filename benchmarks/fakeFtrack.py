@@ -0,0 +1,469 @@
+'''
+Fake Ftrack
+
+An in-process stand-in for the legacy ftrack module and ftrack_api, backed by
+an in-memory FakeServer. Every call that would reach the real server is
+counted and can be slowed down by a fixed latency, so benchmarks report both
+wall time and API calls without touching the studio server.
+
+buildGraph fills a server with a production hierarchy of projects, episodes,
+acts, shots and tasks with users, managers and statuses, and DiskAccessor
+maps the hooks' roots onto local folders such as a temporary directory.
+
+Call install(server) before importing a hook.
+'''
+
+import logging
+import os
+import re
+import sys
+import time
+import types
+import uuid
+
+
+class FakeEntity(dict):
+	'''
+	A server side entity. Attributes are plain dictionary items.
+	'''
+
+	def __init__(self, entityType, **attributes):
+		super(FakeEntity, self).__init__()
+		self.entityType = entityType
+		for key, value in attributes.items():
+			self[key] = value
+
+	def __hash__(self):
+		return hash(self['id'])
+
+	def __eq__(self, other):
+		return isinstance(other, FakeEntity) and other.get('id') == self.get('id')
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __setitem__(self, key, value):
+		# Keep foreign keys in step with relationships, as the server would.
+		super(FakeEntity, self).__setitem__(key, value)
+		if isinstance(value, FakeEntity):
+			super(FakeEntity, self).__setitem__(key + '_id', value['id'])
+
+	def resolve(self, path):
+		# Follow a dotted attribute path such as "parent.name".
+		value = self
+		for part in path.split('.'):
+			if value is None:
+				return None
+			value = value.get(part)
+		return value
+
+
+class FakeProjectSchema(FakeEntity):
+
+	def get_statuses(self, schema, type_id=None):
+		return list(self.get('statuses', []))
+
+
+# Entity types that need more than plain attributes.
+ENTITY_CLASSES = {
+	'ProjectSchema': FakeProjectSchema
+}
+
+
+class FakeServer(object):
+	'''
+	In-memory entity store that counts and delays every API call.
+	'''
+
+	def __init__(self, latency=0.0):
+		super(FakeServer, self).__init__()
+		self.latency = latency
+		self.calls = 0
+		self.entities = {}
+
+	def call(self):
+		# Account for one round trip to the server.
+		self.calls += 1
+		if self.latency:
+			time.sleep(self.latency)
+
+	def add(self, entityType, **attributes):
+		attributes.setdefault('id', str(uuid.uuid4()))
+		entity = ENTITY_CLASSES.get(entityType, FakeEntity)(entityType, **attributes)
+		self.entities.setdefault(entityType, {})[entity['id']] = entity
+		return entity
+
+	def get(self, entityType, entityId):
+		return self.entities.get(entityType, {}).get(entityId)
+
+	def all(self, entityType):
+		return list(self.entities.get(entityType, {}).values())
+
+
+class FakeQueryResult(list):
+
+	def one(self):
+		if len(self) != 1:
+			raise ValueError('Expected one result, got {0}.'.format(len(self)))
+		return self[0]
+
+	def first(self):
+		return self[0] if self else None
+
+	def all(self):
+		return list(self)
+
+
+_QUERY = re.compile(r'^(?:select\s+.+?\s+from\s+)?(?P<type>\w+)(?:\s+where\s+(?P<condition>.+?))?\s*$', re.IGNORECASE)
+_CONDITION = re.compile(r'^(?P<path>[\w.]+)\s+(?P<operator>is not|is|in|like)\s+(?P<value>.+)$', re.IGNORECASE)
+
+
+def _literal(value):
+	value = value.strip()
+	if value[:1] in ('"', "'"):
+		return value[1:-1]
+	return value
+
+
+def _matches(entity, condition):
+	match = _CONDITION.match(condition.strip())
+	if match is None:
+		raise ValueError('Unsupported condition {0!r}.'.format(condition))
+	actual = entity.resolve(match.group('path'))
+	if isinstance(actual, FakeEntity):
+		actual = actual['id']
+	operator = match.group('operator').lower()
+	value = match.group('value').strip()
+	if operator == 'in':
+		return actual in [_literal(each) for each in value.strip('()').split(',') if each.strip()]
+	if operator == 'like':
+		pattern = re.escape(_literal(value)).replace('\\%', '.*').replace('%', '.*')
+		return re.match('^' + pattern + '$', actual or '') is not None
+	if operator == 'is not':
+		return actual != _literal(value)
+	return actual == _literal(value)
+
+
+class FakeSession(object):
+	'''
+	Minimal ftrack_api.Session. Understands "[select ... from] Type [where a is x and b in (...)]".
+	'''
+
+	server = None
+
+	def __init__(self, *args, **kwargs):
+		super(FakeSession, self).__init__()
+		self.pending = []
+		self.call()
+
+	def call(self, data=None):
+		# Every request goes through here, as in ftrack_api.
+		self.server.call()
+
+	def query(self, expression):
+		self.call()
+		match = _QUERY.match(expression.strip())
+		if match is None:
+			raise ValueError('Unsupported query {0!r}.'.format(expression))
+		condition = match.group('condition')
+		conditions = re.split(r'\s+and\s+', condition) if condition else []
+		return FakeQueryResult(
+			entity for entity in self.server.all(match.group('type'))
+			if all(_matches(entity, each) for each in conditions)
+		)
+
+	def get(self, entityType, entityId):
+		self.call()
+		return self.server.get(entityType, entityId)
+
+	def create(self, entityType, data=None):
+		entity = self.server.add(entityType, **(data or {}))
+		self.pending.append(entity)
+		return entity
+
+	def commit(self):
+		self.call()
+		self.pending = []
+
+	def rollback(self):
+		self.pending = []
+
+	def close(self):
+		pass
+
+
+class FakeEventHub(object):
+	'''
+	Synchronous event hub. Each published event is delayed by latency seconds.
+	'''
+
+	def __init__(self, latency=0.0):
+		super(FakeEventHub, self).__init__()
+		self.latency = latency
+		self.subscribers = []
+		self.replies = []
+		self.connected = True
+
+	def subscribe(self, subscription, callback):
+		self.subscribers.append((subscription, callback))
+		return len(self.subscribers)
+
+	def unsubscribe(self, identifier):
+		self.subscribers[identifier - 1] = (None, None)
+
+	def publish(self, event):
+		if self.latency:
+			time.sleep(self.latency)
+		topic = event.get('topic')
+		results = []
+		for subscription, callback in self.subscribers:
+			if callback is not None and 'topic={0}'.format(topic) in subscription:
+				results.append(callback(event))
+		return results
+
+	def publishReply(self, sourceEvent, data, source=None):
+		self.replies.append((sourceEvent, data))
+
+	def wait(self, duration=None):
+		pass
+
+
+def buildGraph(server, projects=1, episodes=1, acts=2, shots=10, users=5, statuses=None):
+	'''
+	Add a production hierarchy to server. Every shot gets a Compositing task
+	with one assigned artist and one manager.
+	Returns the created entities by type.
+	'''
+	created = dict((entityType, []) for entityType in ('Status', 'User', 'Project', 'Episode', 'Act', 'Shot', 'Task'))
+
+	def add(entityType, **attributes):
+		entity = server.add(entityType, **attributes)
+		created.setdefault(entityType, []).append(entity)
+		return entity
+
+	names = statuses or ['Not started', 'Assigned', 'In progress', 'On Hold', 'Approved', 'For Review']
+	statusEntities = [add('Status', name=name) for name in names]
+	schema = add('ProjectSchema', name='Default', statuses=statusEntities)
+	userEntities = [
+		add('User', username='user{0}'.format(index), first_name='User', last_name=str(index), email='user{0}@example.com'.format(index))
+		for index in range(users)
+	]
+	compositing = add('Type', name='Compositing')
+
+	for projectIndex in range(projects):
+		short = 'P{0}'.format(projectIndex)
+		project = add(
+			'Project', name='project{0}'.format(projectIndex), project_schema=schema,
+			custom_attributes={'proj': short, 'ae_name': 'Editor', 'ae_address': 'editor@example.com'}
+		)
+		for episodeIndex in range(episodes):
+			episode = add('Episode', name='{0:03d}'.format(episodeIndex + 1), object_type={'name': 'Episode'}, project=project)
+			for actIndex in range(acts):
+				act = add('Act', name='A{0}'.format(actIndex + 1), object_type={'name': 'Act'}, parent=episode, project=project)
+				for shotIndex in range(shots):
+					shot = add('Shot', name='{0:04d}'.format((shotIndex + 1) * 10), object_type={'name': 'Shot'}, parent=act, project=project)
+					task = add(
+						'Task', name='Compositing', type=compositing, object_type={'name': 'Task'},
+						parent=shot, project=project, ancestors=[episode, act, shot], status=statusEntities[0]
+					)
+					artist = userEntities[len(created['Task']) % len(userEntities)]
+					manager = userEntities[0]
+					task['assignments'] = [add('Appointment', type='assignment', context_id=task['id'], resource=artist)]
+					task['managers'] = [add('Manager', context_id=task['id'], user=manager)]
+	return created
+
+
+def shotFolder(task, layout='{show}/{episode}/shots/{showShort}{episode}_{act}_{shot}'):
+	# The folder of a buildGraph task, relative to the projects root, in the hooks' default layout.
+	episode, act, shot = task['ancestors']
+	project = task['project']
+	return layout.format(
+		show=project['name'], episode=episode['name'], act=act['name'],
+		shot=shot['name'], showShort=project['custom_attributes']['proj']
+	)
+
+
+class DiskAccessor(object):
+	'''
+	Legacy DiskAccessor. Roots listed in ROOTS are redirected, so "Z:/projects/"
+	can point at a temporary directory.
+	'''
+
+	ROOTS = {}
+
+	def __init__(self, prefix=''):
+		super(DiskAccessor, self).__init__()
+		for root, local in self.ROOTS.items():
+			if prefix.startswith(root):
+				prefix = os.path.join(local, prefix[len(root):])
+				break
+		self.prefix = prefix
+
+	def getFilesystemPath(self, resourceIdentifier):
+		return os.path.join(self.prefix, resourceIdentifier)
+
+
+class FakeJob(object):
+
+	def __init__(self, description, status):
+		super(FakeJob, self).__init__()
+		self.data = {'description': description, 'status': status}
+
+	def setStatus(self, status):
+		self.data['status'] = status
+
+	def set(self, key, value):
+		self.data[key] = value
+
+
+def _legacyModule(server, hub):
+	# Build the legacy "ftrack" module on top of the fake server.
+	module = types.ModuleType('ftrack')
+
+	class Status(object):
+		def __init__(self, id):
+			self._id = id
+
+		def getId(self):
+			return self._id
+
+		def getName(self):
+			return server.get('Status', self._id)['name']
+
+	class Task(object):
+		def __init__(self, id=None):
+			server.call()
+			self._entity = server.get('Task', id)
+
+		def getId(self):
+			return self._entity['id']
+
+		def getName(self):
+			return self._entity['name']
+
+		def getStatus(self):
+			server.call()
+			return Status(self._entity['status_id'])
+
+		def setStatus(self, status):
+			server.call()
+			self._entity['status_id'] = status.getId()
+
+		def getUsers(self):
+			server.call()
+			return list(self._entity.get('assignments', []))
+
+		def getProject(self):
+			server.call()
+			return Project(self._entity['project']['id'])
+
+	class Project(object):
+		def __init__(self, id=None):
+			self._entity = server.get('Project', id)
+
+		def getId(self):
+			return self._entity['id']
+
+		def getTaskStatuses(self):
+			server.call()
+			return [Status(status['id']) for status in self._entity['project_schema'].get_statuses('Task')]
+
+	class AssetVersion(object):
+		def __init__(self, id=None):
+			server.call()
+			self._entity = server.get('AssetVersion', id)
+
+		def getId(self):
+			return self._entity['id']
+
+		def getTask(self):
+			server.call()
+			return Task(self._entity['task_id'])
+
+	class User(object):
+		def __init__(self, id=None):
+			server.call()
+			self._entity = server.get('User', id)
+
+		def getId(self):
+			return self._entity['id']
+
+	class Registry(object):
+		pass
+
+	def createJob(description, status, user=None):
+		server.call()
+		return FakeJob(description, status)
+
+	module.Status = Status
+	module.Task = Task
+	module.Project = Project
+	module.User = User
+	module.DiskAccessor = DiskAccessor
+	module.createJob = createJob
+	module.AssetVersion = AssetVersion
+	module.Registry = Registry
+	module.EVENT_HUB = hub
+	module.setup = lambda *args, **kwargs: None
+	return module
+
+
+class _ApplicationStore(object):
+	'''
+	ftrack_connect.application.ApplicationStore without the filesystem search.
+	'''
+
+	def __init__(self):
+		super(_ApplicationStore, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.ApplicationStore')
+		self.applications = self._discoverApplications()
+
+	def _searchFilesystem(self, expression, label, applicationIdentifier, **kwargs):
+		return [{'identifier': applicationIdentifier, 'label': label, 'path': '/usr/bin/' + applicationIdentifier, 'launchArguments': []}]
+
+
+class _ApplicationLauncher(object):
+
+	def __init__(self, applicationStore):
+		super(_ApplicationLauncher, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.ApplicationLauncher')
+		self.applicationStore = applicationStore
+
+	def _getApplicationLaunchCommand(self, application, context=None):
+		return [application['path']] + application['launchArguments']
+
+	def launch(self, applicationIdentifier, context=None):
+		for application in self.applicationStore.applications:
+			if application['identifier'] == applicationIdentifier:
+				return {'success': True, 'command': self._getApplicationLaunchCommand(application, context)}
+		return {'success': False}
+
+
+def install(server, hubLatency=0.0):
+	# Replace ftrack and ftrack_api in sys.modules with fakes bound to server.
+	hub = FakeEventHub(latency=hubLatency)
+
+	apiModule = types.ModuleType('ftrack_api')
+	session = type('Session', (FakeSession,), {'server': server})
+	apiModule.Session = session
+	apiModule.FakeServer = server
+
+	# The fake session ignores its cache argument, these only need to exist.
+	cacheModule = types.ModuleType('ftrack_api.cache')
+	cacheModule.FileCache = lambda *args, **kwargs: None
+	cacheModule.SerialisedCache = lambda *args, **kwargs: None
+	apiModule.cache = cacheModule
+
+	# Base classes for the DJV View hook.
+	connectModule = types.ModuleType('ftrack_connect')
+	applicationModule = types.ModuleType('ftrack_connect.application')
+	applicationModule.ApplicationStore = _ApplicationStore
+	applicationModule.ApplicationLauncher = _ApplicationLauncher
+	connectModule.application = applicationModule
+
+	sys.modules['ftrack'] = _legacyModule(server, hub)
+	sys.modules['ftrack_connect'] = connectModule
+	sys.modules['ftrack_connect.application'] = applicationModule
+	sys.modules['ftrack_api'] = apiModule
+	sys.modules['ftrack_api.cache'] = cacheModule
+	return hub
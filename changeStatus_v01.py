@@ -1,41 +1,314 @@
-''' 
+'''
 FTrack action that listen for updates on tasks and changes their status
 when users are added or removed or if a new asset is uploaded.
+
+Statuses are looked up by name through a cached StatusRegistry and the
+changes are described by a TransitionTable, see hookLib.statusTransitions.
+Run with --batch to merge the entities of every event received within a
+short window into a single bulk query and a single commit, or with
+--workers to handle events on a pool of threads, keeping the updates for
+each entity in order.
 '''
 
 import sys
 import os
+import logging
+import argparse
+import threading
 
 path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ftrack-api')
 sys.path.append(path)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 import ftrack
 
-def callback(event):
-	
+from hookLib import instrument
+from hookLib import metrics
+from hookLib import sessionProvider
+from hookLib.dispatcher import EventDispatcher, splitByEntity
+from hookLib.statusRegistry import StatusRegistry
+from hookLib.statusTransitions import TransitionTable
+
+logger = logging.getLogger('changeStatus')
+
+# Seconds to keep collecting events before a batch is written.
+BATCH_WINDOW = 0.5
+
+# Asset version to task ids remembered by PooledToggler for routing.
+VERSION_TASK_CACHE = 10000
+
+def updatedEntities(event):
+	# The task and asset version updates carried by an event, in order.
+	entities = []
 	for entity in event['data'].get('entities', []):
-		# Toggle the task status when artists are assigned or unassigned.
-		if entity['entityType'].lower() == 'task' and entity['action'] == 'update':
-			task = ftrack.Task(id=entity.get('entityId'))
-			# Ignore if the status is ON HOLD or OMITTED.
-			if task.getStatus().getId() == 'a0bc2444-15e2-11e1-b21a-0019bb4983d8' or task.getStatus().getId() == 'a0bc3f24-15e2-11e1-b21a-0019bb4983d8':
+		entityType = entity['entityType'].lower()
+		if entity['action'] == 'update' and entityType in ('task', 'assetversion'):
+			entities.append((entityType, entity.get('entityId')))
+	return entities
+
+def idList(ids):
+	# Format ids for an "in (...)" query clause.
+	return ', '.join('"{0}"'.format(each) for each in ids)
+
+def closeSession(session):
+	try:
+		session.close()
+	except Exception:
+		logger.debug('Failed to close session.', exc_info=True)
+
+class StatusToggler(object):
+	'''
+	Applies the transition table to the tasks touched by update events.
+	'''
+
+	def __init__(self, session, registry=None, transitions=None):
+		super(StatusToggler, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+		self.session = session
+		self.registry = registry or StatusRegistry(session)
+		self.transitions = transitions or TransitionTable.fromEnvironment()
+
+	def callback(self, event):
+		# Handle a single event straight away.
+		self.registry.handleEvent(event)
+		self.apply(updatedEntities(event))
+
+	@instrument.entryPoint('changeStatus.apply')
+	def apply(self, entities):
+		# Resolve asset versions to their tasks with one query.
+		versionIds = set(entityId for entityType, entityId in entities if entityType == 'assetversion')
+		versionTasks = {}
+		if versionIds:
+			for version in self.session.query('select task_id from AssetVersion where id in ({0})'.format(idList(versionIds))):
+				versionTasks[version['id']] = version['task_id']
+
+		updates = []
+		for entityType, entityId in entities:
+			if entityType == 'assetversion':
+				entityId = versionTasks.get(entityId)
+			if entityId:
+				updates.append((entityType, entityId))
+		if not updates:
+			return
+
+		# Fetch every affected task with its status and assignments in one query.
+		taskIds = set(taskId for entityType, taskId in updates)
+		tasks = {}
+		for task in self.session.query('select status_id, project_id, assignments from Task where id in ({0})'.format(idList(taskIds))):
+			tasks[task['id']] = task
+
+		# Fold the updates for each task in order to find its final status.
+		current = dict((taskId, task['status_id']) for taskId, task in tasks.items())
+		final = dict(current)
+		targets = {}
+		for entityType, taskId in updates:
+			task = tasks.get(taskId)
+			if task is None:
+				continue
+			targetName = self.transitions.lookup(entityType, self.registry.nameOf(final[taskId]), task['assignments'])
+			if targetName is None:
+				continue
+			target = self.registry.status(task['project_id'], targetName)
+			if target is None:
+				self.logger.warning('Status {0!r} does not exist for task {1}.'.format(targetName, taskId))
+				continue
+			final[taskId] = target['id']
+			targets[taskId] = target
+
+		# Only write the tasks whose status actually changes.
+		changed = [taskId for taskId in final if final[taskId] != current[taskId]]
+		if not changed:
+			return
+		try:
+			self.write(tasks, targets, changed)
+			written = changed
+		except Exception:
+			# Write the tasks one by one, so a task the server rejects only loses its own update.
+			self.logger.warning('Failed to write {0} task statuses together, writing them one by one.'.format(len(changed)))
+			self.session.rollback()
+			written = []
+			for taskId in changed:
+				try:
+					self.write(tasks, targets, [taskId])
+				except Exception:
+					self.logger.exception('Failed to set the status of task {0}.'.format(taskId))
+					self.session.rollback()
+				else:
+					written.append(taskId)
+		metrics.increment('changeStatus.statusWrites', len(written))
+		self.logger.debug('Updated {0} of {1} tasks.'.format(len(written), len(tasks)))
+
+	def write(self, tasks, targets, taskIds):
+		# Set the target status of taskIds in one commit.
+		for taskId in taskIds:
+			# Registry entities may belong to another worker's session.
+			tasks[taskId]['status'] = self.session.get('Status', targets[taskId]['id'])
+		self.session.commit()
+
+class StatusBatcher(object):
+	'''
+	Collects status updates for a short window and applies them in bulk.
+	'''
+
+	def __init__(self, toggler, window=BATCH_WINDOW):
+		super(StatusBatcher, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+		self.toggler = toggler
+		self.window = window
+
+		self._lock = threading.Lock()
+		self._flushLock = threading.Lock()
+		self._pending = []
+		self._eventCount = 0
+		self._timer = None
+
+	def callback(self, event):
+		# Queue the event's entities and start the window if it isn't running.
+		self.toggler.registry.handleEvent(event)
+		entities = updatedEntities(event)
+		if not entities:
+			return
+		with self._lock:
+			self._pending.extend(entities)
+			self._eventCount += 1
+			if self._timer is None:
+				self._timer = threading.Timer(self.window, self.flush)
+				self._timer.daemon = True
+				self._timer.start()
+
+	def flush(self):
+		# Apply everything collected so far. Flushes never overlap.
+		with self._flushLock:
+			with self._lock:
+				entities, self._pending = self._pending, []
+				eventCount, self._eventCount = self._eventCount, 0
+				self._timer = None
+			if not entities:
 				return
-			else:
-				# Task switches from NOT STARTED to ASSIGNED when artists are added.
-				if task.getStatus().getId() == '44dd9fb2-4164-11df-9218-0019bb4983d8' and bool(task.getUsers()):
-					task.setStatus(ftrack.Status(id='18002a4c-c2df-11e6-ab59-0a580a58070f'))
-				# Task switches from ASSIGNED to NOT STARTED when artists are removed.
-				if task.getStatus().getId() != '44dd9fb2-4164-11df-9218-0019bb4983d8' and not bool(task.getUsers()):
-					task.setStatus(ftrack.Status(id='44dd9fb2-4164-11df-9218-0019bb4983d8'))
-				
-		# Upgrade the task status when an asset is uploaded. 
-		if entity['entityType'].lower() == 'assetversion' and entity['action'] == 'update':
-			task = ftrack.AssetVersion(id=entity.get('entityId')).getTask()
-			# Switch status to FOR REVIEW when a new asset is uploaded
-			if task.getStatus().getId() != '44dded64-4164-11df-9218-0019bb4983d8':
-				task.setStatus(ftrack.Status(id='44dded64-4164-11df-9218-0019bb4983d8'))
-
-# Subscribe to events with the update topic.
-ftrack.setup()
-ftrack.EVENT_HUB.subscribe('topic=ftrack.update', callback)
-ftrack.EVENT_HUB.wait()
\ No newline at end of file
+
+			metrics.increment('changeStatus.batches')
+			metrics.increment('changeStatus.mergedEvents', eventCount)
+			metrics.observe('changeStatus.eventsPerBatch', eventCount)
+			self.logger.debug('Merged {0} events into a batch of {1} entities.'.format(eventCount, len(entities)))
+
+			try:
+				self.toggler.apply(entities)
+			except Exception:
+				self.logger.exception('Failed to apply status batch.')
+				self.toggler.session.rollback()
+
+class PooledToggler(object):
+	'''
+	Hands each entity update to an EventDispatcher worker.
+	Every worker thread gets its own session and shares the status registry.
+	Updates are routed by task, so a version and its task land on one worker.
+	'''
+
+	def __init__(self, registry, workers=4, queueSize=1000):
+		super(PooledToggler, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+		self.registry = registry
+		self.dispatcher = EventDispatcher(self.handle, workers=workers, queueSize=queueSize, keyFunction=self.taskKey, name='changeStatus')
+		self._local = threading.local()
+		self._versionTasks = {}
+		self._lookupSession = None
+		# Raised by reset, workers replace their session when it changes.
+		self._generation = 0
+
+	def start(self):
+		self.dispatcher.start()
+
+	def reset(self):
+		# Start over with fresh sessions and empty caches, e.g. after the server connection was lost.
+		# Workers only own their sessions, so each drops its own before it handles the next event.
+		self._generation += 1
+		self.registry.invalidate()
+		self._versionTasks = {}
+		session, self._lookupSession = self._lookupSession, None
+		if session is not None:
+			closeSession(session)
+
+	def callback(self, event):
+		# Runs on the hub thread, so only invalidate caches and queue the work.
+		self.registry.handleEvent(event)
+		for each in splitByEntity(event):
+			if updatedEntities(each):
+				self.dispatcher.dispatch(each)
+
+	def taskKey(self, event):
+		# The task an update applies to. Asset versions are routed by their task_id, looked up once and
+		# remembered. The parents in the event are no help, shots and sequences are labelled 'task' there too.
+		entity = event['data']['entities'][0]
+		entityId = entity.get('entityId')
+		if entity['entityType'].lower() != 'assetversion':
+			return entityId
+		taskId = self._versionTasks.get(entityId)
+		if taskId is None:
+			taskId = self.versionTask(entityId)
+		return taskId or entityId
+
+	def versionTask(self, versionId):
+		# Runs on the hub thread, which has a session of its own for these lookups.
+		if self._lookupSession is None:
+			self._lookupSession = sessionProvider.createSession()
+		try:
+			version = self._lookupSession.query('select task_id from AssetVersion where id is "{0}"'.format(versionId)).first()
+		except Exception:
+			self.logger.exception('Failed to look up the task of version {0}.'.format(versionId))
+			return None
+		taskId = version['task_id'] if version is not None else None
+		if taskId:
+			if len(self._versionTasks) >= VERSION_TASK_CACHE:
+				self._versionTasks.clear()
+			self._versionTasks[versionId] = taskId
+		return taskId
+
+	def handle(self, event):
+		toggler = getattr(self._local, 'toggler', None)
+		if toggler is not None and self._local.generation != self._generation:
+			closeSession(toggler.session)
+			toggler = None
+		if toggler is None:
+			self._local.generation = self._generation
+			toggler = self._local.toggler = StatusToggler(sessionProvider.createSession(), registry=self.registry)
+		try:
+			toggler.apply(updatedEntities(event))
+		except Exception:
+			toggler.session.rollback()
+			raise
+
+# Created on first use so importing this module stays free of side effects.
+_toggler = None
+
+@instrument.entryPoint('changeStatus.callback')
+def callback(event):
+	# Toggle task statuses for a single ftrack.update event.
+	global _toggler
+	if _toggler is None:
+		_toggler = StatusToggler(sessionProvider.createSession())
+	_toggler.callback(event)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--batch', action='store_true', help='Merge events received within a window into bulk updates.')
+	parser.add_argument('--window', type=float, default=BATCH_WINDOW, help='Seconds to collect events for when batching.')
+	parser.add_argument('--workers', type=int, default=0, help='Handle events on this many worker threads.')
+	parser.add_argument('--queue-size', type=int, default=1000, help='Events the workers may have waiting before the hub blocks.')
+	arguments = parser.parse_args()
+
+	# Subscribe to events with the update topic.
+	ftrack.setup()
+	instrument.countLegacyApi(ftrack)
+	instrument.serveMetrics()
+	if arguments.batch:
+		batcher = StatusBatcher(StatusToggler(sessionProvider.createSession()), window=arguments.window)
+		ftrack.EVENT_HUB.subscribe('topic=ftrack.update', batcher.callback)
+	elif arguments.workers > 0:
+		pool = PooledToggler(StatusRegistry(sessionProvider.createSession()), workers=arguments.workers, queueSize=arguments.queue_size)
+		pool.start()
+		ftrack.EVENT_HUB.subscribe('topic=ftrack.update', pool.callback)
+	else:
+		ftrack.EVENT_HUB.subscribe('topic=ftrack.update', callback)
+	ftrack.EVENT_HUB.wait()
@@ -0,0 +1,11 @@
+'''
+Shared helpers for the SDE Ftrack hooks.
+
+The hooks add their own folder to sys.path and import from this package,
+so it has to stay importable without Ftrack Connect being present.
+'''
+
+import os
+
+# Folder for queues and caches that have to survive a Connect restart.
+STATE_FOLDER = os.environ.get('SDE_HOOKS_STATE', os.path.join(os.path.expanduser('~'), '.sde_ftrack'))
@@ -0,0 +1,272 @@
+'''
+Copy Engine
+
+Native replacement for shelling out to xcopy. Large files are copied in big
+chunks, using copy_file_range or sendfile where the platform offers them and
+a buffered read/write loop otherwise. Files are written next to their
+destination with a .part suffix and only moved into place once the copy has
+been verified, so a failed copy never leaves a truncated file behind.
+Digests are computed from the bytes as they are copied, without reading
+the source a second time, see hookLib.digests.
+Several files, such as the frames of a sequence, are copied in parallel
+on the shared io-copy pool of hookLib.executor.
+'''
+
+import io
+import logging
+import os
+import threading
+import time
+
+from hookLib import digests
+from hookLib import metrics
+from hookLib import executor
+
+logger = logging.getLogger(__name__)
+
+# Bytes moved per read/write or per copy_file_range/sendfile call.
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Suffix of files that are still being written.
+PART_SUFFIX = '.part'
+
+
+class CopyError(IOError):
+	'''
+	Raised when a file could not be copied or failed verification.
+	'''
+
+
+def _copyRange(source, destination, size, progress):
+	# Kernel side copy on Linux (Python 3.8+).
+	copied = 0
+	while copied < size:
+		count = os.copy_file_range(source.fileno(), destination.fileno(), min(CHUNK_SIZE, size - copied))
+		if count == 0:
+			break
+		copied += count
+		progress(count)
+	return copied
+
+
+def _sendfile(source, destination, size, progress):
+	# sendfile can write to regular files on Linux (Python 3.3+).
+	copied = 0
+	while copied < size:
+		count = os.sendfile(destination.fileno(), source.fileno(), copied, min(CHUNK_SIZE, size - copied))
+		if count == 0:
+			break
+		copied += count
+		progress(count)
+	return copied
+
+
+def _buffered(source, destination, size, progress, hasher=None):
+	# Portable loop through a single reusable buffer.
+	buffer = bytearray(CHUNK_SIZE)
+	view = memoryview(buffer)
+	copied = 0
+	while True:
+		count = source.readinto(buffer)
+		if not count:
+			break
+		destination.write(view[:count])
+		if hasher is not None:
+			hasher.update(view[:count])
+		copied += count
+		progress(count)
+	return copied
+
+
+def fileDigest(filePath, algorithm=None):
+	# Hash a file, with digests.ALGORITHM by default.
+	return digests.fileDigest(filePath, algorithm)
+
+
+def _replace(partPath, destination):
+	# os.rename refuses to overwrite on Windows and Python 2 has no os.replace.
+	if hasattr(os, 'replace'):
+		os.replace(partPath, destination)
+		return
+	if os.path.exists(destination):
+		os.remove(destination)
+	os.rename(partPath, destination)
+
+
+def _resumeOffset(source, partPath):
+	# Bytes of an interrupted copy that can be kept, rounded down to a whole chunk.
+	# A part file older than its source belongs to a previous version and is discarded.
+	if not os.path.exists(partPath):
+		return 0
+	if os.path.getmtime(partPath) < os.path.getmtime(source):
+		return 0
+	return (os.path.getsize(partPath) // CHUNK_SIZE) * CHUNK_SIZE
+
+
+def copyFile(source, destination, progress=None, checksum=False, digest=False, resume=False):
+	'''
+	Copy source to destination, which may be a folder, and verify the result.
+	The size is always checked. With checksum the source bytes are hashed
+	while copying and compared with a hash of the written file. With digest
+	that hash is returned as 'digest' and its algorithm as 'algorithm'.
+	With resume a .part file left by an interrupted copy is continued from
+	its last complete chunk and kept if this copy is interrupted too.
+	Returns a dictionary describing the copy and raises CopyError on failure.
+	'''
+	if os.path.isdir(destination):
+		destination = os.path.join(destination, os.path.basename(source))
+	progress = progress or (lambda count: None)
+	partPath = destination + PART_SUFFIX
+	started = time.time()
+	verified = False
+
+	try:
+		size = os.path.getsize(source)
+		algorithm = digests.ALGORITHM
+		hasher = digests.new(algorithm) if checksum or digest else None
+		offset = _resumeOffset(source, partPath) if resume else 0
+
+		with io.open(source, 'rb') as sourceFile:
+			if offset:
+				# Continue the part file, hashing what is already there.
+				destinationFile = io.open(partPath, 'r+b')
+				destinationFile.truncate(offset)
+				if hasher is not None:
+					for chunk in iter(lambda: destinationFile.read(CHUNK_SIZE), b''):
+						hasher.update(chunk)
+				destinationFile.seek(offset)
+				sourceFile.seek(offset)
+				progress(offset)
+				metrics.increment('copy.resumedBytes', offset)
+			else:
+				destinationFile = io.open(partPath, 'wb')
+
+			with destinationFile:
+				if hasher is None and not offset and hasattr(os, 'copy_file_range'):
+					try:
+						copied = _copyRange(sourceFile, destinationFile, size, progress)
+					except OSError:
+						# Not supported between these filesystems.
+						copied = _buffered(sourceFile, destinationFile, size, progress)
+				elif hasher is None and not offset and hasattr(os, 'sendfile') and os.name == 'posix':
+					try:
+						copied = _sendfile(sourceFile, destinationFile, size, progress)
+					except OSError:
+						copied = _buffered(sourceFile, destinationFile, size, progress)
+				else:
+					copied = offset + _buffered(sourceFile, destinationFile, size, progress, hasher)
+
+		verified = True
+		written = os.path.getsize(partPath)
+		if copied != size or written != size:
+			raise CopyError('Size mismatch copying {0}: expected {1} bytes, wrote {2}.'.format(source, size, written))
+		if checksum and fileDigest(partPath, algorithm) != hasher.hexdigest():
+			raise CopyError('Checksum mismatch copying {0}.'.format(source))
+		_replace(partPath, destination)
+	except (IOError, OSError) as error:
+		# Keep an interrupted part file for the next attempt, but never a bad one.
+		if os.path.exists(partPath) and (verified or not resume):
+			os.remove(partPath)
+		metrics.increment('copy.failed')
+		if isinstance(error, CopyError):
+			raise
+		raise CopyError('Failed to copy {0} to {1}: {2}'.format(source, destination, error))
+
+	elapsed = time.time() - started
+	metrics.increment('copy.files')
+	metrics.increment('copy.bytes', size - offset)
+	metrics.observe('copy.seconds', elapsed)
+	result = {'source': source, 'destination': destination, 'bytes': size, 'seconds': elapsed}
+	if hasher is not None:
+		result['digest'] = hasher.hexdigest()
+		result['algorithm'] = algorithm
+	return result
+
+
+class CopyProgress(object):
+	'''
+	Thread safe running total of a multi file copy.
+	'''
+
+	def __init__(self, totalBytes, totalFiles, callback=None):
+		super(CopyProgress, self).__init__()
+		self.totalBytes = totalBytes
+		self.totalFiles = totalFiles
+		self.copiedBytes = 0
+		self.copiedFiles = 0
+		self.callback = callback
+		self._lock = threading.Lock()
+
+	def addBytes(self, count):
+		with self._lock:
+			self.copiedBytes += count
+		self._report()
+
+	def addFile(self):
+		with self._lock:
+			self.copiedFiles += 1
+		self._report()
+
+	def fraction(self):
+		if not self.totalBytes:
+			return 1.0
+		return float(self.copiedBytes) / self.totalBytes
+
+	def _report(self):
+		if self.callback is not None:
+			self.callback(self)
+
+
+def copyFiles(pairs, progress=None, checksum=False, pool=None, manifest=None, skipUnchanged=True):
+	'''
+	Copy (source, destination) pairs in parallel.
+	progress is called with a CopyProgress as bytes arrive.
+	With a TransferManifest, files it lists as unchanged are skipped unless
+	skipUnchanged is False, other copies resume from their part files and
+	every completed file is recorded with its digest.
+	Returns (results, failures) where failures holds (source, error) pairs.
+	Skipped files are included in results with 'skipped' set.
+	'''
+	pairs = list(pairs)
+	results = []
+	pending = []
+	totalBytes = 0
+	for source, destination in pairs:
+		if manifest is not None and skipUnchanged and manifest.unchanged(source, destination):
+			results.append({'source': source, 'destination': destination, 'bytes': 0, 'seconds': 0.0, 'skipped': True})
+			continue
+		pending.append((source, destination))
+		if os.path.exists(source):
+			totalBytes += os.path.getsize(source)
+	tracker = CopyProgress(totalBytes, len(pending), progress)
+	if manifest is not None:
+		metrics.increment('copy.skipped', len(results))
+
+	if pool is None:
+		pool = executor.pool('io-copy')
+
+	def copyOne(pair):
+		sourceStat = os.stat(pair[0])
+		result = copyFile(
+			pair[0], pair[1], progress=tracker.addBytes, checksum=checksum,
+			digest=manifest is not None, resume=manifest is not None
+		)
+		if manifest is not None:
+			manifest.record(result, sourceStat)
+		tracker.addFile()
+		return result
+
+	try:
+		futures = pool.map(copyOne, pending)
+		failures = []
+		for (source, destination), future in zip(pending, futures):
+			error = future.exception()
+			if error is not None:
+				logger.error(str(error))
+				failures.append((source, error))
+			else:
+				results.append(future.result())
+	finally:
+		if manifest is not None:
+			manifest.save()
+	return results, failures
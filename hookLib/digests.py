@@ -0,0 +1,84 @@
+'''
+Digests
+
+Content hashes of delivered files. xxHash is used when the xxhash package
+is installed, BLAKE2 otherwise and MD5 on interpreters that have neither.
+SDE_DIGEST picks an algorithm by name. Every stored digest is kept with the
+name of its algorithm, so digests made with another algorithm can still be
+checked.
+
+Copies hash the bytes as they pass through, see copyEngine. Files that are
+only read, as when verifying a delivery, are hashed through a memory map on
+the shared verify pool.
+'''
+
+import hashlib
+import io
+import mmap
+import os
+
+from hookLib import executor
+
+try:
+	import xxhash
+except ImportError:
+	xxhash = None
+
+# Bytes hashed per update.
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _defaultAlgorithm():
+	if xxhash is not None:
+		return 'xxh3_128' if hasattr(xxhash, 'xxh3_128') else 'xxh64'
+	if hasattr(hashlib, 'blake2b'):
+		return 'blake2b'
+	return 'md5'
+
+
+ALGORITHM = os.environ.get('SDE_DIGEST', _defaultAlgorithm())
+
+
+def new(algorithm=None):
+	# A hasher for algorithm, ALGORITHM by default.
+	algorithm = algorithm or ALGORITHM
+	if algorithm.startswith('xxh'):
+		if xxhash is None:
+			raise ValueError('Digest {0} needs the xxhash package.'.format(algorithm))
+		return getattr(xxhash, algorithm)()
+	return hashlib.new(algorithm)
+
+
+def fileDigest(filePath, algorithm=None):
+	# Hash a file through a memory map. Empty files cannot be mapped.
+	hasher = new(algorithm)
+	with io.open(filePath, 'rb') as handle:
+		size = os.fstat(handle.fileno()).st_size
+		if size:
+			mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+			try:
+				for offset in range(0, size, CHUNK_SIZE):
+					hasher.update(mapped[offset:offset + CHUNK_SIZE])
+			finally:
+				mapped.close()
+	return hasher.hexdigest()
+
+
+def fileDigests(filePaths, algorithm=None, pool=None):
+	# {path: digest or exception} of every file, hashed in parallel.
+	filePaths = list(filePaths)
+	pool = pool or executor.pool('verify')
+	futures = pool.map(lambda filePath: fileDigest(filePath, algorithm), filePaths)
+	results = {}
+	for filePath, future in zip(filePaths, futures):
+		error = future.exception()
+		results[filePath] = error if error is not None else future.result()
+	return results
+
+
+def combine(digests, algorithm=None):
+	# One digest for a set of files, e.g. the frames of a sequence, from their {name: digest}.
+	hasher = new(algorithm)
+	for name in sorted(digests):
+		hasher.update('{0} {1}\n'.format(name, digests[name]).encode('utf-8'))
+	return hasher.hexdigest()
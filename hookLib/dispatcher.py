@@ -0,0 +1,155 @@
+'''
+Event Dispatcher
+
+Moves events off the event hub thread onto a pool of worker threads.
+Every event is routed by a key, normally the id of the entity it updates, and
+a key always lands on the same worker. Updates to one entity are therefore
+applied in the order they arrived while different entities run in parallel.
+
+Each worker owns a bounded queue. When it is full the hub thread waits up to
+blockTimeout seconds for room (a delayed event) before giving up on the event
+(a dropped event). Both cases are logged and counted.
+'''
+
+import logging
+import threading
+import time
+import zlib
+
+try:
+	import Queue as queue
+except ImportError:
+	import queue
+
+from hookLib import metrics
+
+
+def entityKey(event):
+	# Route by the first entity the event refers to.
+	entities = event['data'].get('entities', [])
+	if entities:
+		return entities[0].get('entityId')
+	return None
+
+
+def splitByEntity(event):
+	# One shallow copy of the event per entity, so each can be routed on its own.
+	entities = event['data'].get('entities', [])
+	if len(entities) < 2:
+		return [event]
+	events = []
+	for entity in entities:
+		single = dict(event)
+		single['data'] = dict(event['data'])
+		single['data']['entities'] = [entity]
+		events.append(single)
+	return events
+
+
+class EventDispatcher(object):
+	'''
+	Keyed, bounded worker pool for event handlers.
+	'''
+
+	def __init__(self, handler, workers=4, queueSize=1000, blockTimeout=1.0, keyFunction=entityKey, name='dispatcher'):
+		super(EventDispatcher, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+		self.handler = handler
+		self.workers = max(1, workers)
+		self.blockTimeout = blockTimeout
+		self.keyFunction = keyFunction
+		self.name = name
+
+		size = max(1, queueSize // self.workers)
+		self._queues = [queue.Queue(maxsize=size) for each in range(self.workers)]
+		self._threads = []
+
+	def start(self):
+		# Start the worker threads.
+		for index, workQueue in enumerate(self._queues):
+			thread = threading.Thread(
+				target=self._work, args=(index, workQueue),
+				name='{0}-worker-{1}'.format(self.name, index)
+			)
+			thread.daemon = True
+			thread.start()
+			self._threads.append(thread)
+
+	def stop(self, timeout=None):
+		# Let the workers finish what is queued, then stop them.
+		for workQueue in self._queues:
+			workQueue.put(None)
+		for thread in self._threads:
+			thread.join(timeout)
+		self._threads = []
+
+	def dispatch(self, event):
+		# Queue an event for its worker. Returns False if it had to be dropped.
+		key = self.keyFunction(event)
+		index = zlib.crc32(str(key).encode('utf-8')) % self.workers
+		workQueue = self._queues[index]
+		item = (event, time.time())
+
+		try:
+			workQueue.put_nowait(item)
+		except queue.Full:
+			metrics.increment('{0}.delayed'.format(self.name))
+			self.logger.warning('Worker {0} queue is full, delaying event for {1}.'.format(index, key))
+			try:
+				workQueue.put(item, timeout=self.blockTimeout)
+			except queue.Full:
+				metrics.increment('{0}.dropped'.format(self.name))
+				self.logger.error('Dropped event {0} for {1}, worker {2} is backed up.'.format(event.get('id'), key, index))
+				return False
+
+		metrics.setGauge('{0}.queueDepth'.format(self.name), self.queueDepth())
+		return True
+
+	def drain(self, timeout=None):
+		# Wait until every queued event has been handled. Returns False if timeout ran out first.
+		deadline = None if timeout is None else time.time() + timeout
+		while any(workQueue.unfinished_tasks for workQueue in self._queues):
+			if deadline is not None and time.time() > deadline:
+				return False
+			time.sleep(0.05)
+		return True
+
+	def alive(self):
+		# Number of worker threads still running.
+		return len([thread for thread in self._threads if thread.is_alive()])
+
+	def queueDepth(self):
+		# Number of events waiting across all workers.
+		return sum(workQueue.qsize() for workQueue in self._queues)
+
+	def stats(self):
+		# Queue depths and handling latency for each worker.
+		timings = metrics.snapshot()['timings']
+		workers = []
+		for index, workQueue in enumerate(self._queues):
+			workers.append({
+				'worker': index,
+				'queueDepth': workQueue.qsize(),
+				'latency': timings.get('{0}.worker{1}.latency'.format(self.name, index))
+			})
+		return {'queueDepth': self.queueDepth(), 'workers': workers}
+
+	def _work(self, index, workQueue):
+		while True:
+			item = workQueue.get()
+			if item is None:
+				workQueue.task_done()
+				break
+			event, queued = item
+			started = time.time()
+			try:
+				self.handler(event)
+			except Exception:
+				self.logger.exception('Worker {0} failed to handle event {1}.'.format(index, event.get('id')))
+				metrics.increment('{0}.failed'.format(self.name))
+			finished = time.time()
+			metrics.observe('{0}.queueWait'.format(self.name), started - queued)
+			metrics.observe('{0}.worker{1}.latency'.format(self.name, index), finished - started)
+			metrics.setGauge('{0}.queueDepth'.format(self.name), self.queueDepth())
+			workQueue.task_done()
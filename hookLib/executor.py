@@ -0,0 +1,83 @@
+'''
+Executor
+
+Named, bounded WorkerPools shared by every hook in the process, so that
+copies, uploads and notifications each run on a fixed number of threads
+however many launches ask for them:
+
+	from hookLib import executor
+	future = executor.submit('io-copy', copyFile, source, destination)
+	future.add_done_callback(copied)
+
+Pools are created on first use and shut down when the interpreter exits.
+Their counters are published through hookLib.metrics, see stats().
+'''
+
+import atexit
+import logging
+import os
+import threading
+
+from hookLib.workerPool import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+# Threads and queue limits of the known pools. Other names get the default.
+POOL_SIZES = {
+	'io-copy': int(os.environ.get('SDE_COPY_WORKERS', 4)),
+	'upload': 2,
+	'notify': 1,
+	'transfer': 2,
+	'resolve': 8,
+	'prefetch': 2,
+	'verify': int(os.environ.get('SDE_VERIFY_WORKERS', 8))
+}
+DEFAULT_SIZE = 4
+
+# Calls a pool may have waiting before submit blocks, 0 for no limit.
+QUEUE_LIMITS = {
+	'io-copy': 1024
+}
+
+# Seconds each pool thread is given to finish when the interpreter exits.
+SHUTDOWN_TIMEOUT = 10.0
+
+_lock = threading.Lock()
+_pools = {}
+
+
+def pool(name, size=None):
+	# The shared pool called name. size only applies when the pool is created.
+	with _lock:
+		existing = _pools.get(name)
+		if existing is None:
+			existing = _pools[name] = WorkerPool(
+				name, size=size or POOL_SIZES.get(name, DEFAULT_SIZE), maxQueue=QUEUE_LIMITS.get(name, 0)
+			)
+		elif size is not None and size != existing.size:
+			logger.debug('Pool {0} already runs {1} threads, ignoring size {2}.'.format(name, existing.size, size))
+		return existing
+
+
+def submit(name, fn, *args, **kwargs):
+	# Run fn on the pool called name and return its Future.
+	return pool(name).submit(fn, *args, **kwargs)
+
+
+def stats():
+	# Queue length, busy workers and call counts of every pool.
+	with _lock:
+		pools = dict(_pools)
+	return dict((name, each.stats()) for name, each in pools.items())
+
+
+def shutdown(wait=True):
+	# Let the pools finish what they are running and stop their threads.
+	with _lock:
+		pools = list(_pools.values())
+		_pools.clear()
+	for each in pools:
+		each.shutdown(wait=wait, timeout=SHUTDOWN_TIMEOUT)
+
+
+atexit.register(shutdown)
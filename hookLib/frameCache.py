@@ -0,0 +1,140 @@
+'''
+Frame Cache
+
+Local copies of sequences for review. prefetch copies the first frames of
+a sequence to a local folder in parallel and returns as soon as they have
+arrived, then keeps copying the rest in the background, so playback can
+start right away instead of streaming every frame from the network share.
+
+Each sequence gets its own folder under CACHE_FOLDER, holding a transfer
+manifest so a repeat review only copies frames that changed. When the cache
+grows past CACHE_LIMIT bytes, the least recently reviewed sequences are
+removed.
+'''
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+from hookLib import STATE_FOLDER
+from hookLib import copyEngine
+from hookLib import executor
+from hookLib import metrics
+from hookLib import sequenceScanner
+from hookLib.transferManifest import TransferManifest
+
+CACHE_FOLDER = os.environ.get('SDE_FRAME_CACHE', os.path.join(STATE_FOLDER, 'frames'))
+
+# Bytes the cache may use before old sequences are evicted.
+CACHE_LIMIT = int(float(os.environ.get('SDE_FRAME_CACHE_GB', 50)) * 1024 ** 3)
+
+# Frames copied before prefetch returns.
+PREFETCH_FRAMES = 24
+
+# Touched whenever a cached sequence is used, its mtime orders the eviction.
+USED_MARKER = '.lastUsed'
+
+
+class FrameCache(object):
+	'''
+	Least recently used cache of sequence folders.
+	'''
+
+	def __init__(self, folder=CACHE_FOLDER, limit=CACHE_LIMIT):
+		super(FrameCache, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+		self.folder = folder
+		self.limit = limit
+
+		self._lock = threading.Lock()
+		self._filling = set()
+
+	def localFolder(self, sourceFolder, value):
+		# Folder the frames of value in sourceFolder are cached in.
+		key = hashlib.md5(os.path.join(sourceFolder, value).encode('utf-8')).hexdigest()
+		return os.path.join(self.folder, key)
+
+	def prefetch(self, sourceFolder, value, firstFrames=PREFETCH_FRAMES):
+		# Copy the first frames of value and queue the rest. Returns the local folder.
+		folder = self.localFolder(sourceFolder, value)
+		if not os.path.isdir(folder):
+			os.makedirs(folder)
+		self._touch(folder)
+
+		pairs = []
+		needed = 0
+		for name in sequenceScanner.expand(sourceFolder, value):
+			pairs.append((os.path.join(sourceFolder, name), folder))
+			if not os.path.exists(os.path.join(folder, name)):
+				needed += os.path.getsize(pairs[-1][0])
+		self.evict(needed, keep=folder)
+
+		manifest = TransferManifest.load(folder)
+		started = time.time()
+		results, failures = copyEngine.copyFiles(pairs[:firstFrames], manifest=manifest)
+		metrics.observe('frameCache.prefetchSeconds', time.time() - started)
+		if failures:
+			raise copyEngine.CopyError('{0} of the first {1} frames failed to copy.'.format(len(failures), firstFrames))
+
+		# One background fill per folder at a time.
+		with self._lock:
+			start = bool(pairs[firstFrames:]) and folder not in self._filling
+			if start:
+				self._filling.add(folder)
+		if start:
+			executor.submit('prefetch', self._fill, folder, pairs[firstFrames:], manifest)
+		return folder
+
+	def evict(self, needed=0, keep=None):
+		# Remove the least recently used folders until needed more bytes fit under the limit.
+		entries = []
+		total = 0
+		if not os.path.isdir(self.folder):
+			return
+		for name in os.listdir(self.folder):
+			folder = os.path.join(self.folder, name)
+			if not os.path.isdir(folder):
+				continue
+			size = sum(os.path.getsize(os.path.join(folder, each)) for each in os.listdir(folder))
+			total += size
+			entries.append((self._lastUsed(folder), folder, size))
+
+		for lastUsed, folder, size in sorted(entries):
+			if total + needed <= self.limit:
+				break
+			with self._lock:
+				if folder == keep or folder in self._filling:
+					continue
+			self.logger.debug('Evicting {0} from the frame cache.'.format(folder))
+			shutil.rmtree(folder, ignore_errors=True)
+			total -= size
+			metrics.increment('frameCache.evicted')
+		metrics.setGauge('frameCache.bytes', total)
+
+	def _fill(self, folder, pairs, manifest):
+		try:
+			results, failures = copyEngine.copyFiles(pairs, manifest=manifest)
+			if failures:
+				self.logger.warning('{0} frames failed to cache in {1}.'.format(len(failures), folder))
+		finally:
+			with self._lock:
+				self._filling.discard(folder)
+
+	def _touch(self, folder):
+		with open(os.path.join(folder, USED_MARKER), 'a'):
+			pass
+		os.utime(os.path.join(folder, USED_MARKER), None)
+
+	def _lastUsed(self, folder):
+		try:
+			return os.path.getmtime(os.path.join(folder, USED_MARKER))
+		except OSError:
+			return 0
+
+
+# Shared by every hook in the process.
+frames = FrameCache()
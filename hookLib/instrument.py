@@ -0,0 +1,300 @@
+'''
+Instrument
+
+Timing for the hooks' entry points and the phases inside them. Decorate an
+entry point with entryPoint and wrap the slow parts in phase:
+
+	@instrument.entryPoint('transferFile.launch')
+	def launch(self, event):
+		with instrument.phase('query'):
+			...
+
+Every entry point call is written as one JSON line to a rotating trace log
+(SDE_TRACE_LOG) with its duration, the time spent in each phase and the
+number of ftrack API calls it made. API calls are counted on sessions passed
+to countSession and on the legacy API's server, where it can be found.
+Durations also go to hookLib.metrics, which serveMetrics exposes in the
+Prometheus text format when SDE_METRICS_PORT is set. The same endpoint
+answers /health with the results of the checks added with addHealthCheck,
+as JSON with status 200 when all of them pass and 503 otherwise.
+'''
+
+import contextlib
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import re
+import threading
+import time
+
+from hookLib import STATE_FOLDER
+from hookLib import metrics
+
+try:
+	from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+	from http.server import BaseHTTPRequestHandler, HTTPServer
+
+TRACE_LOG = os.environ.get('SDE_TRACE_LOG', os.path.join(STATE_FOLDER, 'logs', 'trace.jsonl'))
+
+# Size of each trace log file and the number of old files kept.
+TRACE_BYTES = 10 * 1024 * 1024
+TRACE_BACKUPS = 5
+
+# Names used for phases throughout the hooks.
+QUERY = 'query'
+SCAN = 'scan'
+COPY = 'copy'
+ENCODE = 'encode'
+UPLOAD = 'upload'
+EMAIL = 'email'
+HASH = 'hash'
+
+_local = threading.local()
+_logLock = threading.Lock()
+_traceLogger = None
+_server = None
+_healthChecks = {}
+
+
+class Trace(object):
+	'''
+	Timings of one entry point call.
+	'''
+
+	def __init__(self, name):
+		super(Trace, self).__init__()
+		self.name = name
+		self.started = time.time()
+		self.phases = {}
+		self.apiCalls = 0
+		self.fields = {}
+
+	def record(self, seconds, error=None):
+		return {
+			'time': self.started,
+			'entry': self.name,
+			'seconds': round(seconds, 6),
+			'phases': dict((name, round(value, 6)) for name, value in self.phases.items()),
+			'apiCalls': self.apiCalls,
+			'error': error,
+			'thread': threading.current_thread().name,
+			'fields': self.fields
+		}
+
+
+def current():
+	# The trace of the entry point running on this thread, or None.
+	return getattr(_local, 'trace', None)
+
+
+def annotate(**fields):
+	# Add fields to the current trace, e.g. the number of selected entities.
+	trace = current()
+	if trace is not None:
+		trace.fields.update(fields)
+
+
+def entryPoint(name):
+	# Decorator timing every call of a hook entry point.
+	def decorator(fn):
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			if current() is not None:
+				# Called from another entry point, count it as a phase of that one.
+				with phase(name):
+					return fn(*args, **kwargs)
+
+			trace = _local.trace = Trace(name)
+			error = None
+			try:
+				return fn(*args, **kwargs)
+			except Exception as exception:
+				error = '{0}: {1}'.format(exception.__class__.__name__, exception)
+				raise
+			finally:
+				_local.trace = None
+				seconds = time.time() - trace.started
+				metrics.observe('entry.{0}.seconds'.format(name), seconds)
+				metrics.observe('entry.{0}.apiCalls'.format(name), trace.apiCalls)
+				if error is not None:
+					metrics.increment('entry.{0}.errors'.format(name))
+				_write(trace.record(seconds, error))
+		return wrapper
+	return decorator
+
+
+@contextlib.contextmanager
+def phase(name):
+	# Time a block. Repeated phases of one trace add up, a phase nested in itself is counted once.
+	active = getattr(_local, 'phases', None)
+	if active is None:
+		active = _local.phases = set()
+	if name in active:
+		yield
+		return
+
+	active.add(name)
+	started = time.time()
+	try:
+		yield
+	finally:
+		active.discard(name)
+		seconds = time.time() - started
+		metrics.observe('phase.{0}.seconds'.format(name), seconds)
+		trace = current()
+		if trace is not None:
+			trace.phases[name] = trace.phases.get(name, 0.0) + seconds
+
+
+def timed(name):
+	# Decorator running a whole function as a phase.
+	def decorator(fn):
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			with phase(name):
+				return fn(*args, **kwargs)
+		return wrapper
+	return decorator
+
+
+def countCall():
+	# Count one ftrack API round trip.
+	metrics.increment('ftrack.apiCalls')
+	trace = current()
+	if trace is not None:
+		trace.apiCalls += 1
+
+
+def _counting(method):
+	@functools.wraps(method)
+	def wrapper(*args, **kwargs):
+		countCall()
+		with phase(QUERY):
+			return method(*args, **kwargs)
+	return wrapper
+
+
+def countSession(session):
+	# Count the server calls of an ftrack_api session. Every request goes through Session.call.
+	if hasattr(session, 'call') and not getattr(session.call, '_sdeCounted', False):
+		session.call = _counting(session.call)
+		session.call._sdeCounted = True
+	return session
+
+
+def countLegacyApi(module):
+	# Count the server calls of the legacy ftrack module, if its server object can be found.
+	server = getattr(module, 'xmlServer', None)
+	if server is None or not hasattr(server, 'action') or getattr(server.action, '_sdeCounted', False):
+		return False
+	server.action = _counting(server.action)
+	server.action._sdeCounted = True
+	return True
+
+
+def log(event, **fields):
+	# Write a free form record to the trace log.
+	fields.update({'time': time.time(), 'event': event})
+	_write(fields)
+
+
+def _write(record):
+	global _traceLogger
+	with _logLock:
+		if _traceLogger is None:
+			_traceLogger = logging.getLogger('sde.trace')
+			_traceLogger.propagate = False
+			_traceLogger.setLevel(logging.INFO)
+			try:
+				folder = os.path.dirname(TRACE_LOG)
+				if not os.path.isdir(folder):
+					os.makedirs(folder)
+				handler = logging.handlers.RotatingFileHandler(TRACE_LOG, maxBytes=TRACE_BYTES, backupCount=TRACE_BACKUPS)
+			except (IOError, OSError):
+				logging.getLogger(__name__).exception('Cannot write the trace log {0}.'.format(TRACE_LOG))
+				handler = logging.NullHandler()
+			handler.setFormatter(logging.Formatter('%(message)s'))
+			_traceLogger.addHandler(handler)
+	_traceLogger.info(json.dumps(record, default=str, sort_keys=True))
+
+
+def _metricName(name):
+	return 'sde_' + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def prometheusText(snapshot=None):
+	# hookLib.metrics in the Prometheus text exposition format.
+	snapshot = snapshot or metrics.snapshot()
+	lines = []
+	for name, value in sorted(snapshot['counters'].items()):
+		lines.append('# TYPE {0} counter'.format(_metricName(name)))
+		lines.append('{0} {1}'.format(_metricName(name), value))
+	for name, value in sorted(snapshot['gauges'].items()):
+		lines.append('# TYPE {0} gauge'.format(_metricName(name)))
+		lines.append('{0} {1}'.format(_metricName(name), value))
+	for name, timing in sorted(snapshot['timings'].items()):
+		metric = _metricName(name)
+		lines.append('# TYPE {0} summary'.format(metric))
+		for quantile in ('p50', 'p95', 'p99'):
+			lines.append('{0}{{quantile="0.{1}"}} {2}'.format(metric, quantile[1:], timing[quantile]))
+		lines.append('{0}_sum {1}'.format(metric, timing['total']))
+		lines.append('{0}_count {1}'.format(metric, timing['count']))
+	return '\n'.join(lines) + '\n'
+
+
+def addHealthCheck(name, check):
+	# check() returns a (healthy, detail) pair. Raising counts as unhealthy.
+	_healthChecks[name] = check
+
+
+def health():
+	# (healthy, {name: {'healthy': ..., 'detail': ...}}) of every health check.
+	results = {}
+	for name, check in sorted(_healthChecks.items()):
+		try:
+			healthy, detail = check()
+		except Exception as exception:
+			healthy, detail = False, '{0}: {1}'.format(exception.__class__.__name__, exception)
+		results[name] = {'healthy': bool(healthy), 'detail': detail}
+	return all(result['healthy'] for result in results.values()), results
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		status = 200
+		contentType = 'text/plain; version=0.0.4'
+		if self.path.split('?')[0].rstrip('/') == '/health':
+			healthy, results = health()
+			status = 200 if healthy else 503
+			contentType = 'application/json'
+			body = json.dumps({'healthy': healthy, 'checks': results}, default=str, sort_keys=True).encode('utf-8')
+		else:
+			body = prometheusText().encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', contentType)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+def serveMetrics(port=None, host='127.0.0.1'):
+	# Serve prometheusText on port from a daemon thread. Without a port, SDE_METRICS_PORT is used if set.
+	global _server
+	if port is None:
+		port = os.environ.get('SDE_METRICS_PORT')
+		if not port:
+			return None
+	with _logLock:
+		if _server is None:
+			_server = HTTPServer((host, int(port)), _MetricsHandler)
+			thread = threading.Thread(target=_server.serve_forever, name='metrics-endpoint')
+			thread.daemon = True
+			thread.start()
+	return _server
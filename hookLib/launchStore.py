@@ -0,0 +1,64 @@
+'''
+Launch Store
+
+Keeps what an action worked out while building its form until the form is
+submitted. Actions are launched twice, once for the form and once with its
+values, and the two launches share nothing but the event. State is stored
+under the user who launched and the entities selected, so overlapping
+launches and several users on one action never see each other's state.
+Forms that are never submitted expire after LAUNCH_TTL seconds.
+'''
+
+import threading
+import time
+
+from hookLib import metrics
+
+# Seconds a form's state is kept waiting for its submit.
+LAUNCH_TTL = 30 * 60
+
+
+def launchKey(event):
+	# The user and selection of a launch event.
+	user = event.get('source', {}).get('user', {})
+	selection = event['data'].get('selection', [])
+	return (
+		user.get('id') or user.get('username'),
+		tuple(sorted((entity.get('entityType'), entity.get('entityId')) for entity in selection))
+	)
+
+
+class LaunchStore(object):
+	'''
+	State per launch key, expiring after ttl seconds.
+	'''
+
+	def __init__(self, name, ttl=LAUNCH_TTL):
+		super(LaunchStore, self).__init__()
+		self.name = name
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		self._states = {}
+
+	def put(self, event, state):
+		# Remember state for the submit of the form built for event.
+		now = time.time()
+		with self._lock:
+			self._expire(now)
+			self._states[launchKey(event)] = (now, state)
+			metrics.setGauge('launchStore.{0}.size'.format(self.name), len(self._states))
+
+	def pop(self, event):
+		# The state put for event's form, or None if there is none or it expired.
+		with self._lock:
+			stored = self._states.pop(launchKey(event), None)
+		if stored is None or time.time() - stored[0] > self.ttl:
+			metrics.increment('launchStore.{0}.missing'.format(self.name))
+			return None
+		return stored[1]
+
+	def _expire(self, now):
+		# Called with the lock held.
+		for key, (stored, state) in list(self._states.items()):
+			if now - stored > self.ttl:
+				del self._states[key]
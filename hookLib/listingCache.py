@@ -0,0 +1,156 @@
+'''
+Listing Cache
+
+Keeps the scanned contents of folders on the network share, keyed by path
+and validated by the folder's modification time. A folder whose mtime has
+not changed is served from memory. A folder that has changed is still served
+from memory straight away while a background refresh scans it again, so a
+click never waits on the share unless the folder has never been seen.
+
+Folders can be watched. A polling thread then re-scans them whenever their
+mtime changes, which keeps hot shot folders warm between clicks. A folder
+stops being watched after WATCH_TTL seconds without a request.
+
+The shared instance is listingCache.listings.
+'''
+
+import logging
+import os
+import threading
+import time
+
+from hookLib import metrics
+from hookLib import sequenceScanner
+from hookLib import executor
+
+# Seconds between polls of watched folders.
+POLL_INTERVAL = 10
+
+# Seconds a folder stays watched after it was last requested.
+WATCH_TTL = 30 * 60
+
+
+class CachedListing(object):
+
+	def __init__(self, mtime, entries, scanned):
+		super(CachedListing, self).__init__()
+		self.mtime = mtime
+		self.entries = entries
+		self.scanned = scanned
+
+
+class ListingCache(object):
+	'''
+	Folder listings keyed by path and checked against the folder mtime.
+	'''
+
+	def __init__(self, scanner=sequenceScanner.scan, pollInterval=POLL_INTERVAL, watchTtl=WATCH_TTL):
+		super(ListingCache, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+		self.scanner = scanner
+		self.pollInterval = pollInterval
+		self.watchTtl = watchTtl
+
+		self._lock = threading.Lock()
+		self._listings = {}
+		self._refreshing = set()
+		self._watched = {}
+		self._watcher = None
+		self._pool = executor.pool('listing-refresh', size=2)
+
+	def get(self, folder):
+		# The scanned entries of folder, served from the cache whenever possible.
+		folder = os.path.normpath(folder)
+		mtime = self._mtime(folder)
+		with self._lock:
+			cached = self._listings.get(folder)
+			if folder in self._watched:
+				self._watched[folder] = time.time()
+
+		if cached is None:
+			metrics.increment('listing.misses')
+			return self.refresh(folder).entries
+
+		if cached.mtime == mtime:
+			metrics.increment('listing.hits')
+			return cached.entries
+
+		metrics.increment('listing.staleHits')
+		self.logger.info('Serving stale listing of {0}, scanned {1:.1f}s ago.'.format(folder, time.time() - cached.scanned))
+		self.refreshLater(folder)
+		return cached.entries
+
+	def refresh(self, folder):
+		# Scan folder now and store the result.
+		folder = os.path.normpath(folder)
+		started = time.time()
+		mtime = self._mtime(folder)
+		entries = self.scanner(folder)
+		elapsed = time.time() - started
+		cached = CachedListing(mtime, entries, time.time())
+		with self._lock:
+			self._listings[folder] = cached
+			self._refreshing.discard(folder)
+		metrics.observe('listing.refreshSeconds', elapsed)
+		self.logger.info('Scanned {0} in {1:.3f}s, {2} entries.'.format(folder, elapsed, len(entries)))
+		return cached
+
+	def refreshLater(self, folder):
+		# Queue a background refresh unless one is already pending.
+		folder = os.path.normpath(folder)
+		with self._lock:
+			if folder in self._refreshing:
+				return
+			self._refreshing.add(folder)
+		future = self._pool.submit(self.refresh, folder)
+		future.add_done_callback(lambda done: self._refreshFailed(folder, done))
+
+	def invalidate(self, folder=None):
+		# Forget one folder, or everything.
+		with self._lock:
+			if folder is None:
+				self._listings.clear()
+			else:
+				self._listings.pop(os.path.normpath(folder), None)
+
+	def watch(self, folder):
+		# Keep folder warm by polling it in the background.
+		folder = os.path.normpath(folder)
+		with self._lock:
+			self._watched[folder] = time.time()
+			if self._watcher is None:
+				self._watcher = threading.Thread(target=self._poll, name='listing-watcher')
+				self._watcher.daemon = True
+				self._watcher.start()
+
+	def _refreshFailed(self, folder, future):
+		if future.exception() is not None:
+			with self._lock:
+				self._refreshing.discard(folder)
+			self.logger.warning('Failed to refresh {0}: {1}'.format(folder, future.exception()))
+
+	def _mtime(self, folder):
+		try:
+			return os.stat(folder).st_mtime
+		except OSError:
+			return None
+
+	def _poll(self):
+		while True:
+			time.sleep(self.pollInterval)
+			now = time.time()
+			with self._lock:
+				for folder, requested in list(self._watched.items()):
+					if now - requested > self.watchTtl:
+						del self._watched[folder]
+				watched = list(self._watched)
+				listings = dict(self._listings)
+			for folder in watched:
+				cached = listings.get(folder)
+				if cached is None or cached.mtime != self._mtime(folder):
+					self.refreshLater(folder)
+
+
+# Shared by every hook in the process.
+listings = ListingCache()
@@ -0,0 +1,82 @@
+'''
+Process wide counters, gauges and timing samples for the hooks.
+
+Everything is kept in memory and guarded by a single lock so the values can
+be updated from the event hub thread and any worker threads alike.
+'''
+
+import threading
+
+# Number of recent samples kept per timing for percentile reporting.
+MAX_SAMPLES = 1024
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+
+def increment(name, amount=1):
+	# Add to a monotonically increasing counter.
+	with _lock:
+		_counters[name] = _counters.get(name, 0) + amount
+
+
+def setGauge(name, value):
+	# Record the current value of something that goes up and down.
+	with _lock:
+		_gauges[name] = value
+
+
+def observe(name, value):
+	# Record a single sample, typically a duration in seconds or a batch size.
+	with _lock:
+		timing = _timings.get(name)
+		if timing is None:
+			timing = _timings[name] = {'count': 0, 'total': 0.0, 'max': 0.0, 'samples': []}
+		timing['count'] += 1
+		timing['total'] += value
+		timing['max'] = max(timing['max'], value)
+		samples = timing['samples']
+		samples.append(value)
+		if len(samples) > MAX_SAMPLES:
+			del samples[0]
+
+
+def percentile(samples, fraction):
+	# Nearest-rank percentile of an unsorted list of samples.
+	if not samples:
+		return 0.0
+	ordered = sorted(samples)
+	index = int(round(fraction * (len(ordered) - 1)))
+	return ordered[index]
+
+
+def snapshot():
+	# Return a plain copy of every metric, safe to serialise.
+	with _lock:
+		timings = {}
+		for name, timing in _timings.items():
+			samples = timing['samples']
+			timings[name] = {
+				'count': timing['count'],
+				'total': timing['total'],
+				'mean': timing['total'] / timing['count'] if timing['count'] else 0.0,
+				'max': timing['max'],
+				'p50': percentile(samples, 0.50),
+				'p95': percentile(samples, 0.95),
+				'p99': percentile(samples, 0.99)
+			}
+		return {
+			'counters': dict(_counters),
+			'gauges': dict(_gauges),
+			'timings': timings
+		}
+
+
+def reset():
+	# Forget every metric. Mainly useful between benchmark runs.
+	with _lock:
+		_counters.clear()
+		_gauges.clear()
+		_timings.clear()
@@ -0,0 +1,245 @@
+'''
+Notifier
+
+Queued email notifications. Messages for the same recipient that arrive
+within the digest window are merged into one email by a compose function.
+Composed emails go through a persistent UploadQueue, so they survive a
+Connect restart and are retried with backoff, and are sent over one SMTP
+connection that is kept open between emails and reopened when it drops.
+
+Settings are read from a JSON file (SDE_NOTIFY_CONFIG, by default
+notify.json in the state folder) and can be overridden with environment
+variables:
+
+	SDE_SMTP_HOST, SDE_SMTP_PORT, SDE_SMTP_STARTTLS, SDE_SMTP_USER,
+	SDE_SMTP_PASSWORD, SDE_SMTP_SENDER, SDE_NOTIFY_WINDOW
+
+No login is attempted without a user, which is what a local debugging
+server such as aiosmtpd expects:
+
+	python -m aiosmtpd -n -l localhost:8025
+	SDE_SMTP_HOST=localhost SDE_SMTP_PORT=8025 SDE_SMTP_STARTTLS=0
+'''
+
+import json
+import logging
+import os
+import smtplib
+import socket
+import threading
+import time
+
+from hookLib import STATE_FOLDER
+from hookLib import instrument
+from hookLib import metrics
+from hookLib.uploadQueue import UploadQueue
+
+CONFIG_PATH = os.environ.get('SDE_NOTIFY_CONFIG', os.path.join(STATE_FOLDER, 'notify.json'))
+
+DEFAULTS = {
+	'host': 'smtp.gmail.com',
+	'port': 587,
+	'starttls': True,
+	'user': None,
+	'password': None,
+	'sender': 'vfxsde@gmail.com',
+	'timeout': 30.0,
+	# Seconds to collect messages for one recipient before sending a digest.
+	'window': 30.0
+}
+
+ENVIRONMENT = {
+	'SDE_SMTP_HOST': ('host', str),
+	'SDE_SMTP_PORT': ('port', int),
+	'SDE_SMTP_STARTTLS': ('starttls', lambda value: value.lower() not in ('0', 'false', 'no', '')),
+	'SDE_SMTP_USER': ('user', str),
+	'SDE_SMTP_PASSWORD': ('password', str),
+	'SDE_SMTP_SENDER': ('sender', str),
+	'SDE_NOTIFY_WINDOW': ('window', float)
+}
+
+# Seconds a connection may sit idle before it is checked with NOOP.
+IDLE_CHECK = 60.0
+
+# Errors after which the connection is reopened and the email sent again.
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, socket.error)
+
+
+def loadConfig(path=None):
+	# Defaults, updated from the config file and then from the environment.
+	config = dict(DEFAULTS)
+	path = path or CONFIG_PATH
+	if os.path.exists(path):
+		with open(path) as configFile:
+			config.update(json.load(configFile))
+	for variable, (key, convert) in ENVIRONMENT.items():
+		if variable in os.environ:
+			config[key] = convert(os.environ[variable])
+	return config
+
+
+def formatMessage(sender, to, cc, subject, body):
+	header = 'From: {0}\n'.format(sender)
+	header += 'To: {0}\n'.format(','.join(to))
+	if cc:
+		header += 'Cc: {0}\n'.format(','.join(cc))
+	header += 'Subject: {0}\n\n'.format(subject)
+	return header + body
+
+
+class SmtpConnection(object):
+	'''
+	One SMTP connection, opened on first use and reused for later emails.
+	'''
+
+	def __init__(self, config):
+		super(SmtpConnection, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+		self.config = config
+		self._lock = threading.Lock()
+		self._server = None
+		self._lastUsed = 0
+
+	def send(self, to, cc, subject, body):
+		message = formatMessage(self.config['sender'], to, cc, subject, body)
+		with self._lock:
+			try:
+				refused = self._connection().sendmail(self.config['sender'], to + cc, message)
+			except CONNECTION_ERRORS:
+				# The server dropped us since the last email, try once more on a fresh connection.
+				self.logger.debug('SMTP connection lost, reconnecting.')
+				self._close()
+				refused = self._connection().sendmail(self.config['sender'], to + cc, message)
+			self._lastUsed = time.time()
+		metrics.increment('notify.sent')
+		if refused:
+			self.logger.warning('Recipients refused: {0}'.format(', '.join(refused)))
+		return refused
+
+	def close(self):
+		with self._lock:
+			self._close()
+
+	def _connection(self):
+		# Called with the lock held.
+		if self._server is not None and time.time() - self._lastUsed > IDLE_CHECK:
+			try:
+				self._server.noop()
+			except CONNECTION_ERRORS:
+				self._close()
+		if self._server is None:
+			server = smtplib.SMTP(self.config['host'], self.config['port'], timeout=self.config['timeout'])
+			try:
+				if self.config['starttls']:
+					server.starttls()
+				if self.config['user']:
+					server.login(self.config['user'], self.config['password'])
+			except Exception:
+				server.close()
+				raise
+			metrics.increment('notify.connections')
+			self._server = server
+		return self._server
+
+	def _close(self):
+		if self._server is None:
+			return
+		try:
+			self._server.quit()
+		except CONNECTION_ERRORS + (smtplib.SMTPException,):
+			self._server.close()
+		self._server = None
+
+
+class Notifier(object):
+	'''
+	Collects messages per recipient and sends one email per recipient and window.
+
+	compose(items) turns the items collected for a recipient into a
+	(subject, body) pair. Items must be JSON serialisable.
+	'''
+
+	def __init__(self, name, compose, config=None, folder=STATE_FOLDER):
+		super(Notifier, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+		self.name = name
+		self.compose = compose
+		self.config = config or loadConfig()
+		self.connection = SmtpConnection(self.config)
+		self.pendingPath = os.path.join(folder, '{0}Pending.json'.format(name))
+		self.queue = UploadQueue(name, self._send, os.path.join(folder, '{0}Queue.json'.format(name)), concurrency=1, maxAttempts=5)
+
+		self._lock = threading.Lock()
+		self._pending = {}
+		self._timer = None
+
+	def start(self):
+		# Send anything left over from the last run.
+		self.queue.start()
+		with self._lock:
+			self._pending = self._load()
+			if self._pending:
+				self._startTimer()
+
+	def notify(self, recipient, item, cc=None):
+		# Queue item for recipient, it is sent once the digest window closes.
+		with self._lock:
+			entry = self._pending.setdefault(recipient, {'items': [], 'cc': []})
+			entry['items'].append(item)
+			entry['cc'].extend(address for address in cc or [] if address not in entry['cc'] and address != recipient)
+			self._save()
+			self._startTimer()
+		metrics.increment('{0}.queued'.format(self.name))
+
+	def flush(self):
+		# Compose and queue one email per recipient for everything collected so far.
+		with self._lock:
+			pending, self._pending = self._pending, {}
+			self._timer = None
+			for recipient, entry in pending.items():
+				try:
+					subject, body = self.compose(entry['items'])
+				except Exception:
+					self.logger.exception('Failed to compose the notification for {0}.'.format(recipient))
+					continue
+				payload = {'to': [recipient], 'cc': entry['cc'], 'subject': subject, 'body': body}
+				self.queue.submit(payload, label=subject)
+				metrics.observe('{0}.itemsPerEmail'.format(self.name), len(entry['items']))
+			self._save()
+
+	def close(self):
+		self.connection.close()
+
+	@instrument.entryPoint('notify.send')
+	def _send(self, payload):
+		with instrument.phase(instrument.EMAIL):
+			self.connection.send(payload['to'], payload['cc'], payload['subject'], payload['body'])
+
+	def _startTimer(self):
+		# Called with the lock held.
+		if self._timer is None:
+			self._timer = threading.Timer(self.config['window'], self.flush)
+			self._timer.daemon = True
+			self._timer.start()
+
+	def _load(self):
+		if not os.path.exists(self.pendingPath):
+			return {}
+		try:
+			with open(self.pendingPath) as pendingFile:
+				return json.load(pendingFile)
+		except (IOError, ValueError):
+			self.logger.exception('Ignoring unreadable notifications {0}.'.format(self.pendingPath))
+			return {}
+
+	def _save(self):
+		# Called with the lock held.
+		try:
+			folder = os.path.dirname(self.pendingPath)
+			if not os.path.isdir(folder):
+				os.makedirs(folder)
+			with open(self.pendingPath, 'w') as pendingFile:
+				json.dump(self._pending, pendingFile, indent=1)
+		except (IOError, OSError):
+			self.logger.exception('Failed to save notifications {0}.'.format(self.pendingPath))
@@ -0,0 +1,253 @@
+'''
+Proxy Encoder
+
+Makes a review sized H.264 MP4 of an OUT file or sequence on the local
+machine, so only the proxy is sent to Ftrack's review encoder instead of the
+full resolution original.
+
+Sequences are split into frame ranges that are encoded by several encoder
+processes at once and then joined without re-encoding. Proxies are cached in
+PROXY_FOLDER under a fingerprint of the source (names, sizes and modification
+times of its files), so publishing the same file again reuses its proxy. When
+the cache grows past PROXY_LIMIT bytes, the least recently used proxies are
+removed.
+
+The encoder is ffmpeg unless SDE_PROXY_ENCODER names another executable that
+takes the same arguments.
+'''
+
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from hookLib import STATE_FOLDER
+from hookLib import metrics
+from hookLib import sequenceScanner
+
+logger = logging.getLogger(__name__)
+
+ENCODER = os.environ.get('SDE_PROXY_ENCODER', 'ffmpeg')
+
+# Where finished proxies are cached.
+PROXY_FOLDER = os.path.join(STATE_FOLDER, 'proxies')
+
+# Bytes the cached proxies may use before the least recently used are removed.
+PROXY_LIMIT = int(float(os.environ.get('SDE_PROXY_CACHE_GB', 20)) * 1024 ** 3)
+
+# Encoder processes run at once for a sequence, and the fewest frames worth a process.
+SEGMENT_PROCESSES = 4
+MIN_SEGMENT_FRAMES = 48
+
+FRAME_RATE = 24
+
+# Arguments shared by every encode.
+ENCODE_ARGUMENTS = [
+	'-vf', 'scale=1920:-2',
+	'-c:v', 'libx264', '-preset', 'fast', '-crf', '20',
+	'-pix_fmt', 'yuv420p', '-an'
+]
+
+# Extra input arguments per sequence extension, e.g. to display linear EXRs in sRGB.
+INPUT_ARGUMENTS = {
+	'.exr': ['-apply_trc', 'iec61966_2_1']
+}
+
+
+class ProxyError(RuntimeError):
+	'''
+	Raised when the encoder fails.
+	'''
+
+
+def available():
+	# True if the encoder executable can be found.
+	if os.path.isfile(ENCODER):
+		return True
+	for folder in os.environ.get('PATH', '').split(os.pathsep):
+		for name in (ENCODER, ENCODER + '.exe'):
+			if os.path.isfile(os.path.join(folder, name)):
+				return True
+	return False
+
+
+def _frames(sourcePath):
+	# (folder, pattern, frames) for a sequence path, or None for a single file.
+	folder, value = os.path.split(sourcePath.replace('\\', '/'))
+	parsed = sequenceScanner.parseValue(value)
+	if parsed is None:
+		return None
+	pattern = parsed[0]
+	names = sequenceScanner.expand(folder, value)
+	frames = [int(sequenceScanner.FRAME_PATTERN.match(name).group('frame')) for name in names]
+	return folder, pattern, frames
+
+
+def fingerprint(sourcePath):
+	# Hash of the names, sizes and modification times of the source files.
+	hasher = hashlib.sha1()
+	hasher.update(repr(ENCODE_ARGUMENTS).encode('utf-8'))
+	sequence = _frames(sourcePath)
+	if sequence is None:
+		paths = [sourcePath]
+	else:
+		folder, pattern, frames = sequence
+		paths = [os.path.join(folder, pattern % frame) for frame in frames]
+	for path in paths:
+		stat = os.stat(path)
+		hasher.update('{0}|{1}|{2}\n'.format(path, stat.st_size, stat.st_mtime).encode('utf-8'))
+	return hasher.hexdigest()
+
+
+def _run(command):
+	process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	output, errors = process.communicate()
+	if process.returncode != 0:
+		tail = errors.decode('utf-8', 'replace')[-2000:]
+		raise ProxyError('Encoder failed with code {0}: {1}'.format(process.returncode, tail))
+
+
+def _encodeMovie(sourcePath, outputPath):
+	_run([ENCODER, '-y', '-v', 'error', '-i', sourcePath] + ENCODE_ARGUMENTS + [outputPath])
+
+
+def _segments(frames):
+	# Split a sorted frame list into contiguous ranges, one per encoder process.
+	ranges = []
+	start = previous = frames[0]
+	for frame in frames[1:]:
+		if frame != previous + 1:
+			ranges.append((start, previous))
+			start = frame
+		previous = frame
+	ranges.append((start, previous))
+
+	count = max(1, min(SEGMENT_PROCESSES, len(frames) // MIN_SEGMENT_FRAMES))
+	size = -(-len(frames) // count)
+	segments = []
+	for first, last in ranges:
+		while first <= last:
+			end = min(last, first + size - 1)
+			segments.append((first, end))
+			first = end + 1
+	return segments
+
+
+def _encodeSequence(folder, pattern, frames, outputPath, workFolder):
+	extension = os.path.splitext(pattern)[1].lower()
+	inputPattern = os.path.join(folder, pattern)
+	segments = _segments(frames)
+	segmentPaths = [os.path.join(workFolder, 'segment{0:04d}.mp4'.format(index)) for index in range(len(segments))]
+
+	errors = []
+	lock = threading.Semaphore(SEGMENT_PROCESSES)
+
+	def encode(first, last, segmentPath):
+		with lock:
+			try:
+				_run(
+					[ENCODER, '-y', '-v', 'error', '-framerate', str(FRAME_RATE), '-start_number', str(first)] +
+					INPUT_ARGUMENTS.get(extension, []) +
+					['-i', inputPattern, '-frames:v', str(last - first + 1)] +
+					ENCODE_ARGUMENTS + [segmentPath]
+				)
+			except Exception as error:
+				errors.append(error)
+
+	threads = []
+	for (first, last), segmentPath in zip(segments, segmentPaths):
+		thread = threading.Thread(target=encode, args=(first, last, segmentPath))
+		thread.start()
+		threads.append(thread)
+	for thread in threads:
+		thread.join()
+	if errors:
+		raise errors[0]
+
+	if len(segmentPaths) == 1:
+		shutil.move(segmentPaths[0], outputPath)
+		return
+
+	# Join the segments without encoding them again.
+	listPath = os.path.join(workFolder, 'segments.txt')
+	with open(listPath, 'w') as listFile:
+		for segmentPath in segmentPaths:
+			listFile.write("file '{0}'\n".format(segmentPath.replace('\\', '/')))
+	_run([ENCODER, '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', listPath, '-c', 'copy', outputPath])
+
+
+def makeProxy(sourcePath):
+	'''
+	Return the path of a review proxy for sourcePath, encoding it if needed.
+	sourcePath is a file or a sequence in "name.%04d.exr [1001-1240]" form.
+	'''
+	proxyPath = os.path.join(PROXY_FOLDER, fingerprint(sourcePath) + '.mp4')
+	try:
+		# The modification time orders the eviction.
+		os.utime(proxyPath, None)
+	except OSError:
+		pass
+	else:
+		metrics.increment('proxy.hits')
+		return proxyPath
+
+	if not os.path.isdir(PROXY_FOLDER):
+		os.makedirs(PROXY_FOLDER)
+	workFolder = tempfile.mkdtemp(dir=PROXY_FOLDER)
+	started = time.time()
+	try:
+		partPath = os.path.join(workFolder, 'proxy.mp4')
+		sequence = _frames(sourcePath)
+		if sequence is None:
+			_encodeMovie(sourcePath, partPath)
+		else:
+			folder, pattern, frames = sequence
+			if not frames:
+				raise ProxyError('No frames found for {0}.'.format(sourcePath))
+			_encodeSequence(folder, pattern, frames, partPath, workFolder)
+		os.rename(partPath, proxyPath)
+	finally:
+		shutil.rmtree(workFolder, ignore_errors=True)
+
+	elapsed = time.time() - started
+	metrics.increment('proxy.encoded')
+	metrics.observe('proxy.seconds', elapsed)
+	logger.info('Encoded proxy of {0} in {1:.1f}s.'.format(sourcePath, elapsed))
+	evict(keep=proxyPath)
+	return proxyPath
+
+
+def evict(keep=None, limit=None):
+	# Remove the least recently used proxies until the cache fits under limit, PROXY_LIMIT by default.
+	limit = PROXY_LIMIT if limit is None else limit
+	entries = []
+	total = 0
+	for name in os.listdir(PROXY_FOLDER):
+		proxyPath = os.path.join(PROXY_FOLDER, name)
+		if not name.endswith('.mp4') or not os.path.isfile(proxyPath):
+			continue
+		try:
+			stat = os.stat(proxyPath)
+		except OSError:
+			continue
+		total += stat.st_size
+		entries.append((stat.st_mtime, proxyPath, stat.st_size))
+
+	for lastUsed, proxyPath, size in sorted(entries):
+		if total <= limit:
+			break
+		if proxyPath == keep:
+			continue
+		try:
+			os.remove(proxyPath)
+		except OSError:
+			# Still being uploaded on Windows, try again next time.
+			continue
+		logger.debug('Evicted proxy {0}.'.format(proxyPath))
+		total -= size
+		metrics.increment('proxy.evicted')
+	metrics.setGauge('proxy.bytes', total)
@@ -0,0 +1,82 @@
+'''
+Selection Info
+
+Names and types of selected tasks for the discover hot path. Lookups are
+shared by every hook and cached per entity id for a short while, so a
+right-click costs at most one query however many hooks look at it, and
+none at all when it was already seen or is not a task selection.
+'''
+
+import threading
+import time
+
+from hookLib import metrics
+from hookLib import sessionProvider
+
+# Seconds a task's name and type are reused for.
+SELECTION_TTL = 30
+
+QUERY = 'select name, type.name from Task where id in ({0})'
+
+
+def taskIds(selection, single=False):
+	# Ids of a selection made only of tasks, or None. Needs no server access.
+	if not selection or (single and len(selection) != 1):
+		return None
+	if any(entity.get('entityType') != 'task' for entity in selection):
+		return None
+	return [entity['entityId'] for entity in selection]
+
+
+class SelectionInfo(object):
+	'''
+	Cache of {'name', 'type'} per task id.
+	'''
+
+	def __init__(self, ttl=SELECTION_TTL):
+		super(SelectionInfo, self).__init__()
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		self._tasks = {}
+
+	def tasks(self, ids):
+		# Info for each id, fetching the ones not cached in one query. Unknown ids are left out.
+		found = {}
+		misses = []
+		now = time.time()
+		with self._lock:
+			for taskId in ids:
+				cached = self._tasks.get(taskId)
+				if cached is not None and now - cached[0] < self.ttl:
+					found[taskId] = cached[1]
+				else:
+					misses.append(taskId)
+		metrics.increment('selectionInfo.hits', len(found))
+		if not misses:
+			return found
+
+		metrics.increment('selectionInfo.misses', len(misses))
+		with sessionProvider.session() as session:
+			result = session.query(QUERY.format(', '.join('"{0}"'.format(taskId) for taskId in misses)))
+			fetched = dict((task['id'], {'name': task['name'], 'type': task['type']['name']}) for task in result)
+		with self._lock:
+			for taskId, info in fetched.items():
+				self._tasks[taskId] = (now, info)
+		found.update(fetched)
+		return found
+
+	def names(self, ids):
+		# Name of each id in order, None for unknown ids.
+		tasks = self.tasks(ids)
+		return [tasks[taskId]['name'] if taskId in tasks else None for taskId in ids]
+
+	def invalidate(self, taskId=None):
+		with self._lock:
+			if taskId is None:
+				self._tasks.clear()
+			else:
+				self._tasks.pop(taskId, None)
+
+
+# Shared by every hook in the process.
+selections = SelectionInfo()
@@ -0,0 +1,211 @@
+'''
+Sequence Scanner
+
+Lists a folder and collapses numbered image frames into sequence entries
+such as "shot_v003.####.exr [1001-1240]", so an OUT folder holding several
+thousand frames becomes a handful of enumerator items. Movies are never
+collapsed, however they are numbered. The folder is streamed with
+os.scandir where available instead of building full path lists.
+
+Each entry has a label for display and a value for round tripping through an
+action form. The value of a sequence uses the "name.%04d.exr [1001-1240]"
+form Ftrack accepts for sequence component paths, and expand turns a value
+back into the names of the files it covers. rangedValue adds the frame range
+to a pattern that was stored without one.
+'''
+
+import os
+import re
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		scandir = None
+
+# Extensions of formats written as one file per frame. Numbered movies and
+# other containers, e.g. review_v001.mov, stay separate files.
+SEQUENCE_EXTENSIONS = frozenset((
+	'.exr', '.dpx', '.cin', '.tif', '.tiff', '.png', '.jpg', '.jpeg',
+	'.tga', '.sgi', '.rgb', '.hdr', '.bmp', '.iff', '.psd'
+))
+
+# A frame number between a "." or "_" and the extension.
+FRAME_PATTERN = re.compile(r'^(?P<head>.*[._])(?P<frame>\d+)(?P<tail>\.[A-Za-z0-9]+)$')
+
+# A sequence value, e.g. "shot_v003.%04d.exr [1001-1240]".
+VALUE_PATTERN = re.compile(r'^(?P<head>.*)%0(?P<padding>\d+)d(?P<tail>\S*) \[(?P<first>\d+)-(?P<last>\d+)\]$')
+
+# A sequence pattern without its frame range, e.g. "shot_v003.%04d.exr" or "shot_v003.####.exr".
+RANGELESS_PATTERN = re.compile(r'^(?P<head>.*?)(?:%0(?P<padding>\d+)d|(?P<hashes>#+))(?P<tail>[^#%\s]*)$')
+
+
+class SingleFile(object):
+	'''
+	A file that is not part of a sequence.
+	'''
+
+	def __init__(self, name):
+		super(SingleFile, self).__init__()
+		self.name = name
+		self.label = name
+		self.value = name
+
+	def files(self):
+		return [self.name]
+
+
+class Sequence(object):
+	'''
+	Numbered frames sharing a head, tail and padding.
+	'''
+
+	def __init__(self, head, tail, padding, frames):
+		super(Sequence, self).__init__()
+		self.head = head
+		self.tail = tail
+		self.padding = padding
+		self.frames = sorted(frames)
+
+		self.first = self.frames[0]
+		self.last = self.frames[-1]
+		self.pattern = '{0}%0{1}d{2}'.format(head, padding, tail)
+		self.value = '{0} [{1}-{2}]'.format(self.pattern, self.first, self.last)
+		self.name = '{0}{1}{2}'.format(head, '#' * padding, tail)
+		self.missing = missingFrames(self.frames)
+
+		self.label = '{0} [{1}-{2}]'.format(self.name, self.first, self.last)
+		if self.missing:
+			self.label += ' missing {0}'.format(formatRanges(self.missing))
+
+	def files(self):
+		return [self.pattern % frame for frame in self.frames]
+
+
+def missingFrames(frames):
+	# Frames absent between the first and last of a sorted list.
+	missing = []
+	for previous, current in zip(frames, frames[1:]):
+		missing.extend(range(previous + 1, current))
+	return missing
+
+
+def formatRanges(frames):
+	# "1010-1012, 1050" style summary of a sorted list of frames.
+	ranges = []
+	start = end = None
+	for frame in frames:
+		if start is not None and frame == end + 1:
+			end = frame
+			continue
+		if start is not None:
+			ranges.append(str(start) if start == end else '{0}-{1}'.format(start, end))
+		start = end = frame
+	if start is not None:
+		ranges.append(str(start) if start == end else '{0}-{1}'.format(start, end))
+	return ', '.join(ranges)
+
+
+def iterNames(folder):
+	# Stream the names of the files in folder.
+	if scandir is not None:
+		for entry in scandir(folder):
+			if entry.is_file():
+				yield entry.name
+	else:
+		for name in os.listdir(folder):
+			if os.path.isfile(os.path.join(folder, name)):
+				yield name
+
+
+def collapse(names):
+	# Group names into sequences and single files, sorted by label.
+	groups = {}
+	singles = []
+	match = FRAME_PATTERN.match
+	for name in names:
+		found = match(name)
+		if found is None or found.group('tail').lower() not in SEQUENCE_EXTENSIONS:
+			singles.append(name)
+			continue
+		frame = found.group('frame')
+		key = (found.group('head'), found.group('tail'), len(frame))
+		groups.setdefault(key, []).append((int(frame), name))
+
+	entries = [SingleFile(name) for name in singles]
+	for (head, tail, padding), frames in groups.items():
+		if len(frames) == 1:
+			entries.append(SingleFile(frames[0][1]))
+		else:
+			entries.append(Sequence(head, tail, padding, [frame for frame, name in frames]))
+	entries.sort(key=lambda entry: entry.label.lower())
+	return entries
+
+
+def scan(folder):
+	# The collapsed contents of folder, or an empty list if it doesn't exist.
+	if not os.path.isdir(folder):
+		return []
+	return collapse(iterNames(folder))
+
+
+def parseValue(value):
+	# (pattern, first, last) of a sequence value, or None for a single file.
+	found = VALUE_PATTERN.match(value)
+	if found is None:
+		return None
+	pattern = '{0}%0{1}d{2}'.format(found.group('head'), found.group('padding'), found.group('tail'))
+	return pattern, int(found.group('first')), int(found.group('last'))
+
+
+def expand(folder, value):
+	# The names of the existing files in folder that an entry value refers to.
+	parsed = parseValue(value)
+	if parsed is None:
+		return [value]
+	pattern, first, last = parsed
+	# One listing is cheaper than a stat per frame on a network share.
+	existing = set(iterNames(folder)) if os.path.isdir(folder) else set()
+	names = []
+	for frame in range(first, last + 1):
+		name = pattern % frame
+		if name in existing:
+			names.append(name)
+	return names
+
+
+def rangedValue(folder, pattern):
+	# The value of a sequence pattern that has no frame range, with the range of its frames in folder.
+	# None if pattern is not a sequence pattern or none of its frames exist.
+	found = RANGELESS_PATTERN.match(pattern)
+	if found is None or not os.path.isdir(folder):
+		return None
+	head, tail = found.group('head'), found.group('tail')
+	padding = int(found.group('padding') or len(found.group('hashes')))
+	frame = re.compile(r'^{0}(\d{{{1}}}){2}$'.format(re.escape(head), padding, re.escape(tail)))
+	frames = []
+	for name in iterNames(folder):
+		matched = frame.match(name)
+		if matched is not None:
+			frames.append(int(matched.group(1)))
+	if not frames:
+		return None
+	return Sequence(head, tail, padding, frames).value
+
+
+def displayName(value):
+	# A readable name for an entry value, e.g. "shot_v003" for a sequence.
+	found = VALUE_PATTERN.match(value)
+	if found is None:
+		return value
+	return found.group('head').rstrip('._') or value
+
+
+def displayLabel(value):
+	# A label for showing an entry value to people, e.g. "shot_v003 [1001-1240]" for a sequence.
+	found = VALUE_PATTERN.match(value)
+	if found is None:
+		return value
+	return '{0} [{1}-{2}]'.format(displayName(value), found.group('first'), found.group('last'))
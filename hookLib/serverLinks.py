@@ -0,0 +1,96 @@
+'''
+Server Links
+
+Finds the local file an asset version was published from. The Output
+Manager attaches it to each version as a component named 'Server link' in
+the unmanaged location, so its resource identifier is the filesystem path.
+The path and the version's asset type come back from one projected query
+and are cached per version.
+'''
+
+import logging
+import threading
+import time
+
+from hookLib import metrics
+
+COMPONENT_NAME = 'Server link'
+
+# Seconds a resolved version is reused for.
+LINK_TTL = 10 * 60
+
+QUERY = (
+	'select resource_identifier, component.version.asset.type.short from ComponentLocation '
+	'where component.version_id is "{0}" and component.name is "{1}"'
+)
+
+
+class ServerLinkError(LookupError):
+	'''
+	Raised when a version has no usable server link. reason is one of
+	MISSING or WRONG_TYPE.
+	'''
+
+	MISSING = 'missing'
+	WRONG_TYPE = 'wrongType'
+
+	def __init__(self, versionId, reason, message):
+		super(ServerLinkError, self).__init__(message)
+		self.versionId = versionId
+		self.reason = reason
+
+
+class ServerLinkResolver(object):
+	'''
+	Cache of {'path', 'assetType'} per asset version id.
+	'''
+
+	def __init__(self, ttl=LINK_TTL):
+		super(ServerLinkResolver, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		self._links = {}
+
+	def resolve(self, session, versionId, assetType=None):
+		# The server link of versionId. With assetType, versions of other types raise ServerLinkError.
+		with self._lock:
+			cached = self._links.get(versionId)
+		if cached is not None and time.time() - cached[0] < self.ttl:
+			metrics.increment('serverLinks.hits')
+			link = cached[1]
+		else:
+			metrics.increment('serverLinks.misses')
+			link = self._query(session, versionId)
+			with self._lock:
+				self._links[versionId] = (time.time(), link)
+
+		if assetType is not None and link['assetType'] != assetType:
+			raise ServerLinkError(
+				versionId, ServerLinkError.WRONG_TYPE,
+				'Version {0} is a {1!r} asset, not {2!r}.'.format(versionId, link['assetType'], assetType)
+			)
+		return link
+
+	def invalidate(self, versionId=None):
+		with self._lock:
+			if versionId is None:
+				self._links.clear()
+			else:
+				self._links.pop(versionId, None)
+
+	def _query(self, session, versionId):
+		location = session.query(QUERY.format(versionId, COMPONENT_NAME)).first()
+		if location is None or not location['resource_identifier']:
+			raise ServerLinkError(
+				versionId, ServerLinkError.MISSING,
+				'Version {0} has no {1!r} component.'.format(versionId, COMPONENT_NAME)
+			)
+		return {
+			'path': location['resource_identifier'],
+			'assetType': location['component']['version']['asset']['type']['short']
+		}
+
+
+# Shared by every hook in the process.
+serverLinks = ServerLinkResolver()
@@ -0,0 +1,85 @@
+'''
+Session Provider
+
+Creating an ftrack_api.Session authenticates, downloads the schema and starts
+with an empty entity cache, which costs hundreds of milliseconds. The hooks
+running inside one Connect process share a single session from here instead.
+
+The shared session keeps its schema and entity cache on disk under
+CACHE_FOLDER, so even the first session of a new Connect process starts
+warm. The entity cache file is named after the program, as dbm files do not
+survive several writers, and sessions made with createSession for worker
+threads keep their entities in memory. ftrack_api sessions are not thread
+safe, so the shared one is only handed out inside the session() context
+manager, which holds a lock for its duration. Keep the block to the
+queries, file system work inside it holds up every other hook thread.
+'''
+
+import contextlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+
+import ftrack_api
+import ftrack_api.cache
+
+from hookLib import instrument
+from hookLib import metrics
+
+logger = logging.getLogger(__name__)
+
+# Where the schema and the entity cache are kept between runs.
+CACHE_FOLDER = os.environ.get('SDE_FTRACK_CACHE', os.path.join(tempfile.gettempdir(), 'sde_ftrack_cache'))
+
+_lock = threading.RLock()
+_session = None
+
+
+def _cacheMaker(session):
+	# File backed entity cache, as described in the ftrack_api caching docs. One file per program.
+	if not os.path.isdir(CACHE_FOLDER):
+		os.makedirs(CACHE_FOLDER)
+	program = os.path.splitext(os.path.basename(sys.argv[0] if sys.argv and sys.argv[0] else 'python'))[0] or 'python'
+	return ftrack_api.cache.SerialisedCache(
+		ftrack_api.cache.FileCache(os.path.join(CACHE_FOLDER, 'entities.{0}.dbm'.format(program))),
+		encode=session.encode,
+		decode=session.decode
+	)
+
+
+def createSession(fileCache=False):
+	# A new session using the on-disk schema cache. Entities are cached in memory unless fileCache
+	# is set, which only the shared session does. Prefer session() unless a thread needs its own.
+	metrics.increment('session.created')
+	logger.debug('Creating ftrack_api session.')
+	return instrument.countSession(ftrack_api.Session(
+		cache=_cacheMaker if fileCache else None,
+		schema_cache_path=CACHE_FOLDER,
+		auto_connect_event_hub=False
+	))
+
+
+@contextlib.contextmanager
+def session():
+	# The shared session, locked against other threads until the block ends.
+	global _session
+	with _lock:
+		if _session is None:
+			_session = createSession(fileCache=True)
+		else:
+			metrics.increment('session.reused')
+		yield _session
+
+
+def reset():
+	# Drop the shared session, e.g. after the server connection was lost.
+	global _session
+	with _lock:
+		if _session is not None:
+			try:
+				_session.close()
+			except Exception:
+				logger.debug('Failed to close session.', exc_info=True)
+		_session = None
@@ -0,0 +1,241 @@
+'''
+Shot Paths
+
+Resolves the show, episode, act and shot of a task and the folders the hooks
+work with, using one projected query per task instead of a walk over the
+task's parents. Results are cached per task for CONTEXT_TTL seconds.
+
+Shot folders follow one of several layouts. The layout a project uses is
+probed once, on the first task resolved for that project, and then
+remembered. More layouts can be added with registerLayout. Several tasks
+can be resolved at once with ShotPathResolver.resolveMany.
+'''
+
+import logging
+import os
+import threading
+import time
+
+from hookLib import metrics
+from hookLib import sessionProvider
+
+# Seconds a resolved task is reused for.
+CONTEXT_TTL = 5 * 60
+
+# Shot folder layouts relative to the project root, tried in order.
+LAYOUTS = [
+	('A', '{show}/{episode}/shots/{showShort}{episode}_{act}_{shot}'),
+	('B', '{show}/episodes/{episode}/shots/{showShort}{episode}_{act}_{shot}')
+]
+
+# Output folder inside a shot folder.
+OUT_FOLDER = 'out'
+
+# Editorial transfer folder relative to the transfer root.
+DESTINATION_TEMPLATE = '{show}/{episode}/vfx_for_editorial/{act}/'
+
+# Object types that name each level of the hierarchy.
+LEVELS = {
+	'Shot': 'shot',
+	'Act': 'act',
+	'Sequence': 'act',
+	'Episode': 'episode'
+}
+
+QUERY = (
+	'select id, name, object_type.name, project_id, project.name, project.custom_attributes, '
+	'ancestors.name, ancestors.object_type.name from Task where id is "{0}"'
+)
+
+
+class ShotPathError(ValueError):
+	'''
+	Raised when a task cannot be mapped to a shot folder.
+	'''
+
+
+class ShotContext(object):
+	'''
+	Names and paths for one task. Paths are relative to the roots they were resolved against.
+	'''
+
+	def __init__(self, taskId, projectId, names, projectAttributes):
+		super(ShotContext, self).__init__()
+		self.taskId = taskId
+		self.projectId = projectId
+		self.show = names.get('show')
+		self.episode = names.get('episode')
+		self.act = names.get('act')
+		self.shot = names.get('shot')
+		self.showShort = names.get('showShort')
+		self.projectAttributes = projectAttributes
+
+		self.layout = None
+		self.shotFolder = None
+		self.outFolder = None
+		self.destinationFolder = None
+
+	@property
+	def names(self):
+		return {
+			'show': self.show,
+			'episode': self.episode,
+			'act': self.act,
+			'shot': self.shot,
+			'showShort': self.showShort
+		}
+
+	@property
+	def shotName(self):
+		# e.g. "SDE101_A_010"
+		return '{0}{1}_{2}_{3}'.format(self.showShort, self.episode, self.act, self.shot)
+
+
+def registerLayout(name, template, first=False):
+	# Add a shot folder layout. Templates receive show, episode, act, shot and showShort.
+	layout = (name, template)
+	if first:
+		LAYOUTS.insert(0, layout)
+	else:
+		LAYOUTS.append(layout)
+
+
+class ShotPathResolver(object):
+	'''
+	Cached task to shot folder resolution shared by the hooks.
+	'''
+
+	def __init__(self, ttl=CONTEXT_TTL):
+		super(ShotPathResolver, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+		self.ttl = ttl
+
+		self._lock = threading.Lock()
+		# (taskId, root) -> (resolved, ShotContext)
+		self._contexts = {}
+		# (projectId, root) -> layout name
+		self._layouts = {}
+
+	def resolve(self, taskId, root):
+		# The ShotContext of a task, with its shot folder found under root.
+		# The shared session is only held for the query, not while the share is probed.
+		key = (taskId, root)
+		with self._lock:
+			cached = self._contexts.get(key)
+		if cached is not None and time.time() - cached[0] < self.ttl:
+			metrics.increment('shotPaths.hits')
+			return cached[1]
+
+		metrics.increment('shotPaths.misses')
+		with sessionProvider.session() as session:
+			context = self._query(session, taskId)
+		self._locate(context, root)
+		with self._lock:
+			self._contexts[key] = (time.time(), context)
+		return context
+
+	def resolveMany(self, taskIds, root, pool=None):
+		# Resolve several tasks with one query, locating their folders in parallel on pool.
+		# Returns {taskId: ShotContext or ShotPathError}.
+		results = {}
+		misses = []
+		now = time.time()
+		with self._lock:
+			for taskId in taskIds:
+				cached = self._contexts.get((taskId, root))
+				if cached is not None and now - cached[0] < self.ttl:
+					results[taskId] = cached[1]
+				else:
+					misses.append(taskId)
+		metrics.increment('shotPaths.hits', len(results))
+		metrics.increment('shotPaths.misses', len(misses))
+		if not misses:
+			return results
+
+		contexts = []
+		query = QUERY.replace('where id is "{0}"', 'where id in ({0})')
+		with sessionProvider.session() as session:
+			for task in session.query(query.format(', '.join('"{0}"'.format(taskId) for taskId in misses))):
+				try:
+					contexts.append(self._context(task))
+				except ShotPathError as error:
+					results[task['id']] = error
+		for taskId in misses:
+			if taskId not in results and taskId not in [context.taskId for context in contexts]:
+				results[taskId] = ShotPathError('Task {0} does not exist.'.format(taskId))
+
+		def locate(context):
+			try:
+				return self._locate(context, root)
+			except ShotPathError as error:
+				return error
+
+		if pool is None:
+			located = [locate(context) for context in contexts]
+		else:
+			located = [future.result() for future in pool.map(locate, contexts)]
+		for context, result in zip(contexts, located):
+			results[context.taskId] = result
+			if isinstance(result, ShotContext):
+				with self._lock:
+					self._contexts[(context.taskId, root)] = (time.time(), result)
+		return results
+
+	def invalidate(self, taskId=None, projectId=None):
+		# Forget cached tasks, and a project's layout if projectId is given.
+		with self._lock:
+			for key, (resolved, context) in list(self._contexts.items()):
+				if taskId in (None, context.taskId) and projectId in (None, context.projectId):
+					del self._contexts[key]
+			for key in list(self._layouts):
+				if projectId in (None, key[0]):
+					del self._layouts[key]
+
+	def _query(self, session, taskId):
+		return self._context(session.query(QUERY.format(taskId)).one())
+
+	def _context(self, task):
+		project = task['project']
+		attributes = dict(project['custom_attributes'])
+
+		names = {'show': project['name'], 'showShort': attributes.get('proj')}
+		if task['object_type']['name'] == 'Shot':
+			names['shot'] = task['name']
+		for ancestor in task['ancestors']:
+			level = LEVELS.get(ancestor['object_type']['name'])
+			if level is not None:
+				names[level] = ancestor['name']
+
+		missing = [level for level in ('show', 'episode', 'act', 'shot', 'showShort') if not names.get(level)]
+		if missing:
+			raise ShotPathError('Not enough variables to map current project.')
+		return ShotContext(task['id'], task['project_id'], names, attributes)
+
+	def _locate(self, context, root):
+		# Find the shot folder, trying the project's known layout first.
+		with self._lock:
+			known = self._layouts.get((context.projectId, root))
+		layouts = sorted(LAYOUTS, key=lambda layout: layout[0] != known)
+
+		for name, template in layouts:
+			shotFolder = template.format(**context.names)
+			if os.path.isdir(os.path.join(root, shotFolder, OUT_FOLDER)):
+				if name != known:
+					self.logger.debug('Project {0} uses layout {1}.'.format(context.projectId, name))
+					with self._lock:
+						self._layouts[(context.projectId, root)] = name
+				context.layout = name
+				context.shotFolder = shotFolder
+				context.outFolder = '{0}/{1}/'.format(shotFolder, OUT_FOLDER)
+				context.destinationFolder = DESTINATION_TEMPLATE.format(**context.names)
+				return context
+			if name == known:
+				# The known layout should match every shot of the project.
+				self.logger.debug('Shot {0} does not follow layout {1}.'.format(context.shotName, name))
+
+		raise ShotPathError('Output folder does not exist')
+
+
+# Shared by every hook in the process.
+resolver = ShotPathResolver()
@@ -0,0 +1,109 @@
+'''
+Status Registry
+
+Loads the statuses available to each project once and keeps them for a while,
+so hooks can refer to statuses by name instead of hard-coded ids.
+Projects are cached by their workflow schema, and entries are dropped again
+when an update event reports that a project or schema changed.
+'''
+
+import logging
+import threading
+import time
+
+# Seconds before statuses are loaded from the server again.
+STATUS_TTL = 600
+
+# Entity types whose updates mean a workflow has changed.
+SCHEMA_ENTITY_TYPES = ('projectschema', 'workflowschema', 'workflowschemas', 'workflowschemastatuses', 'status')
+
+
+def normalise(name):
+	# Status names are matched case insensitively.
+	return (name or '').strip().lower()
+
+
+class StatusRegistry(object):
+	'''
+	Cache of status entities keyed by project and status name.
+	'''
+
+	def __init__(self, session, ttl=STATUS_TTL):
+		super(StatusRegistry, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+		self.session = session
+		self.ttl = ttl
+
+		self._lock = threading.RLock()
+		# Every status on the server: (loaded, {id: status}).
+		self._all = None
+		# projectId -> schemaId
+		self._projectSchemas = {}
+		# schemaId -> (loaded, {name: status})
+		self._schemas = {}
+
+	def nameOf(self, statusId):
+		# The normalised name of a status id.
+		status = self._allStatuses().get(statusId)
+		if status is None:
+			return None
+		return normalise(status['name'])
+
+	def status(self, projectId, name):
+		# The status called name in the project's task workflow, None if the workflow has no such status.
+		# A status of the same name from another workflow would be rejected by the server.
+		return self._projectStatuses(projectId).get(normalise(name))
+
+	def invalidate(self, projectId=None, schemaId=None):
+		# Forget cached statuses. With no arguments everything is dropped.
+		with self._lock:
+			if projectId is None and schemaId is None:
+				self._all = None
+				self._projectSchemas.clear()
+				self._schemas.clear()
+				return
+			if projectId is not None:
+				schemaId = self._projectSchemas.pop(projectId, schemaId)
+			if schemaId is not None:
+				self._schemas.pop(schemaId, None)
+
+	def handleEvent(self, event):
+		# Drop cached statuses affected by an ftrack.update event.
+		for entity in event['data'].get('entities', []):
+			entityType = entity.get('entityType', '').lower()
+			if entityType in SCHEMA_ENTITY_TYPES:
+				self.logger.debug('Workflow {0} changed, clearing status cache.'.format(entity.get('entityId')))
+				self.invalidate()
+				return
+			if entityType == 'show':
+				keys = [key.lower() for key in entity.get('keys', [])]
+				if 'projectschemaid' in keys or 'project_schema_id' in keys:
+					self.invalidate(projectId=entity.get('entityId'))
+
+	def _expired(self, loaded):
+		return time.time() - loaded > self.ttl
+
+	def _allStatuses(self):
+		with self._lock:
+			if self._all is None or self._expired(self._all[0]):
+				statuses = self.session.query('select id, name from Status')
+				self._all = (time.time(), dict((status['id'], status) for status in statuses))
+			return self._all[1]
+
+	def _projectStatuses(self, projectId):
+		with self._lock:
+			schemaId = self._projectSchemas.get(projectId)
+			if schemaId is None:
+				project = self.session.query(
+					'select project_schema_id from Project where id is "{0}"'.format(projectId)
+				).one()
+				schemaId = self._projectSchemas[projectId] = project['project_schema_id']
+
+			cached = self._schemas.get(schemaId)
+			if cached is None or self._expired(cached[0]):
+				schema = self.session.get('ProjectSchema', schemaId)
+				statuses = dict((normalise(status['name']), status) for status in schema.get_statuses('Task'))
+				cached = self._schemas[schemaId] = (time.time(), statuses)
+				self.logger.debug('Loaded {0} statuses for schema {1}.'.format(len(statuses), schemaId))
+			return cached[1]
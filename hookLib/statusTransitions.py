@@ -0,0 +1,91 @@
+'''
+Status Transitions
+
+A declarative table of status changes keyed by
+(entity type, current status name, whether the task has users).
+Any part of the key can be ANY. Lookups try the most specific key first and
+never do more than four dictionary lookups.
+
+Studios with a different workflow can point SDE_STATUS_RULES at a JSON file
+holding a list of rules such as:
+
+	{"entityType": "task", "status": "not started", "users": true, "target": "assigned"}
+
+where "*" stands for ANY and a null target means "leave the status alone".
+'''
+
+import json
+import os
+
+from hookLib.statusRegistry import normalise
+
+# Matches any value in a rule key.
+ANY = '*'
+
+_MISSING = object()
+
+# (entity type, current status, has users) -> new status, None keeps the status.
+DEFAULT_RULES = [
+	# Tasks that are on hold or omitted are never toggled.
+	(('task', 'on hold', ANY), None),
+	(('task', 'omitted', ANY), None),
+	# Task switches from NOT STARTED to ASSIGNED when artists are added.
+	(('task', 'not started', True), 'assigned'),
+	(('task', 'not started', False), None),
+	# Task switches back to NOT STARTED when the last artist is removed.
+	(('task', ANY, False), 'not started'),
+	# Switch status to FOR REVIEW when a new asset is uploaded.
+	(('assetversion', 'for review', ANY), None),
+	(('assetversion', ANY, ANY), 'for review')
+]
+
+
+class TransitionTable(object):
+	'''
+	Constant time lookup of the status a task should move to.
+	'''
+
+	def __init__(self, rules=None):
+		super(TransitionTable, self).__init__()
+		self._rules = {}
+		for (entityType, status, hasUsers), target in (rules if rules is not None else DEFAULT_RULES):
+			if status != ANY:
+				status = normalise(status)
+			if target is not None:
+				target = normalise(target)
+			self._rules[(entityType.lower(), status, hasUsers)] = target
+
+	@classmethod
+	def fromFile(cls, filePath):
+		# Build a table from a JSON list of rules.
+		with open(filePath) as ruleFile:
+			data = json.load(ruleFile)
+		rules = []
+		for rule in data:
+			key = (rule['entityType'], rule.get('status', ANY), rule.get('users', ANY))
+			rules.append((key, rule.get('target')))
+		return cls(rules)
+
+	@classmethod
+	def fromEnvironment(cls):
+		# Use SDE_STATUS_RULES when it is set, otherwise the default rules.
+		filePath = os.environ.get('SDE_STATUS_RULES')
+		if filePath:
+			return cls.fromFile(filePath)
+		return cls()
+
+	def lookup(self, entityType, statusName, hasUsers):
+		# The name of the new status, or None if the status should not change.
+		entityType = entityType.lower()
+		statusName = normalise(statusName)
+		hasUsers = bool(hasUsers)
+		for key in (
+			(entityType, statusName, hasUsers),
+			(entityType, statusName, ANY),
+			(entityType, ANY, hasUsers),
+			(entityType, ANY, ANY)
+		):
+			target = self._rules.get(key, _MISSING)
+			if target is not _MISSING:
+				return target
+		return None
@@ -0,0 +1,159 @@
+'''
+Transfer Manifest
+
+A JSON file kept in each destination folder that records the size, the
+modification time of the source and a digest of every file delivered there.
+copyEngine.copyFiles uses it to skip files that have not changed since the
+last transfer, so re-delivering a sequence after a fix only copies the frames
+that were re-rendered. The manifest is saved every SAVE_EVERY files, which
+lets an interrupted transfer pick up after the last recorded frame.
+
+Transfers into the same folder share one manifest per process, see load,
+and save merges in entries another process wrote since, so concurrent
+deliveries to one folder never drop each other's files.
+
+The digests are made while copying. verify hashes the folder again to show
+that what was delivered is still intact, see verifyDelivery_v01.py.
+'''
+
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+from hookLib import digests
+
+# Name of the manifest inside a destination folder.
+MANIFEST_NAME = '.sde_transfer_manifest.json'
+
+# Completed files between saves of the manifest.
+SAVE_EVERY = 25
+
+# Allowed difference between modification times, filesystems round them differently.
+MTIME_TOLERANCE = 0.001
+
+# Manifests in use, by folder.
+_sharedLock = threading.Lock()
+_shared = weakref.WeakValueDictionary()
+
+
+class TransferManifest(object):
+	'''
+	Files delivered to one destination folder, keyed by file name.
+	'''
+
+	def __init__(self, folder):
+		super(TransferManifest, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+		self.folder = folder
+		self.path = os.path.join(folder, MANIFEST_NAME)
+		self.files = {}
+
+		self._lock = threading.Lock()
+		self._saveLock = threading.Lock()
+		self._unsaved = 0
+
+	@classmethod
+	def load(cls, folder):
+		# The manifest of a folder, shared with every other transfer into it that is still running.
+		# Read from disk when nobody holds it, starting empty if there is none yet.
+		key = os.path.normcase(os.path.abspath(folder))
+		with _sharedLock:
+			manifest = _shared.get(key)
+			if manifest is None:
+				manifest = _shared[key] = cls(folder)
+				manifest.files = manifest._read()
+		return manifest
+
+	def _read(self):
+		if not os.path.exists(self.path):
+			return {}
+		try:
+			with open(self.path) as manifestFile:
+				return json.load(manifestFile).get('files', {})
+		except (IOError, ValueError):
+			self.logger.warning('Ignoring unreadable manifest {0}.'.format(self.path))
+			return {}
+
+	def unchanged(self, source, destination):
+		# True if destination already holds the current version of source.
+		if os.path.isdir(destination):
+			destination = os.path.join(destination, os.path.basename(source))
+		entry = self.files.get(os.path.basename(destination))
+		if entry is None or not os.path.exists(destination) or not os.path.exists(source):
+			return False
+		sourceStat = os.stat(source)
+		return (
+			entry['size'] == sourceStat.st_size and
+			abs(entry['mtime'] - sourceStat.st_mtime) < MTIME_TOLERANCE and
+			os.path.getsize(destination) == entry['size']
+		)
+
+	def record(self, result, sourceStat):
+		# Remember a completed copy and save now and then.
+		with self._lock:
+			self.files[os.path.basename(result['destination'])] = {
+				'size': sourceStat.st_size,
+				'mtime': sourceStat.st_mtime,
+				'digest': result.get('digest'),
+				'algorithm': result.get('algorithm'),
+				'transferred': time.time()
+			}
+			self._unsaved += 1
+			due = self._unsaved >= SAVE_EVERY
+		if due:
+			self.save()
+
+	def verify(self, pool=None):
+		# Hash every recorded file again. Returns (name, problem) pairs, empty if the folder is intact.
+		with self._lock:
+			files = dict(self.files)
+		problems = []
+		hashed = {}
+		for name, entry in sorted(files.items()):
+			filePath = os.path.join(self.folder, name)
+			if not os.path.exists(filePath):
+				problems.append((name, 'missing'))
+			elif os.path.getsize(filePath) != entry['size']:
+				problems.append((name, 'size is {0} bytes, expected {1}'.format(os.path.getsize(filePath), entry['size'])))
+			elif entry.get('digest'):
+				hashed.setdefault(entry['algorithm'], []).append(name)
+			else:
+				problems.append((name, 'no digest recorded'))
+
+		for algorithm, names in hashed.items():
+			results = digests.fileDigests([os.path.join(self.folder, name) for name in names], algorithm, pool=pool)
+			for name in names:
+				actual = results[os.path.join(self.folder, name)]
+				expected = files[name]['digest']
+				if isinstance(actual, Exception):
+					problems.append((name, 'unreadable: {0}'.format(actual)))
+				elif actual != expected:
+					problems.append((name, '{0} digest does not match'.format(algorithm)))
+		return sorted(problems)
+
+	def save(self):
+		# Write the manifest through a temporary file so readers never see half of it.
+		# Entries written by another process since this one was read are kept.
+		temporaryPath = '{0}.{1}.tmp'.format(self.path, os.getpid())
+		with self._saveLock:
+			onDisk = self._read()
+			with self._lock:
+				for name, entry in onDisk.items():
+					self.files.setdefault(name, entry)
+				data = json.dumps({'files': self.files}, indent=1, sort_keys=True)
+				self._unsaved = 0
+			try:
+				with open(temporaryPath, 'w') as manifestFile:
+					manifestFile.write(data)
+				if hasattr(os, 'replace'):
+					os.replace(temporaryPath, self.path)
+				else:
+					if os.path.exists(self.path):
+						os.remove(self.path)
+					os.rename(temporaryPath, self.path)
+			except (IOError, OSError):
+				self.logger.exception('Failed to save manifest {0}.'.format(self.path))
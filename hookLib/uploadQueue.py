@@ -0,0 +1,211 @@
+'''
+Upload Queue
+
+A persistent job queue with a concurrency limit and retries. Every change to
+a job is written to a JSON file, so queued and interrupted jobs are picked up
+again when Connect restarts. A failed job is retried with exponential backoff
+until it has been tried maxAttempts times.
+
+Jobs are plain dictionaries:
+
+	{'id', 'label', 'payload', 'status', 'attempts', 'error', 'created', 'updated'}
+
+where status is one of QUEUED, RUNNING, DONE or FAILED. jobs() returns copies
+of them for display. The handler gets the job's payload and may record its
+progress in it with checkpoint, so payloads have to be JSON serialisable.
+'''
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+from hookLib import metrics
+from hookLib import executor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Finished jobs kept in the file for the status display.
+KEEP_FINISHED = 100
+
+
+class UploadQueue(object):
+	'''
+	Runs handler(payload) for each job, at most concurrency at a time.
+	'''
+
+	def __init__(self, name, handler, path, concurrency=2, maxAttempts=3, backoff=30.0):
+		super(UploadQueue, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+		self.name = name
+		self.handler = handler
+		self.path = path
+		self.concurrency = concurrency
+		self.maxAttempts = maxAttempts
+		self.backoff = backoff
+
+		self._condition = threading.Condition()
+		self._jobs = []
+		self._running = 0
+		self._thread = None
+		self._pool = executor.pool(name, size=concurrency)
+
+	def start(self):
+		# Load persisted jobs and start scheduling them.
+		with self._condition:
+			if self._thread is not None:
+				return
+			self._load()
+			self._thread = threading.Thread(target=self._schedule, name='{0}-scheduler'.format(self.name))
+			self._thread.daemon = True
+			self._thread.start()
+
+	def submit(self, payload, label=None):
+		# Queue a job and return its id.
+		now = time.time()
+		job = {
+			'id': str(uuid.uuid4()),
+			'label': label or '',
+			'payload': payload,
+			'status': QUEUED,
+			'attempts': 0,
+			'error': None,
+			'created': now,
+			'updated': now,
+			'notBefore': now
+		}
+		with self._condition:
+			self._jobs.append(job)
+			self._save()
+			self._condition.notify()
+		metrics.increment('{0}.submitted'.format(self.name))
+		return job['id']
+
+	def checkpoint(self, payload, **values):
+		# Store values in a running job's payload and save the queue, so a retry,
+		# also after a restart, can skip the steps that already succeeded.
+		with self._condition:
+			payload.update(values)
+			self._save()
+
+	def jobs(self, statuses=None, match=None):
+		# Copies of the jobs, optionally filtered by status or a predicate on the payload.
+		with self._condition:
+			jobs = [dict(job) for job in self._jobs]
+		if statuses is not None:
+			jobs = [job for job in jobs if job['status'] in statuses]
+		if match is not None:
+			jobs = [job for job in jobs if match(job['payload'])]
+		return jobs
+
+	def counts(self):
+		# Number of jobs in each state.
+		counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+		for job in self.jobs():
+			counts[job['status']] += 1
+		return counts
+
+	def _load(self):
+		if not os.path.exists(self.path):
+			return
+		try:
+			with open(self.path) as queueFile:
+				self._jobs = json.load(queueFile)
+		except (IOError, ValueError):
+			self.logger.exception('Ignoring unreadable upload queue {0}.'.format(self.path))
+			self._jobs = []
+		# Jobs that were running when Connect stopped start again.
+		for job in self._jobs:
+			if job['status'] == RUNNING:
+				job['status'] = QUEUED
+		resumed = len([job for job in self._jobs if job['status'] == QUEUED])
+		if resumed:
+			self.logger.info('Resuming {0} queued jobs.'.format(resumed))
+
+	def _save(self):
+		# Called with the condition held.
+		finished = [job for job in self._jobs if job['status'] in (DONE, FAILED)]
+		for job in finished[:-KEEP_FINISHED]:
+			self._jobs.remove(job)
+		folder = os.path.dirname(self.path)
+		try:
+			if folder and not os.path.isdir(folder):
+				os.makedirs(folder)
+			temporaryPath = self.path + '.tmp'
+			with open(temporaryPath, 'w') as queueFile:
+				json.dump(self._jobs, queueFile, indent=1)
+			if hasattr(os, 'replace'):
+				os.replace(temporaryPath, self.path)
+			else:
+				if os.path.exists(self.path):
+					os.remove(self.path)
+				os.rename(temporaryPath, self.path)
+		except (IOError, OSError):
+			self.logger.exception('Failed to save upload queue {0}.'.format(self.path))
+
+	def _schedule(self):
+		while True:
+			with self._condition:
+				job, wait = self._nextJob()
+				if job is None:
+					self._condition.wait(wait)
+					continue
+				job['status'] = RUNNING
+				job['attempts'] += 1
+				job['updated'] = time.time()
+				self._running += 1
+				self._save()
+				metrics.setGauge('{0}.running'.format(self.name), self._running)
+			self._pool.submit(self._run, job)
+
+	def _nextJob(self):
+		# The next job that may start now, or how long to wait for one.
+		if self._running >= self.concurrency:
+			return None, None
+		now = time.time()
+		wait = None
+		for job in self._jobs:
+			if job['status'] != QUEUED:
+				continue
+			if job['notBefore'] <= now:
+				return job, None
+			delay = job['notBefore'] - now
+			wait = delay if wait is None else min(wait, delay)
+		return None, wait
+
+	def _run(self, job):
+		started = time.time()
+		error = None
+		try:
+			self.handler(job['payload'])
+		except Exception:
+			error = sys.exc_info()[1]
+			self.logger.exception('Job {0} ({1}) failed, attempt {2}.'.format(job['id'], job['label'], job['attempts']))
+		metrics.observe('{0}.seconds'.format(self.name), time.time() - started)
+
+		with self._condition:
+			self._running -= 1
+			job['updated'] = time.time()
+			if error is None:
+				job['status'] = DONE
+				job['error'] = None
+				metrics.increment('{0}.done'.format(self.name))
+			elif job['attempts'] < self.maxAttempts:
+				job['status'] = QUEUED
+				job['error'] = str(error)
+				job['notBefore'] = time.time() + self.backoff * 2 ** (job['attempts'] - 1)
+				metrics.increment('{0}.retried'.format(self.name))
+			else:
+				job['status'] = FAILED
+				job['error'] = str(error)
+				metrics.increment('{0}.failed'.format(self.name))
+			self._save()
+			metrics.setGauge('{0}.running'.format(self.name), self._running)
+			self._condition.notify()
@@ -0,0 +1,183 @@
+'''
+Worker Pool
+
+A fixed number of threads working through a queue of calls. submit returns
+a Future so callers can wait for a result or attach completion callbacks.
+Each pool reports its queue length, busy workers and call durations to
+hookLib.metrics under pool.<name>.
+Written against the standard library only, so it runs under the Python 2
+interpreter bundled with Ftrack Connect as well as Python 3.
+'''
+
+import logging
+import sys
+import threading
+import time
+
+from hookLib import metrics
+
+try:
+	import Queue as queue
+except ImportError:
+	import queue
+
+
+class Future(object):
+	'''
+	The eventual result of a call submitted to a WorkerPool.
+	'''
+
+	def __init__(self):
+		super(Future, self).__init__()
+		self._done = threading.Event()
+		self._lock = threading.Lock()
+		self._result = None
+		self._exception = None
+		self._callbacks = []
+
+	def done(self):
+		return self._done.is_set()
+
+	def result(self, timeout=None):
+		# Wait for the call and return its value, re-raising any error.
+		if not self._done.wait(timeout):
+			raise RuntimeError('Timed out waiting for result.')
+		if self._exception is not None:
+			raise self._exception
+		return self._result
+
+	def exception(self, timeout=None):
+		if not self._done.wait(timeout):
+			raise RuntimeError('Timed out waiting for result.')
+		return self._exception
+
+	def add_done_callback(self, callback):
+		# Call callback(future) once finished, straight away if already done.
+		with self._lock:
+			if not self._done.is_set():
+				self._callbacks.append(callback)
+				return
+		self._runCallback(callback)
+
+	def setResult(self, result):
+		self._result = result
+		self._finish()
+
+	def setException(self, exception):
+		self._exception = exception
+		self._finish()
+
+	def _finish(self):
+		with self._lock:
+			self._done.set()
+			callbacks, self._callbacks = self._callbacks, []
+		for callback in callbacks:
+			self._runCallback(callback)
+
+	def _runCallback(self, callback):
+		try:
+			callback(self)
+		except Exception:
+			logging.getLogger(__name__).exception('Future callback failed.')
+
+
+class WorkerPool(object):
+	'''
+	Bounded pool of daemon threads. Threads are started on first use.
+	'''
+
+	def __init__(self, name, size=4, maxQueue=0):
+		super(WorkerPool, self).__init__()
+		self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+		self.name = name
+		self.size = max(1, size)
+
+		self._queue = queue.Queue(maxsize=maxQueue)
+		self._threads = []
+		self._lock = threading.Lock()
+		self._shutdown = False
+		self._active = 0
+		self._completed = 0
+		self._failed = 0
+
+	def submit(self, fn, *args, **kwargs):
+		# Queue fn(*args, **kwargs). Blocks while a bounded queue is full.
+		if self._shutdown:
+			raise RuntimeError('Worker pool {0} has been shut down.'.format(self.name))
+		self._startThreads()
+		future = Future()
+		self._queue.put((future, fn, args, kwargs, time.time()))
+		metrics.setGauge('pool.{0}.queued'.format(self.name), self._queue.qsize())
+		return future
+
+	def map(self, fn, items):
+		# Run fn over items in parallel and return the futures in order.
+		return [self.submit(fn, item) for item in items]
+
+	def stats(self):
+		# Current load of the pool.
+		with self._lock:
+			return {
+				'size': self.size,
+				'threads': len(self._threads),
+				'queued': self._queue.qsize(),
+				'active': self._active,
+				'completed': self._completed,
+				'failed': self._failed
+			}
+
+	def shutdown(self, wait=True, timeout=None):
+		# Finish queued work, then stop the threads. timeout limits the wait for each thread.
+		with self._lock:
+			if self._shutdown:
+				return
+			self._shutdown = True
+			threads = list(self._threads)
+		for each in threads:
+			self._queue.put(None)
+		if wait:
+			for thread in threads:
+				thread.join(timeout)
+
+	def _startThreads(self):
+		with self._lock:
+			while len(self._threads) < self.size:
+				thread = threading.Thread(
+					target=self._work, name='{0}-{1}'.format(self.name, len(self._threads))
+				)
+				thread.daemon = True
+				thread.start()
+				self._threads.append(thread)
+
+	def _work(self):
+		while True:
+			item = self._queue.get()
+			if item is None:
+				break
+			future, fn, args, kwargs, queued = item
+			started = time.time()
+			metrics.setGauge('pool.{0}.active'.format(self.name), self._count('_active', 1))
+			metrics.observe('pool.{0}.waitSeconds'.format(self.name), started - queued)
+			try:
+				result = fn(*args, **kwargs)
+			except Exception:
+				self.logger.debug('Call in pool {0} failed.'.format(self.name), exc_info=True)
+				self._finished(started, '_failed')
+				future.setException(sys.exc_info()[1])
+			else:
+				self._finished(started, '_completed')
+				future.setResult(result)
+
+	def _count(self, attribute, amount):
+		with self._lock:
+			value = getattr(self, attribute) + amount
+			setattr(self, attribute, value)
+		return value
+
+	def _finished(self, started, outcome):
+		metrics.observe('pool.{0}.seconds'.format(self.name), time.time() - started)
+		metrics.increment('pool.{0}.{1}'.format(self.name, outcome.lstrip('_')))
+		self._count(outcome, 1)
+		metrics.setGauge('pool.{0}.active'.format(self.name), self._count('_active', -1))
+		metrics.setGauge('pool.{0}.queued'.format(self.name), self._queue.qsize())
@@ -3,23 +3,35 @@ Output Manager: a Hook for Ftrack Connect
 v04 by Joshua Krause
 
 Scans a project's OUT directory for files.
-User can select a file to to upload for web viewing.
+User can select one or more files to upload for web viewing.
 Also creates a link to the local file for synergy with the accompanying DJV View hook.
 '''
 
 import logging
 import getpass
-import threading
 import os.path
+import sys
 import ftrack
 import ftrack_api
 
-def async(fn):
-	# Run the uploading method on a separate thread so it doesn't cause the Action to fail.
-	def wrapper(*args, **kwargs):
-		thread = threading.Thread(target=fn, args=args, kwargs=kwargs)
-		thread.start()
-	return wrapper
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from hookLib import digests
+from hookLib import instrument
+from hookLib import sequenceScanner
+from hookLib.selectionInfo import selections, taskIds
+from hookLib.launchStore import LaunchStore
+from hookLib.listingCache import listings
+from hookLib.serverLinks import COMPONENT_NAME
+from hookLib.shotPaths import resolver, ShotPathError
+from hookLib.statusRegistry import StatusRegistry
+from hookLib import sessionProvider
+from hookLib import STATE_FOLDER
+from hookLib.uploadQueue import UploadQueue
+from hookLib import proxyEncoder
+
+# Count the legacy API's round trips in the trace log.
+instrument.countLegacyApi(ftrack)
 
 class OutputManager(object):
 	
@@ -28,6 +40,22 @@ class OutputManager(object):
 	projectRoot = 'Z:/projects/'
 	outputPath = 'out'
 	
+	# Task names the action is offered for.
+	taskNames = ('Compositing', 'animation')
+	
+	# Uploads running at once on the shared upload pool, and where queued uploads are kept between restarts.
+	uploadConcurrency = 2
+	uploadQueuePath = os.path.join(STATE_FOLDER, 'uploadQueue.json')
+	
+	# Upload a locally encoded proxy for review instead of the original.
+	useProxies = True
+	
+	# Prefix of the components ftrack.Review.makeReviewable creates.
+	reviewComponent = 'ftrackreview'
+	
+	# Status the task is set to when its files are published, looked up by name in the project's workflow.
+	publishedStatus = 'In progress'
+	
 	def __init__(self):
 		super(OutputManager, self).__init__()
 		
@@ -35,55 +63,196 @@ class OutputManager(object):
 		
 		if self.identifier is None:
 			raise ValueError('The action must be given an identifier.')
+		
+		self.uploads = UploadQueue('upload', self.processAsset, self.uploadQueuePath, concurrency=self.uploadConcurrency)
+		
+		# The task and folder of every open form, per user and selection, until it is submitted.
+		self.launches = LaunchStore('outputManager')
+		
+		# Created on first use, see statusRegistry.
+		self._statuses = None
 	
-	@async
-	def processAsset(self, outputPath, outputFile):
+	@instrument.entryPoint('outputManager.upload')
+	def processAsset(self, job):
 		# Uploads an asset to Ftrack and links to the original on the server.
-		try:
-			asset = self.task.createAsset(name=outputFile, assetType ='img')
-		except:
-			asset = self.task.getParent().createAsset(name=outputFile, assetType ='img')
-		version = asset.createVersion(taskid=self.task.getId())
-		componentPath = outputPath + "\\" + outputFile 
-		# Create a web viewable version, then attach the server link to it.
-		ftrack.Review.makeReviewable(version, filePath=componentPath)
-		linkedComponent = version.createComponent(name='Server link', path=componentPath)
-		version.publish()
+		# Runs as an upload queue job, which retries it if anything fails. Each step that
+		# succeeded is recorded in the job, so a retry carries on after the last one.
+		componentPath = os.path.join(job['outputPath'], job['outputFile'])
+		
+		# Hash the original, so what the server link points at can be checked later.
+		if not job.get('integrity'):
+			with instrument.phase(instrument.HASH):
+				self.uploads.checkpoint(job, integrity=self.linkIntegrity(componentPath))
+		
+		if job.get('versionId'):
+			# The version was created up front by createVersions, or by an earlier attempt.
+			version = ftrack.AssetVersion(job['versionId'])
+		else:
+			# Sequences are named after their head and linked with their frame range.
+			task = ftrack.Task(job['taskId'])
+			assetName = sequenceScanner.displayName(job['outputFile'])
+			try:
+				asset = task.createAsset(name=assetName, assetType ='img')
+			except:
+				asset = task.getParent().createAsset(name=assetName, assetType ='img')
+			version = asset.createVersion(taskid=task.getId())
+			self.uploads.checkpoint(job, versionId=version.getId())
 		
+		# Only create the components an earlier attempt did not.
+		components = dict((component.getName(), component) for component in version.getComponents())
+		reviewable = any(name.startswith(self.reviewComponent) for name in components)
+		if not reviewable:
+			reviewPath = self.reviewPath(job, componentPath)
+		
+		# Create a web viewable version, then attach the server link to the original.
+		with instrument.phase(instrument.UPLOAD):
+			if not reviewable:
+				ftrack.Review.makeReviewable(version, filePath=reviewPath)
+			linkedComponent = components.get(COMPONENT_NAME)
+			if linkedComponent is None:
+				linkedComponent = version.createComponent(name=COMPONENT_NAME, path=componentPath)
+			for key, value in job['integrity'].items():
+				linkedComponent.setMeta(key, value)
+			version.publish()
+	
+	def reviewPath(self, job, componentPath):
+		# The file sent for review: a proxy, encoded once per job, or the original.
+		reviewPath = job.get('reviewPath')
+		if reviewPath and os.path.exists(reviewPath):
+			return reviewPath
+		if self.useProxies and proxyEncoder.available():
+			with instrument.phase(instrument.ENCODE):
+				reviewPath = proxyEncoder.makeProxy(componentPath)
+			self.uploads.checkpoint(job, reviewPath=reviewPath)
+			return reviewPath
+		if self.useProxies:
+			self.logger.warning('Proxy encoder {0} not found, uploading the original.'.format(proxyEncoder.ENCODER))
+		return componentPath
+	
+	def linkIntegrity(self, componentPath):
+		# Component metadata describing the linked file or sequence: its digest, algorithm, file count and size.
+		# A sequence gets one digest made from the digests of its frames.
+		outputPath, outputFile = os.path.split(componentPath)
+		names = sequenceScanner.expand(outputPath, outputFile)
+		paths = [os.path.join(outputPath, name) for name in names]
+		hashed = digests.fileDigests(paths)
+		for filePath in paths:
+			if isinstance(hashed[filePath], Exception):
+				raise hashed[filePath]
+		if len(names) == 1:
+			digest = hashed[paths[0]]
+		else:
+			digest = digests.combine(dict((name, hashed[filePath]) for name, filePath in zip(names, paths)))
+		return {
+			'sde_digest': digest,
+			'sde_digest_algorithm': digests.ALGORITHM,
+			'sde_files': str(len(names)),
+			'sde_bytes': str(sum(os.path.getsize(filePath) for filePath in paths))
+		}
+	
+	def createVersions(self, taskId, outputFiles, userId=None):
+		# Creates an asset, or reuses an existing one, and a new version for every file, and sets the
+		# task to publishedStatus, all in a single commit.
+		# The versions are published by userId if given, otherwise by the API user.
+		# Returns (outputFile, versionId) pairs in the order given.
+		with sessionProvider.session() as session:
+			try:
+				task = session.query('select parent, project_id from Task where id is "{0}"'.format(taskId)).one()
+				assetType = session.query('AssetType where short is "img"').one()
+				
+				names = [sequenceScanner.displayName(outputFile) for outputFile in outputFiles]
+				assets = {}
+				# Only img assets are reused, DJV View rejects sequence links on assets of other types.
+				for asset in session.query('select name from Asset where parent.id is "{0}" and type.short is "img" and name in ({1})'.format(
+					task['parent']['id'], ', '.join('"{0}"'.format(name) for name in set(names))
+				)):
+					assets[asset['name']] = asset
+				
+				versions = []
+				for outputFile, name in zip(outputFiles, names):
+					if name not in assets:
+						assets[name] = session.create('Asset', {'name': name, 'type': assetType, 'parent': task['parent']})
+					data = {'asset': assets[name], 'task': task}
+					if userId:
+						data['user_id'] = userId
+					version = session.create('AssetVersion', data)
+					versions.append((outputFile, version['id']))
+				
+				status = self.statusRegistry().status(task['project_id'], self.publishedStatus)
+				if status is None:
+					self.logger.warning('Status {0!r} does not exist for task {1}.'.format(self.publishedStatus, taskId))
+				else:
+					# Registry entities belong to the registry's session.
+					task['status'] = session.get('Status', status['id'])
+				session.commit()
+			except Exception:
+				session.rollback()
+				raise
+		return versions
+	
+	def statusRegistry(self):
+		# Only called inside the shared session block, whose lock keeps two threads from creating it.
+		if self._statuses is None:
+			self._statuses = StatusRegistry(sessionProvider.createSession())
+		return self._statuses
+	
+	def selectedFiles(self, values):
+		# The files picked in the form. Multi-select enumerators return a list.
+		selected = values.get('output_file') or []
+		if not isinstance(selected, list):
+			selected = [selected]
+		return [each for each in selected if each]
+		
+	@instrument.entryPoint('outputManager.launch')
 	def launch(self, event):
 		selection = event['data'].get('selection', [])
-		session = ftrack_api.Session()
 			
-		# If the event dictionary has a 'data' entry, check to see if there is a file to process.
+		# If the event dictionary has a 'data' entry, check to see if there are files to process.
 		if 'values' in event['data'] and len(event['data']['values']) > 0:
 			values = event['data']['values']
+			outFiles = self.selectedFiles(values)
 			
-			# If there is a file, process it.
-			if values['output_file'] != '':
-				outFile = values['output_file']
-				outPath = self.projectsAccessor.getFilesystemPath(self.outputPath)
-				self.processAsset(outPath, outFile)
-				
-				# Update the status.			
-				statuses = self.project.getTaskStatuses()
-				self.task.setStatus(statuses[2])
-				
-			# If there isn't a file, nothing was selected on the previous menu.
+			# If nothing was selected on the previous menu, there is nothing to do.
+			if not outFiles:
+				return { 'items': [{ 'type': 'label', 'value': 'None selected.' }] }
+			
+			# The form was built for this user and selection by an earlier launch.
+			state = self.launches.pop(event)
+			if state is None:
+				return { 'items': [{ 'type': 'label', 'value': 'This form has expired, please launch Output Manager again.' }] }
+			
+			# Create every asset and version and set the status in one transaction, then queue the uploads.
+			outPath = state['outputFolder']
+			taskId = state['taskId']
+			summary = []
+			try:
+				versions = self.createVersions(taskId, outFiles, event['source'].get('user', {}).get('id'))
+			except Exception as error:
+				self.logger.exception('Failed to create versions.')
+				summary = ['{0}: failed to create version ({1})'.format(outFile, error) for outFile in outFiles]
 			else:
-				values['output_file'] = 'None selected.'
+				for outFile, versionId in versions:
+					self.uploads.submit({'taskId': taskId, 'versionId': versionId, 'outputPath': outPath, 'outputFile': outFile}, label=outFile)
+					summary.append('{0}: queued for upload'.format(outFile))
+			
 			return {
 				'items': [
 					{ 
 						'type': 'label',
-						'value': 'Currently uploading:'
+						'value': 'Publishing {0} file(s):'.format(len(outFiles))
 					},
 					{ 
-						'type': 'label',
-						'value': values['output_file']
+						'type': 'textarea',
+						'label': 'Files',
+						'value': '\n'.join(summary)
 					},
 					{ 
 						'type': 'label',
 						'value': 'This may take a few minutes.'
+					},
+					{ 
+						'type': 'label',
+						'value': self.queueSummary()
 					}
 				]
 			}			
@@ -92,62 +261,27 @@ class OutputManager(object):
 		if not self.validateSelection(selection):
 			return
 				
-		# Get the task and use its parents to create path variables.
-		self.task = ftrack.Task(selection[0]['entityId'])
-		self.project = self.task.getProject()
+		# Resolve the task's shot folder. The legacy task is only fetched once there is something to publish.
+		taskId = selection[0]['entityId']
 		
-		task_api = session.query('Task where id is {}'.format(selection[0]['entityId']))[0]	
-		project_api = session.query('Project where id is {}'.format(task_api['project_id']))[0];
+		try:
+			context = resolver.resolve(taskId, self.projectRoot)
+		except ShotPathError as error:
+			return { 'items': [{ 'type': 'label', 'value': str(error) }] }
 		
-		if self.task.get('objecttypename') == 'Shot':
-			shot = self.task.getName()
-			
-		for each in self.task.getParents():
-			try:
-				objectType = each.get('objecttypename')
-				if objectType == 'Shot':
-					shot = each.getName()
-				if objectType == 'Act' or objectType == 'Sequence':
-					act = each.getName()
-				if objectType == 'Episode':
-					episode = each.getName()
-			except:
-				objectType = each.get('entityType')
-				if objectType == 'show':
-					show = each.getName()
-					showShort = project_api['custom_attributes']['proj']
-					
-		# Create variables for the old file structure and new file structure.
-		try:			
-			pathVersionA = '{0}{1}/{2}/shots/{3}{4}_{5}_{6}'.format(self.projectRoot, show, episode, showShort, episode, act, shot)
-			pathVersionB = '{0}{1}/episodes/{2}/shots/{3}{4}_{5}_{6}'.format(self.projectRoot, show, episode, showShort, episode, act, shot)
-		except:
-			return { 'items': [{ 'type': 'label', 'value': 'Not enough variables to map current project.' }] }
-
-		# Create disk accessors.
-		self.projectsAccessorA = ftrack.DiskAccessor(pathVersionA)
-		self.projectsAccessorB = ftrack.DiskAccessor(pathVersionB)
+		projectsAccessor = ftrack.DiskAccessor(self.projectRoot + context.shotFolder)
 		
-		# Check to see which file structure is in use and if the output folder exists.
-		if not self.projectsAccessorA.exists(self.outputPath) and not self.projectsAccessorB.exists(self.outputPath):
-			return { 'items': [{ 'type': 'label', 'value': 'Output folder does exist' }] }
-		else:
-			if self.projectsAccessorA.exists(self.outputPath) and not self.projectsAccessorB.exists(self.outputPath):
-				self.projectsAccessor = ftrack.DiskAccessor(pathVersionA)
-			if not self.projectsAccessorA.exists(self.outputPath) and self.projectsAccessorB.exists(self.outputPath):
-				self.projectsAccessor = ftrack.DiskAccessor(pathVersionB)
-		
-		# Generate a list of files in the out folder and use it to generate an enum.
-		filePaths = self.projectsAccessor.list(self.outputPath)
-		outputList = []
-
-		for item in filePaths:
-			pathList = item.split("\\")
-			outputList.append(pathList[-1])
+		# Scan the out folder, collapsing frames into sequences, and use it to generate an enum.
+		# The listing is cached and the folder kept warm for the next click.
+		outputFolder = projectsAccessor.getFilesystemPath(self.outputPath)
+		self.launches.put(event, { 'taskId': taskId, 'outputFolder': outputFolder })
+		with instrument.phase(instrument.SCAN):
+			outputList = listings.get(outputFolder)
+		listings.watch(outputFolder)
 		
 		outputPreviewList = []
-		for file in outputList:
-			outputPreviewList.append( { 'label' : file, 'value' : file } )
+		for entry in outputList:
+			outputPreviewList.append( { 'label' : entry.label, 'value' : entry.value } )
 							
 		return {
 			'items': [
@@ -157,40 +291,72 @@ class OutputManager(object):
 				},
 				{
 					'type': 'label',
-					'value': 'Current shot: {0}'.format(showShort + episode + '_' + act + '_' + shot)
+					'value': 'Current shot: {0}'.format(context.shotName)
 				},
 				{
-					'label': 'Output file',
+					'label': 'Output files',
 					'type': 'enumerator',
 					'name': 'output_file',
+					'multi_select': True,
 					'data': outputPreviewList
-				} 
+				},
+				{
+					'type': 'label',
+					'value': self.queueSummary()
+				},
+				{
+					'type': 'textarea',
+					'label': 'Uploads for this task:',
+					'value': '\n'.join(self.uploadStatus(taskId))
+				}
 			]
 		}
+	
+	def uploadStatus(self, taskId=None):
+		# One line per upload job, newest first, optionally only for one task.
+		match = None
+		if taskId is not None:
+			match = lambda payload: payload.get('taskId') == taskId
+		lines = []
+		for job in sorted(self.uploads.jobs(match=match), key=lambda job: job['created'], reverse=True):
+			line = '{0}: {1}'.format(job['label'], job['status'])
+			if job['error']:
+				line += ' ({0}, attempt {1})'.format(job['error'], job['attempts'])
+			lines.append(line)
+		return lines
+	
+	def queueSummary(self):
+		counts = self.uploads.counts()
+		return 'Upload queue: {0} queued, {1} running, {2} done, {3} failed.'.format(
+			counts['queued'], counts['running'], counts['done'], counts['failed']
+		)
 				
+	@instrument.entryPoint('outputManager.discover')
 	def discover(self, event):
 		# If the selection is a task, reveal the action button.
 		selection = event['data'].get('selection', [])
 		if self.validateSelection(selection):
 			return { 'items': [{ 'label': 'Output Manager', 'actionIdentifier': self.identifier }] }
 		
+	def start(self):
+		# Resume any uploads left from the last session.
+		self.uploads.start()
+	
 	def register(self):
-		# Register the class with Ftrack.
+		# Register the class with Ftrack for the current user.
+		self.start()
+		instrument.serveMetrics()
 		ftrack.EVENT_HUB.subscribe('topic=ftrack.action.discover and source.user.username={0}'.format(getpass.getuser()), self.discover)
 		ftrack.EVENT_HUB.subscribe('topic=ftrack.action.launch and source.user.username={0} and data.actionIdentifier={1}'.format(getpass.getuser(),self.identifier), self.launch)
 	
 	def validateSelection(self, selection):
-		# Check to see that our selection is a task.
-		entityType = selection[0]['entityType']
-
-		if len(selection) == 1 and entityType == 'task':
-			taskName = ftrack.Task(selection[0]['entityId']).getName()
-			if taskName == 'Compositing' or taskName == 'animation':
-				return True
-			else:
-				return False
-		else:
+		# Check to see that our selection is a single task, without asking the server.
+		ids = taskIds(selection, single=True)
+		if ids is None:
 			return False
+		
+		# Check to see that the task is a Compositing task. The name is shared with the other hooks.
+		return selections.names(ids)[0] in self.taskNames
 
 def register(session, **kw):
 	logger = logging.getLogger(
@@ -207,8 +373,3 @@ def register(session, **kw):
 		return
 	outputManager = OutputManager()
 	outputManager.register()
-
-def writeLog(string, type = 'a'):
-	log = open('W:/pipeline/ftrack/log/outputLog.txt', type)
-	log.write(string + '\n')
-	log.close()
\ No newline at end of file
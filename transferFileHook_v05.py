@@ -6,33 +6,116 @@ Scans a project's OUT directory for files.
 User can select a file to copy to the TRANSFER folder.
 Updates the task to APPROVED.
 Sends emails to the Assistant Editor(AE), the artist, and the supervisor.
+
+Several Compositing tasks can be selected at once. Their shots are resolved
+together, the copies share the transfer pool, the statuses are written in a
+single commit and each AE gets one email listing everything delivered.
 '''
 
 import sys
+import errno
 import logging
 import os
 import threading
+import time
 import getpass
 import ftrack
 import ftrack_api
 
-sys.path.append('C:\Python27\Lib')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# smtplib for the notifier.
+sys.path.append(r'C:\Python27\Lib')
+
+from hookLib import copyEngine
+from hookLib import executor
+from hookLib import instrument
+from hookLib import sequenceScanner
+from hookLib.launchStore import LaunchStore
+from hookLib.listingCache import listings
+from hookLib.notifier import Notifier
+from hookLib.selectionInfo import selections, taskIds
+from hookLib.shotPaths import resolver, ShotContext, ShotPathError
+from hookLib.statusRegistry import StatusRegistry
+from hookLib import sessionProvider
+from hookLib.transferManifest import TransferManifest
+
+# Count the legacy API's round trips in the trace log.
+instrument.countLegacyApi(ftrack)
+
+# Transfers running at once, and the shots probed and listed in parallel when the form is built.
+# The files of each transfer are copied on the shared io-copy pool.
+transferPool = executor.pool('transfer')
+resolvePool = executor.pool('resolve')
+
+# Task names the action is offered for.
+TASK_NAMES = ('Compositing', 'animation')
+
+def idList(ids):
+	# Format ids for an "in (...)" query clause.
+	return ', '.join('"{0}"'.format(each) for each in ids)
 
-import smtplib
+def fullName(user):
+	name = ' '.join(part for part in (user.get('first_name'), user.get('last_name')) if part)
+	return name or user.get('username')
 
-# Allows for multiple threads when copying files.
-# Prevents script from failing due to timeout.
-def async(fn):
-	def wrapper(*args, **kwargs):
-		thread = threading.Thread(target=fn, args=args, kwargs=kwargs)
-		thread.start()
-	return wrapper
+def splitList(value):
+	# Project attributes hold comma separated names and addresses.
+	return [each.strip() for each in (value or '').split(',') if each.strip()]
+
+class TransferBatch(object):
+	'''
+	Waits for the transfers started by one launch and hands the shots that
+	arrived to a callback once the last one has finished. The callback only
+	fires after seal, so transfers finishing while later ones are still
+	being added cannot end the batch early.
+	'''
+
+	def __init__(self, callback):
+		super(TransferBatch, self).__init__()
+		self.callback = callback
+		self.delivered = []
+		self.failed = []
+		self._lock = threading.Lock()
+		self._pending = 0
+		self._sealed = False
+		self._called = False
+
+	def add(self, shot, future):
+		with self._lock:
+			self._pending += 1
+		future.add_done_callback(lambda future: self._finished(shot, future))
+
+	def seal(self):
+		# Every transfer has been added.
+		with self._lock:
+			self._sealed = True
+		self._callIfDone()
+
+	def _finished(self, shot, future):
+		with self._lock:
+			if future.exception() is None:
+				self.delivered.append(shot)
+			else:
+				self.failed.append((shot, future.exception()))
+			self._pending -= 1
+		self._callIfDone()
+
+	def _callIfDone(self):
+		with self._lock:
+			done = self._sealed and self._pending == 0 and not self._called
+			if done:
+				self._called = True
+		if done:
+			self.callback(self)
 
 class TransferFile(object):
 	identifier = 'sde_transferFile'
 	source_root = 'Z:/projects/'
 	destination_root = 'Y:/'
 	
+	# Status the task is set to once its transfer has arrived, looked up by name in the project's workflow.
+	transferredStatus = 'Approved'
+	
 	def __init__(self):
 		super(TransferFile, self).__init__()
 		
@@ -41,9 +124,15 @@ class TransferFile(object):
 		if self.identifier is None:
 			raise ValueError('The action must be given an identifier.')
 		
+		# The shots of every open form, per user and selection, until it is submitted.
+		self.launches = LaunchStore('transferFile')
+		
+		# Created on first use, see statusRegistry.
+		self._statuses = None
+	
+	@instrument.entryPoint('transferFile.launch')
 	def launch(self, event):
 		selection = event['data'].get('selection', [])
-		session = ftrack_api.Session()
 		
 		# Create disk accessors.
 		sourceAccessor = ftrack.DiskAccessor(self.source_root)
@@ -53,280 +142,320 @@ class TransferFile(object):
 		# If there are no keys in values, restart the loop.
 		if 'values' in event['data'] and len(event['data']['values']) > 0:
 			values = event['data']['values']
+			sync = values.get('sync', True) not in (False, 'false', 'False')
 			
-			#If there is a selected file, process it.
-			if values['transfer_file'] != '':
-				finalFile = values['transfer_file']
-				finalSource = '{0}\\{1}'.format(sourceAccessor.getFilesystemPath(self.sourcePath), finalFile)
-				finalDestination = destinationAccessor.getFilesystemPath(self.destinationPath)
+			# The form was built for this user and selection by an earlier launch.
+			shots = self.launches.pop(event)
+			if shots is None:
+				return { 'items': [{ 'type': 'label', 'value': 'This form has expired, please launch Transfer File again.' }] }
+			
+			# Copy every selected file. Statuses and emails are only updated once they have arrived.
+			batch = TransferBatch(self.transfersFinished)
+			transfers = []
+			for shot in shots:
+				finalFile = values.get(shot['field'], '')
+				if not finalFile:
+					continue
 				
-				#Copy the file.
-				self.copyFile(finalSource, finalDestination)
+				# A sequence expands to every frame that exists in its range.
+				pairs = []
+				for name in sequenceScanner.expand(shot['sourceFolder'], finalFile):
+					pairs.append((os.path.join(shot['sourceFolder'], name), shot['destinationFolder']))
 				
-				# Update the task status to output.
-				statuses = self.project.getTaskStatuses()
-				self.task.setStatus(statuses[4])
-
-				# Send email notifications.
-				self.sendNotification(finalDestination, finalFile)				
-			else:
-				values['output_file'] = 'None selected.'
+				delivery = dict(shot, file=finalFile)
+				batch.add(delivery, self.copyFile(pairs, finalFile, sync, event['source'].get('user', {}).get('id')))
+				transfers.append(delivery)
+			batch.seal()
 			
-			return {
-				'items': [
-					{ 
-						'type': 'label',
-						'value': 'Copying file:'
-					},
-					{ 
-						'type': 'label',
-						'value': 'File: ' + values['transfer_file']
-					},
-					{ 
-						'type': 'label',
-						'value': 'Destination: ' + self.destinationPath
-					}
-				]
-			}
+			items = [{ 'type': 'label', 'value': 'Copying file:' }]
+			for delivery in transfers:
+				items.append({ 'type': 'label', 'value': 'File: ' + sequenceScanner.displayLabel(delivery['file']) })
+				items.append({ 'type': 'label', 'value': 'Destination: ' + delivery['destinationFolder'] })
+			if not transfers:
+				items.append({ 'type': 'label', 'value': 'None selected.' })
+			items.append({ 'type': 'label', 'value': 'Progress and the result of the copy are shown in the Jobs list.' })
+			return { 'items': items }
 
 		# Validate selection and abort if not valid.
 		if not self.validateSelection(selection):
 			return
 		
-		# Clear any pre-existing variables.
-		self.sourcePath = ''
-		self.destinationPath = ''
-		self.contactDictionary = {}
-		
-		# Retrieve our variables for the current task.
-		self.task = ftrack.Task(selection[0]['entityId'])
-		self.project = self.task.getProject();
+		shots = []
+		taskIds = [entity['entityId'] for entity in selection]
 		
-		# Use the newer API to access custom attributes.
-		self.task_api = session.query('Task where id is {}'.format(selection[0]['entityId']))[0]	
-		project_api = session.query('Project where id is {}'.format(self.task_api['project_id']))[0];
+		# Resolve every shot, its folders and the project's custom attributes with one query,
+		# probing the folders in parallel. The contacts of all tasks take two more queries.
+		contexts = resolver.resolveMany(taskIds, self.source_root, pool=resolvePool)
+		with sessionProvider.session() as session:
+			contacts = self.taskContacts(session, taskIds)
 		
-		# Retrieve names and email addresses
-		name = project_api['custom_attributes']['ae_name']
-		address = project_api['custom_attributes']['ae_address']
-		
-		aeList = []
-		aeEmailList = []
-		
-		if "," in name:
-			aeList = name.split(',')
-			aeEmailList = address.split(',')
-		else:
-			aeList.append(name)
-			aeEmailList.append(address)
-		
-		# The assigned artists.
-		assignees = self.task.getUsers()
-		
-		assigneeList = []
-		assigneeEmailList = []
-		for each in assignees:
-			assigneeList.append(each.getName())
-			assigneeEmailList.append(each.getEmail())
-		
-		# The managers
-		managers = self.task.getManagers()
-		
-		managerList = []
-		managerEmailList = []
-		for each in managers:
-			manager = each.getUser()
-			managerList.append(manager.getName())
-			managerEmailList.append(manager.getEmail())
-		
-		
-		self.contactDictionary = {
-			'manager': managerList, 
-			'managerEmail' : managerEmailList, 
-			'assignee': assigneeList, 
-			'assigneeEmail': assigneeEmailList, 
-			'ae': aeList, 
-			'aeEmail' : aeEmailList }
-		
-		# If our task is a shot, store its name.
-		if self.task.get('objecttypename') == 'Shot':
-			shot = self.task.getName()
+		items = [{ 'type': 'label', 'value': 'Transfers a file to the editorial server.' }]
+		errors = []
+		for taskId in taskIds:
+			context = contexts.get(taskId)
+			if not isinstance(context, ShotContext):
+				errors.append(str(context or ShotPathError('Task {0} does not exist.'.format(taskId))))
+				continue
 			
-		# Find the parents of the current task.
-		parents = self.task.getParents()
-		
-		for each in self.task.getParents():
-			try:
-				objectType = each.get('objecttypename')
-				if objectType == 'Shot':
-					shot = each.getName()
-				if objectType == 'Act' or objectType == 'Sequence':
-					act = each.getName()
-				if objectType == 'Episode':
-					episode = each.getName()
-			except:
-				objectType = each.get('entityType')
-				if objectType == 'show':
-					show = each.getName()
-					showShort = project_api['custom_attributes']['proj']
-					
-		# Create variables for the old file structure and new file structure.
-		try:		
-			sourcePathVersionA = '{}/{}/shots/{}{}_{}_{}/out/'.format(show, episode, showShort, episode, act, shot)
-			sourcePathVersionB = '{}/episodes/{}/shots/{}{}_{}_{}/out/'.format(show, episode, showShort, episode, act, shot)
-			self.destinationPath = '{0}/{1}/vfx_for_editorial/{2}/'.format(show, episode, act)
-		except:
-			return { 'items': [{ 'type': 'label', 'value': 'Not enough variables to map current project.' }] }
-
-		# Check to see which file structure is in use and if the output folder exists.
-		if not sourceAccessor.exists(sourcePathVersionA) and not sourceAccessor.exists(sourcePathVersionB):
-			return { 'items': [{ 'type': 'label', 'value': 'Output folder does exist' }] }
-		else:
-			if sourceAccessor.exists(sourcePathVersionA) and not sourceAccessor.exists(sourcePathVersionB):
-				self.sourcePath = sourcePathVersionA
-			if not sourceAccessor.exists(sourcePathVersionA) and sourceAccessor.exists(sourcePathVersionB):
-				self.sourcePath = sourcePathVersionB
-		
-		# Generate lists of files.
-		sourceListPath = sourceAccessor.list(self.sourcePath)
-		destinationListPath = destinationAccessor.list(self.destinationPath)
+			# Retrieve names and email addresses
+			shot = {
+				'taskId': taskId,
+				'shotName': context.shotName,
+				'field': 'transfer_file_{0}'.format(len(shots)),
+				'sourceFolder': sourceAccessor.getFilesystemPath(context.outFolder),
+				'destinationFolder': destinationAccessor.getFilesystemPath(context.destinationFolder),
+				'ae': splitList(context.projectAttributes.get('ae_name')),
+				'aeEmail': splitList(context.projectAttributes.get('ae_address'))
+			}
+			shot.update(contacts.get(taskId, {}))
+			shots.append(shot)
 		
-		sourceList = self.cleanPath(sourceListPath)
-		destinationString = '\n'.join(self.cleanPath(destinationListPath))
+		if not shots:
+			return { 'items': [{ 'type': 'label', 'value': error } for error in errors] }
 		
-		enumeratorList = []
-		for file in sourceList:
-			enumeratorList.append( { 'label' : file, 'value' : file } )
+		# Generate lists of files, collapsing frames into sequences.
+		# Listings are cached and every folder kept warm for the next click.
+		folders = []
+		for shot in shots:
+			for folder in (shot['sourceFolder'], shot['destinationFolder']):
+				if folder not in folders:
+					folders.append(folder)
+		with instrument.phase(instrument.SCAN):
+			listed = dict(zip(folders, [future.result() for future in resolvePool.map(listings.get, folders)]))
+		for folder in folders:
+			listings.watch(folder)
 		
-		return {
-			'items': [
-				{
-					'type': 'label',
-					'value': 'Transfers a file to the editorial server. WARNING: Currently overwrites existing files!'
-				},
+		for shot in shots:
+			enumeratorList = []
+			for entry in listed[shot['sourceFolder']]:
+				enumeratorList.append( { 'label' : entry.label, 'value' : entry.value } )
+			
+			items.extend([
 				{
 					'type': 'label',
-					'value': 'Current shot: {0}'.format(showShort + episode + '_' + act + '_' + shot)
+					'value': 'Current shot: {0}'.format(shot['shotName'])
 				},
 				{
 					'label': 'File',
 					'type': 'enumerator',
-					'name': 'transfer_file',
+					'name': shot['field'],
 					'data': enumeratorList
 				},
 				{
 					'type': 'label',
-					'value': ''
-				},
-				{
-					'type': 'label',
-					'value': 'Destination: {0}'.format(destinationAccessor.getFilesystemPath(self.destinationPath))
-				},
-				{
+					'value': 'Destination: {0}'.format(shot['destinationFolder'])
+				}
+			])
+			if len(shots) == 1:
+				items.append({
 					'type': 'textarea',
 					'label': 'Transfer folder:',
-					'value': destinationString
-				},
-				{
-					'type': 'label',
-					'value': ''
-				},
-				{
-					'type': 'label',
-					'value': 'Notification send to assistant editors: {0}'.format(' and '.join(aeList))
-				},
-				{
-					'type': 'label',
-					'value': 'Copies sent to artist(s) and supervisor(s): {0}'.format(' and '.join(assigneeList + managerList))
-				}
-			]
-		}
+					'value': '\n'.join(entry.label for entry in listed[shot['destinationFolder']])
+				})
+			items.append({ 'type': 'label', 'value': '' })
+		
+		aeList = []
+		copyList = []
+		for shot in shots:
+			aeList.extend(name for name in shot['ae'] if name not in aeList)
+			copyList.extend(name for name in shot['assignee'] + shot['manager'] if name not in copyList)
+		
+		items.extend([
+			{
+				'label': 'Only copy new or changed files',
+				'type': 'boolean',
+				'name': 'sync',
+				'value': True
+			},
+			{
+				'type': 'label',
+				'value': 'Notification send to assistant editors: {0}'.format(' and '.join(aeList))
+			},
+			{
+				'type': 'label',
+				'value': 'Copies sent to artist(s) and supervisor(s): {0}'.format(' and '.join(copyList))
+			}
+		])
+		for error in errors:
+			items.append({ 'type': 'label', 'value': 'Skipped: {0}'.format(error) })
+		self.launches.put(event, shots)
+		return { 'items': items }
+	
+	def taskContacts(self, session, taskIds):
+		# The assigned artists and the managers of every task, fetched in two queries.
+		contacts = dict((taskId, { 'assignee': [], 'assigneeEmail': [], 'manager': [], 'managerEmail': [] }) for taskId in taskIds)
 		
-	@async
-	def copyFile(self, finalSource, finalDestination):
-		command = os.system ("""xcopy /Y {0} {1} """.format(finalSource, finalDestination))
+		assignments = session.query(
+			'select context_id, resource.first_name, resource.last_name, resource.username, resource.email '
+			'from Appointment where type is "assignment" and context_id in ({0})'.format(idList(taskIds))
+		)
+		for assignment in assignments:
+			user = assignment['resource']
+			if user.get('email') is None:
+				# Groups can be assigned too but have no address.
+				continue
+			contacts[assignment['context_id']]['assignee'].append(fullName(user))
+			contacts[assignment['context_id']]['assigneeEmail'].append(user['email'])
+		
+		managers = session.query(
+			'select context_id, user.first_name, user.last_name, user.username, user.email '
+			'from Manager where context_id in ({0})'.format(idList(taskIds))
+		)
+		for manager in managers:
+			user = manager['user']
+			contacts[manager['context_id']]['manager'].append(fullName(user))
+			contacts[manager['context_id']]['managerEmail'].append(user['email'])
+		return contacts
+		
+	def copyFile(self, pairs, finalFile, sync=True, userId=None):
+		# Queue the copy of (source, destination folder) pairs and return a future for its results.
+		# The job is shown to userId if given, otherwise to the API user.
+		user = ftrack.User(userId) if userId else None
+		job = ftrack.createJob('Transferring {0}'.format(finalFile), 'queued', user=user)
+		return transferPool.submit(self.runCopy, job, pairs, finalFile, sync)
+	
+	@instrument.entryPoint('transferFile.copy')
+	def runCopy(self, job, pairs, finalFile, sync=True):
+		# Copies the files and reports progress and the outcome through an Ftrack job.
+		# Every file is hashed as it is copied and recorded in the destination manifest, see verifyDelivery_v01.py.
+		# In sync mode the manifest is also used to skip unchanged files and resume interrupted ones.
+		job.setStatus('running')
+		if not pairs:
+			job.set('description', 'Transfer of {0} failed: no files found'.format(finalFile))
+			job.setStatus('failed')
+			raise copyEngine.CopyError('No files found for {0}.'.format(finalFile))
+		folder = pairs[0][1]
+		try:
+			os.makedirs(folder)
+		except OSError as error:
+			# Another shot of the same act may have created it first.
+			if error.errno != errno.EEXIST:
+				raise
+		manifest = TransferManifest.load(folder)
+		lastReport = [0]
+		
+		def report(progress):
+			now = time.time()
+			if now - lastReport[0] > 2:
+				lastReport[0] = now
+				job.set('description', 'Transferring {0}: {1:.0%}'.format(finalFile, progress.fraction()))
+		
+		instrument.annotate(file=finalFile, files=len(pairs))
+		with instrument.phase(instrument.COPY):
+			results, failures = copyEngine.copyFiles(pairs, progress=report, manifest=manifest, skipUnchanged=sync)
+		if failures:
+			job.set('description', 'Transfer of {0} failed: {1}'.format(finalFile, failures[0][1]))
+			job.setStatus('failed')
+			raise copyEngine.CopyError('{0} of {1} files failed to copy.'.format(len(failures), len(pairs)))
+		
+		skipped = len([result for result in results if result.get('skipped')])
+		job.set('description', 'Transferred {0}: {1} copied, {2} unchanged'.format(finalFile, len(results) - skipped, skipped))
+		listings.refreshLater(folder)
+		job.setStatus('done')
+		return results
+	
+	@instrument.entryPoint('transferFile.finished')
+	def transfersFinished(self, batch):
+		# Update the statuses of every delivered task in one commit and notify everyone once.
+		for shot, error in batch.failed:
+			self.logger.error('Transfer of {0} failed: {1}'.format(shot['file'], error))
+		if not batch.delivered:
+			return
+		try:
+			self.setTransferred([shot['taskId'] for shot in batch.delivered])
+		except Exception:
+			self.logger.exception('Failed to update the status of the transferred tasks.')
+		self.sendNotification(batch.delivered)
 	
-	# Optimizes paths for Python.
-	def cleanPath(self, pathList):
-		output = []
-		for each in pathList:
-			cleanList = each.split('/')
-			output.append(cleanList[-1])
-		return output
+	def setTransferred(self, taskIds):
+		# Tasks whose workflow has no transferredStatus are left alone.
+		with sessionProvider.session() as session:
+			try:
+				for task in session.query('select project_id from Task where id in ({0})'.format(idList(taskIds))):
+					status = self.statusRegistry().status(task['project_id'], self.transferredStatus)
+					if status is None:
+						self.logger.warning('Status {0!r} does not exist for task {1}.'.format(self.transferredStatus, task['id']))
+						continue
+					# Registry entities belong to the registry's session.
+					task['status'] = session.get('Status', status['id'])
+				session.commit()
+			except Exception:
+				session.rollback()
+				raise
+	
+	def statusRegistry(self):
+		# Only called inside the shared session block, whose lock keeps two threads from creating it.
+		if self._statuses is None:
+			self._statuses = StatusRegistry(sessionProvider.createSession())
+		return self._statuses
 	
 	# Allows Ftrack to see the plug-in
+	@instrument.entryPoint('transferFile.discover')
 	def discover(self, event):
 		selection = event['data'].get('selection', [])
 		if self.validateSelection(selection):
 			return { 'items': [{ 'label': 'Transfer File', 'actionIdentifier': self.identifier }] }
 		
+	def start(self):
+		# Send any notifications left from the last session.
+		notifier.start()
+	
 	def register(self):
+		self.start()
+		instrument.serveMetrics()
 		ftrack.EVENT_HUB.subscribe('topic=ftrack.action.discover and source.user.username={0}'.format(getpass.getuser()), self.discover)
 		ftrack.EVENT_HUB.subscribe('topic=ftrack.action.launch and source.user.username={0} and data.actionIdentifier={1}'.format(getpass.getuser(),self.identifier), self.launch)
 		
 		
 	def validateSelection(self, selection):
-		# Check to see that our selection is a task.
-		entityType = selection[0]['entityType']
-		
-		# Check to see that the task is a Compositing task.
-		if len(selection) == 1 and entityType == 'task':
-			taskName = ftrack.Task(selection[0]['entityId']).getName()
-			if taskName == 'Compositing' or taskName == 'animation':
-				return True
-			else:
-				return False
-		else:
+		# Check to see that our selection is made of tasks, without asking the server.
+		ids = taskIds(selection)
+		if ids is None:
 			return False
+		
+		# Check to see that every task is a Compositing task, with one shared lookup.
+		return all(name in TASK_NAMES for name in selections.names(ids))
 	
-	# Creates a notification email.
-	def sendNotification(self, finalDestination, finalFile):		
-		if self.contactDictionary.get('ae') == 'None' or self.contactDictionary.get('aeEmail') == 'None':
-			return
-		else:
-			aeName = ' and '.join(self.contactDictionary.get('ae'))
-			assigneeName = ' or '.join(self.contactDictionary.get('assignee'))
-			fromAddr = 'vfxsde@gmail.com'
-			toAddr = self.contactDictionary.get('aeEmail')
-			ccAddr = self.contactDictionary.get('assigneeEmail') + self.contactDictionary.get('managerEmail')
-			subject = 'SDE VFX update: '+ finalFile +' has been transferred.'
-			message = 'Dear '+ aeName +',\n\n' \
-					  'Just wanted you to know that "'+ finalFile +'" has been moved to the transfer server.\n' \
-					  'You can find it at:\n\n' \
-					  ''+ finalDestination +'\n\n' \
-					  'Contact '+ assigneeName +' if you have any questions.\n\n' \
-					  'Your pal,\n' \
-					  '- SDE VFX\'s automated response system'
-			login = 'vfxsde'
-			password = 'lisaBrundt'
-			sendemail(from_addr = fromAddr,
-					  to_addr_list = toAddr,
-					  cc_addr_list = ccAddr,
-					  subject = subject,
-					  message = message,
-					  login = login,
-					  password = password)
+	# Queues a notification for each assistant editor. Transfers arriving close together are sent as one email.
+	def sendNotification(self, delivered):
+		for shot in delivered:
+			for name, address in zip(shot['ae'], shot['aeEmail']):
+				if name == 'None' or address == 'None':
+					continue
+				item = {
+					'name': name,
+					'file': shot['file'],
+					'destination': shot['destinationFolder'],
+					'assignees': shot['assignee']
+				}
+				notifier.notify(address, item, cc=shot['assigneeEmail'] + shot['managerEmail'])
 
-# Sends the notification email.
-@async					  
-def sendemail(from_addr, to_addr_list, cc_addr_list,
-			  subject, message,
-			  login, password,
-			  smtpserver='smtp.gmail.com:587'):
-	header  = 'From: %s\n' % from_addr
-	header += 'To: %s\n' % ','.join(to_addr_list)
-	header += 'Cc: %s\n' % ','.join(cc_addr_list)
-	header += 'Subject: %s\n\n' % subject
-	message = header + message
+# Writes the notification email for the transfers collected for one assistant editor.
+def composeEmail(items):
+	assigneeNames = []
+	for item in items:
+		assigneeNames.extend(name for name in item['assignees'] if name not in assigneeNames)
 	
-	send_to = to_addr_list + cc_addr_list
-	
-	server = smtplib.SMTP(smtpserver)
-	server.starttls()
-	server.login(login,password)
-	problems = server.sendmail(from_addr, send_to, message)
+	if len(items) == 1:
+		subject = 'SDE VFX update: '+ sequenceScanner.displayLabel(items[0]['file']) +' has been transferred.'
+		intro = 'Just wanted you to know that "'+ sequenceScanner.displayLabel(items[0]['file']) +'" has been moved to the transfer server.\n' \
+				'You can find it at:\n\n' \
+				''+ items[0]['destination'] +'\n\n'
+	else:
+		subject = 'SDE VFX update: {0} files have been transferred.'.format(len(items))
+		intro = 'Just wanted you to know that these files have been moved to the transfer server:\n\n'
+		for item in items:
+			intro += '"'+ sequenceScanner.displayLabel(item['file']) +'" in '+ item['destination'] +'\n'
+		intro += '\n'
+	message = 'Dear '+ items[0]['name'] +',\n\n' \
+			  + intro + \
+			  'Contact '+ ' or '.join(assigneeNames) +' if you have any questions.\n\n' \
+			  'Your pal,\n' \
+			  '- SDE VFX\'s automated response system'
+	return subject, message
 
-	server.quit()
+# Sends the notification emails. SMTP settings come from hookLib.notifier.loadConfig.
+notifier = Notifier('notify', composeEmail)
 
 def register(session, **kw):
 	logger = logging.getLogger(
@@ -343,8 +472,3 @@ def register(session, **kw):
 		return
 	transferFile = TransferFile()
 	transferFile.register()
-	
-def writeLog(string, type = 'a'):
-	log = open('W:/pipeline/ftrack/log/transferFileLog.txt', type)
-	log.write(string + '\n')
-	log.close()
\ No newline at end of file
@@ -0,0 +1,67 @@
+'''
+Checks that delivered files are still what Transfer File copied.
+
+Every transfer folder holds a manifest with the digest of each file, made
+while it was copied. This hashes the files again, in parallel through
+memory mapped reads, and lists those that are missing, changed size or no
+longer match. Files in the folder that the manifest does not know are listed
+too. Exits with 1 if anything was found.
+
+	python verifyDelivery_v01.py Y:/project/001/vfx_for_editorial/A1 --workers 16
+	python verifyDelivery_v01.py Y:/project --recursive
+'''
+
+import sys
+import os
+import argparse
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from hookLib import executor
+from hookLib.copyEngine import PART_SUFFIX
+from hookLib.transferManifest import MANIFEST_NAME, TransferManifest
+
+def deliveryFolders(folders, recursive=False):
+	# The given folders, or every folder below them holding a manifest.
+	for folder in folders:
+		if not recursive:
+			yield folder
+			continue
+		for root, names, files in os.walk(folder):
+			if MANIFEST_NAME in files:
+				yield root
+
+def verifyFolder(folder, pool=None):
+	# (name, problem) pairs for one delivery folder.
+	if not os.path.exists(os.path.join(folder, MANIFEST_NAME)):
+		return [('', 'no manifest in {0}'.format(folder))]
+	manifest = TransferManifest.load(folder)
+	problems = manifest.verify(pool=pool)
+	for name in os.listdir(folder):
+		if name == MANIFEST_NAME or name.endswith(PART_SUFFIX) or name.endswith('.tmp'):
+			continue
+		if name not in manifest.files and os.path.isfile(os.path.join(folder, name)):
+			problems.append((name, 'not in the manifest'))
+	return sorted(problems)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('folders', nargs='+', help='Transfer folders to check.')
+	parser.add_argument('--recursive', action='store_true', help='Check every folder with a manifest below the given ones.')
+	parser.add_argument('--workers', type=int, default=executor.POOL_SIZES['verify'], help='Files hashed at once.')
+	arguments = parser.parse_args()
+
+	pool = executor.pool('verify', size=arguments.workers)
+	started = time.time()
+	checked = 0
+	failed = 0
+	for folder in deliveryFolders(arguments.folders, arguments.recursive):
+		problems = verifyFolder(folder, pool=pool)
+		checked += 1
+		if problems:
+			failed += 1
+			for name, problem in problems:
+				print('{0}: {1}'.format(os.path.join(folder, name), problem))
+	print('Checked {0} folder(s) in {1:.1f} seconds, {2} with problems.'.format(checked, time.time() - started, failed))
+	sys.exit(1 if failed else 0)